@@ -5,39 +5,88 @@ Author: Brian Boates
 
 Skill rank analysis functions
 """
-import os, sys, math
-import MySQLdb as mdb
-import indeed, utils
+import sys, bisect, heapq, threading
+from collections import Counter
+import numpy as np
+import indeed, utils, cache, lexicon, background, metrics
 
 def relevance(f_query, f_bkgd, termCount, x=0.6):
     """
     return: float | relevance factor computed as described on 
                     Skill Rank "About" page: R = log( f_query/f_bkgd )
     params:
-            f_bkgd: float | "frequency" of word in background
-           f_query: float | "frequency" of word in query
-         termCount: int | number of occurences of term
+            f_bkgd: float or numpy.ndarray | "frequency" of word in background
+           f_query: float or numpy.ndarray | "frequency" of word in query
+         termCount: int or numpy.ndarray | number of occurences of term
     """
-    return ( x*math.log(f_query/f_bkgd) + (1-x) ) * termCount
+    return ( x*np.log(f_query/f_bkgd) + (1-x) ) * termCount
 
 
 def bkgdGet(cur, table):
     """
-    return: dict | dictionary of bkgd terms and counts
+    return: CompactCounts | bkgd terms and counts (looked up like
+                            a dict, see compact.py)
     params:
             cur: cursor to skillrank db
           table: string | db table to retrieve
     """
-    # get all terms and counts from table
-    cur.execute("SELECT term,count FROM "+table)
-    fetch = cur.fetchall()
+    # get all terms and counts from table (n-gram tables
+    # store word ids, see background.tableLoad)
+    return background.tableLoad(cur, table)
+
+
+def scoreTerms(terms, d_bkgd, x=0.6, threshold=1, C_bkgd_avg=None):
+    """
+    Count terms in a single pass and compute the relevance of the
+    whole query vocabulary at once as numpy arrays
+    
+    return: dict, dict | term relevances and term counts (as floats)
+    params:
+          terms: list[string] | list of terms as strings
+         d_bkgd: dict or CompactCounts | bkgd terms and counts
+              x: float [0,1] | relevance scaling factor
+      threshold: int | minimum count for bkgd filtering
+     C_bkgd_avg: float | precomputed average bkgd term count (optional)
+    """
+    # get the sum and average bkgd term count
+    if C_bkgd_avg is None:
+        bkgdCounts = np.fromiter(d_bkgd.itervalues(), dtype=np.int64, count=len(d_bkgd))
+        C_bkgd_sum = float(bkgdCounts.sum())
+        C_bkgd_avg = C_bkgd_sum / float( len(d_bkgd) )
+    
+    # count every term in one pass over the terms list
+    counts = Counter(terms)
+    vocab  = counts.keys()
+    
+    # query counts for each unique term
+    C_query = np.array(counts.values(), dtype=np.float64)
     
-    # build the dictionary of terms and counts
-    d_bkgd = {}
-    for term, count in fetch:
-        d_bkgd[term] = count
+    # get the sum and average query term count
+    C_query_sum = float(len(terms))
+    C_query_avg = C_query_sum / float( len(vocab) )
     
-    return d_bkgd
+    # compute query frequency for all terms
+    f_query = C_query / C_query_avg
+    
+    # get term bkgd counts (0 if term not in bkgd)
+    C_bkgd = np.array([d_bkgd.get(term, 0) for term in vocab], dtype=np.float64)
+    
+    # compute bkgd frequency for all terms
+    f_bkgd = C_bkgd / C_bkgd_avg
+    
+    # very low bkgd counts: penalize "non-words", otherwise
+    # give an average frequency
+    for i in np.flatnonzero(C_bkgd <= threshold):
+        f_bkgd[i] = 1.0 if utils.isWord(vocab[i]) else 100.0
+    
+    # compute relevance for all terms
+    R = relevance(f_query, f_bkgd, C_query, x=x)
+    
+    # convert back to python floats for the results tuples
+    qRelevance = dict(zip(vocab, R.tolist()))
+    qCount     = dict(zip(vocab, C_query.tolist()))
+    
+    return qRelevance, qCount
 
 
 def bestBigrams(words, topWords, N=10, num=100):
@@ -50,24 +99,26 @@ def bestBigrams(words, topWords, N=10, num=100):
                N: int | number of top bigrams to retrieve
              num: int | number of initial bigrams to retrieve
     """
-    # get the top N bigrams
-    topBigrams = utils.getBigrams(words, num=num)
-    
-    # get all the bigrams
-    allBigrams = utils.getNgrams(words, N=2)
-    
-    # create bigram dictionary with actual query counts
-    dictBigram = {}
-    for b in topBigrams:
-        dictBigram[b] = allBigrams.count(b)
-    
+    # get the top collocations with their query counts
+    return selectBigrams(utils.collocations(words, num=num), topWords, N=N)
+
+
+def selectBigrams(topBigrams, topWords, N=10):
+    """
+    return: list[tuple(string,int)] | re-ranked list of top 
+                                      bigrams by query counts
+    params:
+       topBigrams: list[tuple(string,int)] | top collocations and their
+                                             query counts (see utils.collocations)
+         topWords: list[string] | list of top words as strings
+                N: int | number of top bigrams to retrieve
+    """
     # sort bigrams by the query counts
-    bResults = []
-    for key, value in sorted(dictBigram.iteritems(), key=lambda (k,v): (v,k)):
-         bResults.append( (key,str(value)) )
-    bResults = bResults[::-1]
+    bResults = [(b, str(count)) for b, count in sorted(topBigrams,
+                key=lambda (b, count): (count, b), reverse=True)]
     
     # loop until N best bigrams are found
+    topWords = set(topWords)
     nBestBigrams, i = [], 0
     while len(nBestBigrams) < N and i < len(bResults):
         
@@ -86,13 +137,14 @@ def bestBigrams(words, topWords, N=10, num=100):
     return nBestBigrams
 
 
+@metrics.timed('analyze')
 def analyze(cur, jobQuery, terms, x=0.6, nReturn=100, threshold=1):
     """
     Main analysis function to get term relevances
     
     return: list[tuple(term, relevance, count)] | "results"
     params:
-            cur: cursor to skillrank db
+            cur: cursor to skillrank db (None to use the shared bkgd index)
        jobQuery: string | jobQuery from user input
           terms: list[string] | list of terms as strings
               x: float [0,1] | relevance scaling factor
@@ -107,100 +159,73 @@ def analyze(cur, jobQuery, terms, x=0.6, nReturn=100, threshold=1):
     elif length == 2: bkgd_table = 'bkgd_bigrams'
     elif length == 3: bkgd_table = 'bkgd_trigrams'
     
-    # get the bkgd counts table
-    d_bkgd = bkgdGet(cur, bkgd_table)
-    
-    # get the sum and average bkgd term count
-    C_bkgd_sum = float(sum(d_bkgd.values()))
-    C_bkgd_max = float(max(d_bkgd.values()))
-    C_bkgd_avg = float(C_bkgd_sum) / float( len(d_bkgd) )
+    # get the bkgd counts from the shared in-memory index
+    # (or straight from the table if given a cursor)
+    with metrics.timer('bkgd'):
+        if cur is None:
+            bkgd = background.getIndex(bkgd_table).snapshot()
+            d_bkgd, C_bkgd_avg = bkgd.counts, bkgd.avg
+        else:
+            d_bkgd, C_bkgd_avg = bkgdGet(cur, bkgd_table), None
     
-    # create a unique set of terms
-    termSet = set(terms)
-    
-    # get the sum and average bkgd term count
-    C_query_sum = float(sum( [terms.count(term) for term in termSet] ))
-    C_query_max = float(max( [terms.count(term) for term in termSet] ))
-    C_query_avg = float(C_query_sum) / float( len(termSet) )
+    # compute relevances and counts for every unique term at once
+    with metrics.timer('score'):
+        qRelevance, qCount = scoreTerms(terms, d_bkgd, x=x, threshold=threshold,
+                                        C_bkgd_avg=C_bkgd_avg)
     
-    # initialize dictionaries for results
-    qRelevance, qCount = {}, {}
+    # retrieve the top collocations (with their counts)
+    with metrics.timer('collocations'):
+        collocations = utils.collocations(terms, num=100)
     
-    # loop over each word in the query (uniquely)
-    for term in termSet:
-                    
-        # compute query count for term
-        C_query = float(terms.count(term))
+    with metrics.timer('rank'):
+        return rankResults(jobQuery, qRelevance, qCount, collocations, nReturn=nReturn)
+
+
+def rankResults(jobQuery, qRelevance, qCount, collocations, nReturn=100):
+    """
+    Rank scored terms, pick the best bigrams and filter the results
     
-        # compute query frequency for term
-        f_query = C_query / C_query_avg #C_query_max #C_query_sum
-        
-        # get term bkgd count (0 if term not in bkgd)
-        try: C_bkgd = float(d_bkgd[term])
-        except KeyError: C_bkgd = 0
-        
-        # check for very low bkgd count values
-        if C_bkgd <= threshold:
-            
-            # penalize "non-words" with count < threshold (default=10)
-            if not utils.isWord(term): f_bkgd = 100.0
-            
-            # otherwise, give an average frequency
-            else: f_bkgd = 1.0
-            
-        # otherwise compute bkgd frequency
-        else: f_bkgd = C_bkgd / C_bkgd_avg
-        
-        # compute relevance
-        R = relevance(f_query, f_bkgd, C_query, x=x)
-        
-        # assign relevance to word in dictionary
-        qRelevance[term] = R
-        qCount[term]     = C_query
-    
-    # sort by relevance, build raw results list
-    results = []
-    for key, value in sorted(qRelevance.iteritems(), key=lambda (k,v): (v,k)):
-         results.append( (key, value, str(qCount[key])) )
-         
-    # reverse ordering, and only keep top "nReturn" values
-    results = results[::-1][:nReturn]
+    return: list[tuple(term, relevance, count)] | "results"
+            list[tuple(term, relevance, count)] | bigram results
+    params:
+         jobQuery: string | jobQuery from user input
+       qRelevance: dict | term relevances
+           qCount: dict | term counts
+     collocations: list[tuple(string,int)] | top collocations and their counts
+          nReturn: int | number of top words to return (default=100)
+    """
+    # top "nReturn" terms by relevance (ties by term), highest first
+    results = [(key, value, str(qCount[key])) for key, value in
+               heapq.nlargest(nReturn, qRelevance.iteritems(), key=lambda (k,v): (v,k))]
     
     # create list of top nReturn words only
     topTerms = [r[0] for r in results if (len(r[0])>1 or r[0] in ['c','r'])]
     
     # retrieve list of N best bigrams (with their counts)
-    topBigrams = bestBigrams(terms, topTerms, N=10, num=100)
-        
-    # create list of bigram words to remove from results
-    toRemove = []
-    for b in topBigrams:
-        # grab the current bigram
-        bigram = b[0].split()     
-        # concatenate individual bigram words to remove list
-        toRemove += bigram
+    topBigrams = selectBigrams(collocations, topTerms, N=10)
     
-    # only keep bigram removal words for words occuring more than once
-    toRemove = list(set( [r for r in toRemove if toRemove.count(r) > 1] ))
-    toRemove += ['statistical']
+    # only remove bigram words occuring in more than one bigram
+    bigramWords = Counter(w for b in topBigrams for w in b[0].split())
+    toRemove = set(w for w, n in bigramWords.iteritems() if n > 1)
+    toRemove.add('statistical')
     
-    # also concatenate bigram with no space
+    # also remove bigrams with no space
     for b in topBigrams:
         bigram = b[0].split()
-        toRemove += [bigram[0]+bigram[1]]
+        toRemove.add(bigram[0]+bigram[1])
         
-    # append jobQuery words to removal list
+    # add jobQuery words to removal set
     if ' ' in str(jobQuery):
         jq = jobQuery.split()
         for j in jq:
-            toRemove.append(str(j))
-            toRemove.append(str(j)+'s')
-        toRemove.append(str(jobQuery)+'s')
+            toRemove.add(str(j))
+            toRemove.add(str(j)+'s')
+        toRemove.add(str(jobQuery)+'s')
     else:
-        toRemove.append(str(jobQuery))
-        toRemove.append(str(jobQuery)+'s')
+        toRemove.add(str(jobQuery))
+        toRemove.add(str(jobQuery)+'s')
         
-    # get list of all relevances
+    # get the highest relevance left
     maxRelevance = max( [float(r[1]) for r in results if r[0] not in toRemove] )
     
     # get the best bigrams with artificial relevances (limit to top 5)
@@ -211,7 +236,7 @@ def analyze(cur, jobQuery, terms, x=0.6, nReturn=100, threshold=1):
     for i in range(len(topBigrams)):
         term, count = topBigrams[i]
         biResults.append((term, fakeRelevances[i], count))
-        toRemove += term.split()
+        toRemove.update(term.split())
         
     # perform removal of bigram and jobQuery words and normalize R
     results = [(r[0],str(r[1]/maxRelevance),str(int(float(r[2])))) \
@@ -219,20 +244,227 @@ def analyze(cur, jobQuery, terms, x=0.6, nReturn=100, threshold=1):
     
     # remove pluralities (might break other words only 
     # differing by one extra letter, probably rare/okay)
-    resultWords = [r[0] for r in results]
+    resultWords = set(r[0] for r in results)
     results = [r for r in results if r[0][:-1] not in resultWords]
     
     # remove 'ing words if stemmed word in list
-    ingRemoval = []
+    ingRemoval = set()
     for w, r, c in results:
         if w+'ing' in resultWords:
-            ingRemoval.append(w)
+            ingRemoval.add(w)
             print w, 'to be removed'
     results = [r for r in results if r[0] not in ingRemoval]
         
     return results, biResults
 
 
+def growArray(a, n):
+    """
+    return: numpy.ndarray | a, or a copy with room for at least n
+                            entries (capacity doubles, new entries 0)
+    params:
+            a: numpy.ndarray | array to grow
+            n: int | number of entries needed
+    """
+    if n <= len(a): return a
+    b = np.zeros(max(n, 2*len(a)), dtype=a.dtype)
+    b[:len(a)] = a
+    return b
+
+
+class IncrementalAnalyzer(object):
+    """
+    Running analysis of a job query. Postings are added one at a
+    time (in any order, each with its index in the url list) and
+    only their own words are counted and looked up in the bkgd;
+    the per term and per bigram arrays grow in place and add()
+    only updates the rows it touches. results() ranks the running
+    counts with the same arithmetic as analyze, so it matches a
+    full recompute over the postings in index order without going
+    back over the words already added
+    """
+    # same bigram frequency filter as utils.collocations
+    minFreq = 2
+    
+    def __init__(self, jobQuery, d_bkgd=None, C_bkgd_avg=None, x=0.6,
+                 nReturn=100, threshold=1):
+        """
+        params:
+           jobQuery: string | jobQuery from user input
+             d_bkgd: dict | bkgd word counts (default=shared bkgd index)
+         C_bkgd_avg: float | average bkgd word count (computed if not given)
+                  x: float [0,1] | relevance scaling factor
+            nReturn: int | number of top words to return
+          threshold: int | minimum count for bkgd filtering
+        """
+        # a fixed bkgd snapshot for the whole analysis
+        if d_bkgd is None:
+            bkgd = background.getIndex('bkgd_words').snapshot()
+            d_bkgd, C_bkgd_avg = bkgd.counts, bkgd.avg
+        elif C_bkgd_avg is None:
+            bkgdCounts = np.fromiter(d_bkgd.itervalues(), dtype=np.int64, count=len(d_bkgd))
+            C_bkgd_avg = float(bkgdCounts.sum()) / float( len(d_bkgd) )
+        self.jobQuery, self.d_bkgd, self.C_bkgd_avg = jobQuery, d_bkgd, C_bkgd_avg
+        self.x, self.nReturn, self.threshold = x, nReturn, threshold
+        self.stopwords = lexicon.getStopwords()
+        
+        # per term id: term, query count, bkgd frequency, collocation word filter
+        self.ids, self.vocab = {}, []
+        self.counts = np.zeros(1024, dtype=np.int64)
+        self.f_bkgd = np.zeros(1024, dtype=np.float64)
+        self.ok     = np.zeros(1024, dtype=bool)
+        
+        # per bigram id: word ids, count and whether it passes
+        # the collocation filters (kept up to date by add)
+        self.pairIds = {}
+        self.w1 = np.zeros(1024, dtype=np.int64)
+        self.w2 = np.zeros(1024, dtype=np.int64)
+        self.pairCounts = np.zeros(1024, dtype=np.int64)
+        self.eligible   = np.zeros(1024, dtype=bool)
+        
+        # postings added: sorted indices of non-empty postings and
+        # their (first, second to last, last) term ids
+        self.order, self.ends = [], {}
+        self.nTerms, self.nPostings = 0, 0
+    
+    def termId(self, term):
+        """
+        return: int | id of term (new terms are looked up in the bkgd)
+        """
+        i = self.ids.get(term)
+        if i is None:
+            i = self.ids[term] = len(self.vocab)
+            self.vocab.append(term)
+            self.counts = growArray(self.counts, i+1)
+            self.f_bkgd = growArray(self.f_bkgd, i+1)
+            self.ok     = growArray(self.ok, i+1)
+            
+            # same bkgd frequency as scoreTerms
+            C_bkgd = float(self.d_bkgd.get(term, 0))
+            if C_bkgd <= self.threshold:
+                self.f_bkgd[i] = 1.0 if utils.isWord(term) else 100.0
+            else:
+                self.f_bkgd[i] = C_bkgd / self.C_bkgd_avg
+            
+            # same word filter as utils.collocations
+            self.ok[i] = len(term) >= 3 and term.lower() not in self.stopwords
+        return i
+    
+    def pairId(self, pair):
+        """
+        return: int | id of a bigram of term ids (new bigrams start at 0)
+        """
+        k = self.pairIds.get(pair)
+        if k is None:
+            k = self.pairIds[pair] = len(self.pairIds)
+            self.w1 = growArray(self.w1, k+1)
+            self.w2 = growArray(self.w2, k+1)
+            self.pairCounts = growArray(self.pairCounts, k+1)
+            self.eligible   = growArray(self.eligible, k+1)
+            self.w1[k], self.w2[k] = pair
+        return k
+    
+    def add(self, words, index=None):
+        """
+        Add the words of one job posting
+        params:
+            words: list[string] | words of the job posting
+            index: int | position of the posting in the url list
+                         (default=after all postings added so far)
+        """
+        if index is None:
+            index = self.order[-1]+1 if self.order else self.nPostings
+        self.nPostings += 1
+        if not words: return
+        
+        # count the words and the bigrams inside the posting
+        ids = [self.termId(w) for w in words]
+        pairs = [self.pairId(pair) for pair in zip(ids[:-1], ids[1:])]
+        np.add.at(self.counts, ids, 1)
+        np.add.at(self.pairCounts, pairs, 1)
+        self.nTerms += len(ids)
+        
+        # the terms of all postings are joined in index order, so
+        # the bigram across the neighbouring postings changes
+        k = bisect.bisect(self.order, index)
+        before = self.ends[self.order[k-1]][2] if k > 0 else None
+        after  = self.ends[self.order[k]][0] if k < len(self.order) else None
+        for pair, n in [((before, after), -1), ((before, ids[0]), 1), ((ids[-1], after), 1)]:
+            if None in pair: continue
+            pairs.append(self.pairId(pair))
+            self.pairCounts[pairs[-1]] += n
+        self.order.insert(k, index)
+        self.ends[index] = (ids[0], ids[-2] if len(ids) > 1 else None, ids[-1])
+        
+        # only the touched bigrams can pass or fail the filters now
+        touched = np.unique(np.asarray(pairs, dtype=np.int64))
+        self.eligible[touched] = ((self.pairCounts[touched] >= self.minFreq) &
+                                  self.ok[self.w1[touched]] & self.ok[self.w2[touched]])
+    
+    def lastPair(self):
+        """
+        return: tuple(int, int) | term ids of the final bigram (None if
+                                  there are fewer than two terms)
+        """
+        if not self.order: return None
+        first, second, last = self.ends[self.order[-1]]
+        if second is not None: return (second, last)
+        if len(self.order) > 1: return (self.ends[self.order[-2]][2], last)
+        return None
+    
+    def results(self):
+        """
+        return: list[tuple(term, relevance, count)] | "results"
+                list[tuple(term, relevance, count)] | bigram results
+                (same as analyze over the postings' words in index order)
+        """
+        if not self.nTerms: return [], []
+        
+        # relevance of every term (vectorized like scoreTerms), the
+        # average query count changes with every posting
+        V = len(self.vocab)
+        C_query = self.counts[:V].astype(np.float64)
+        C_query_avg = float(self.nTerms) / float( V )
+        R = relevance(C_query / C_query_avg, self.f_bkgd[:V], C_query, x=self.x)
+        
+        # only the top nReturn relevances (and ties) can make the results
+        top = np.arange(len(R))
+        if len(R) > self.nReturn:
+            cut = np.partition(R, len(R)-self.nReturn)[len(R)-self.nReturn]
+            top = np.flatnonzero(R >= cut)
+        qRelevance = dict((self.vocab[i], r) for i, r in zip(top.tolist(), R[top].tolist()))
+        qCount     = dict((self.vocab[i], c) for i, c in zip(top.tolist(), C_query[top].tolist()))
+        
+        # top collocations, scoring only the bigrams passing the filters
+        keep = np.flatnonzero(self.eligible[:len(self.pairIds)])
+        collocations = utils.rankCollocations(self.vocab, self.counts[:V], self.w1[keep],
+                                              self.w2[keep], self.pairCounts[keep],
+                                              last=self.lastPair(), num=100,
+                                              minFreq=self.minFreq, ok=self.ok[:V])
+        
+        return rankResults(self.jobQuery, qRelevance, qCount, collocations, nReturn=self.nReturn)
+    
+    def resultsString(self):
+        """
+        return: string | results string for the postings added so far
+        """
+        return resultsString(self.jobQuery, self.nTerms, self.nPostings)
+
+
+def resultsString(jobQuery, nTerms, nDocuments):
+    """
+    return: string | description of the data behind the results
+    params:
+         jobQuery: string | job query from user form
+           nTerms: int | number of words scraped
+       nDocuments: int | number of job postings
+    """
+    resultsString  = 'Based on '+str(nTerms)+' words scraped from '
+    resultsString += str(nDocuments)+' job postings for "'+jobQuery+'"'
+    return resultsString
+
+
+@metrics.timed('getResults')
 def getResults(jobQuery, nJobs, start=0):
     """
     return: list[tuple(term,relevance,count)] | "results"
@@ -241,21 +473,30 @@ def getResults(jobQuery, nJobs, start=0):
             nJobs: int | number of jobs to consider
             start: int | index to start indeed.com api search
     """
-    # connect to the skillrank database and create cursor
-    con = mdb.connect(host='localhost', user='root', db='skillrank')
-    cur = con.cursor()
+    # retrieve URL's for jobQuery as the api pages arrive
+    urls = indeed.iterJobURLs(jobQuery, nURLs=nJobs, start=start)
     
+    # get indeed job postings using the shared fetch pool, each
+    # download starts as soon as its api page has arrived
+    documents = indeed.threadResults(urls, nThreads=8)
+    
+    return buildResults(jobQuery, documents)
+
+
+def buildResults(jobQuery, documents):
+    """
+    return: list[tuple(term,relevance,count)] | "results"
+            list[tuple(term,relevance,count)] | bigram results
+            string | results string (empty if there are no documents)
+    params:
+         jobQuery: string | job query from user form
+        documents: list[tuple] | indeed.parseJobPosting tuples (in url order)
+    """
     # initialize list for all terms for jobQuery
     terms = []
     
-    # retrieve URL's for jobQuery
-    urls = indeed.getJobURLs(jobQuery, nURLs=nJobs, start=start)
-    
     # if no URL's matched for jobQuery
-    if not urls: return [], [], ''
-    
-    # get indeed job postings using threads for boosted efficieny
-    documents = indeed.threadResults(urls, nThreads=8)
+    if not documents: return [], [], ''
         
     # words lists are the 5th/last item in each
     # tuple returned from threaded documents
@@ -263,17 +504,288 @@ def getResults(jobQuery, nJobs, start=0):
         terms += d[-1]
             
     # retrieve ranked results
-    results, biResults = analyze(cur, jobQuery, terms, x=0.6, nReturn=100, threshold=1)
+    results, biResults = analyze(None, jobQuery, terms, x=0.6, nReturn=100, threshold=1)
     
     # create the results string
-    resultsString  = 'Based on '+str(len(terms))+' words scraped from '
-    resultsString += str(len(urls))+' job postings for "'+jobQuery+'"'
+    return results, biResults, resultsString(jobQuery, len(terms), len(documents))
+
+
+def scoreMatrix(termLists, d_bkgd, x=0.6, threshold=1, C_bkgd_avg=None):
+    """
+    Relevances of the terms of several queries at once: one count
+    matrix over the union of their vocabularies and one bkgd lookup
+    per term, with the same arithmetic as scoreTerms for every row
+    
+    return: list[string] | vocabulary (union over the queries)
+            numpy.ndarray | query x term relevances (nan where the
+                            query doesn't have the term)
+            numpy.ndarray | query x term counts
+    params:
+      termLists: list[list[string]] | terms of each query
+         d_bkgd: dict or CompactCounts | bkgd terms and counts
+              x: float [0,1] | relevance scaling factor
+      threshold: int | minimum count for bkgd filtering
+     C_bkgd_avg: float | precomputed average bkgd term count (optional)
+    """
+    # get the average bkgd term count
+    if C_bkgd_avg is None:
+        bkgdCounts = np.fromiter(d_bkgd.itervalues(), dtype=np.int64, count=len(d_bkgd))
+        C_bkgd_avg = float(bkgdCounts.sum()) / float( len(d_bkgd) )
+    
+    # term ids over all queries, then the counts of every query
+    ids = {}
+    rows = [np.array([ids.setdefault(t, len(ids)) for t in terms], dtype=np.int64)
+            for terms in termLists]
+    vocab = [None] * len(ids)
+    for term, i in ids.iteritems(): vocab[i] = term
+    C_query = np.zeros((len(termLists), len(vocab)), dtype=np.float64)
+    for q, row in enumerate(rows):
+        C_query[q] = np.bincount(row, minlength=len(vocab))
+    
+    # query frequency of every term (average over each query's own vocabulary)
+    C_query_avg = C_query.sum(axis=1) / np.maximum((C_query > 0).sum(axis=1), 1)
+    f_query = C_query / np.maximum(C_query_avg, 1e-300)[:,None]
+    
+    # bkgd frequency of every term, looked up once for all queries
+    C_bkgd = np.array([d_bkgd.get(term, 0) for term in vocab], dtype=np.float64)
+    f_bkgd = C_bkgd / C_bkgd_avg
+    for i in np.flatnonzero(C_bkgd <= threshold):
+        f_bkgd[i] = 1.0 if utils.isWord(vocab[i]) else 100.0
+    
+    # relevance of every (query, term) pair
+    with np.errstate(divide='ignore', invalid='ignore'):
+        R = relevance(f_query, f_bkgd[None,:], C_query, x=x)
+    R[C_query == 0] = np.nan
+    
+    return vocab, R, C_query
+
+
+@metrics.timed('compare')
+def compareResults(jobQueries, nJobs, start=0, x=0.6, nReturn=100, threshold=1):
+    """
+    Analyze several job queries together: postings found by more
+    than one query are downloaded once, and every query is scored
+    against one bkgd snapshot in a single scoreMatrix pass
+    
+    return: dict | job query ---> (results, biResults, resultsString),
+                   as getResults returns for each query alone
+            tuple | vocabulary, relevance and count matrices (see scoreMatrix)
+    params:
+       jobQueries: list[string] | job queries to compare
+            nJobs: int | number of jobs to consider per query
+            start: int | index to start indeed.com api search
+    """
+    # api pages of every query (the queries side by side)
+    urlLists, errors = [[] for jobQuery in jobQueries], []
+    def getURLs(q):
+        try: urlLists[q] = list(indeed.iterJobURLs(jobQueries[q], nURLs=nJobs, start=start))
+        except Exception: errors.append(sys.exc_info())
+    threads = [threading.Thread(target=getURLs, args=(q,)) for q in range(len(jobQueries))]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    if errors: raise errors[0][0], errors[0][1], errors[0][2]
+    
+    # download each posting once, whichever queries found it
+    unique = {}
+    for urls in urlLists:
+        for url in urls: unique.setdefault(indeed.jobkeyFromURL(url), url)
+    documents = indeed.threadResults(sorted(unique.itervalues()), nThreads=8)
+    words = dict((d[0], d[-1]) for d in documents)
+    
+    # terms of every query, its postings in its own url order
+    # (failed downloads left out, as in getResults)
+    keyLists = [[k for k in map(indeed.jobkeyFromURL, urls) if k in words] for urls in urlLists]
+    termLists = [[w for k in keys for w in words[k]] for keys in keyLists]
+    
+    # one bkgd snapshot and one scoring pass for all queries
+    with metrics.timer('bkgd'):
+        bkgd = background.getIndex('bkgd_words').snapshot()
+    with metrics.timer('score'):
+        vocab, R, C = scoreMatrix(termLists, bkgd.counts, x=x, threshold=threshold,
+                                  C_bkgd_avg=bkgd.avg)
+    
+    results = {}
+    for q, jobQuery in enumerate(jobQueries):
+        if not termLists[q]:
+            results[jobQuery] = ([], [], '')
+            continue
+        
+        # only the top nReturn relevances (and ties) can make the results
+        top = np.flatnonzero(C[q])
+        if len(top) > nReturn:
+            cut = np.partition(R[q,top], len(top)-nReturn)[len(top)-nReturn]
+            top = top[R[q,top] >= cut]
+        qRelevance = dict(zip([vocab[i] for i in top], R[q,top].tolist()))
+        qCount     = dict(zip([vocab[i] for i in top], C[q,top].tolist()))
+        
+        with metrics.timer('collocations'):
+            collocations = utils.collocations(termLists[q], num=100)
+        with metrics.timer('rank'):
+            ranked = rankResults(jobQuery, qRelevance, qCount, collocations, nReturn=nReturn)
+        results[jobQuery] = ranked + (resultsString(jobQuery, len(termLists[q]), len(keyLists[q])),)
+    
+    return results, (vocab, R, C)
+
+
+def streamResults(jobQuery, nJobs, start=0, every=10):
+    """
+    Generate progressively better results as job postings arrive:
+    partial results for the postings done so far every "every"
+    postings, then the final results (same as getResults)
+    
+    yield: results, biResults, resultsString, final[bool]
+    params:
+         jobQuery: string | job query from user form
+            nJobs: int | number of jobs to consider
+            start: int | index to start indeed.com api search
+            every: int | number of new postings between partial results
+    """
+    # retrieve URL's for jobQuery as the api pages arrive
+    urls = indeed.iterJobURLs(jobQuery, nURLs=nJobs, start=start)
+    
+    # add the postings to a running analysis as they finish
+    analyzer = None
+    for i, document in indeed.iterPostings(urls):
+        if document is None: continue
+        if analyzer is None: analyzer = IncrementalAnalyzer(jobQuery)
+        analyzer.add(document[-1], index=i)
+        if analyzer.nPostings % every: continue
+        
+        # rank the postings so far (too little text for a
+        # ranking yet is simply skipped)
+        try:
+            results, biResults = analyzer.results()
+        except (ValueError, IndexError):
+            continue
+        yield results, biResults, analyzer.resultsString(), False
+    
+    # if no URL's matched for jobQuery
+    if analyzer is None:
+        yield [], [], '', True
+        return
+    
+    # final results from all postings (in url order)
+    results, biResults = analyzer.results()
+    yield results, biResults, analyzer.resultsString(), True
+
+
+def bubbleResults(jobQuery, results, biResults, resultsString, nBubbles=25):
+    """
+    Rank the analysis results by count and build the d3 bubbles
+    
+    return: dict | results dictionary for d3
+    params:
+         jobQuery: string | job query from user input
+          results: list[tuple(term,relevance,count)] | word results
+        biResults: list[tuple(term,relevance,count)] | bigram results
+    resultsString: string | results string ('' if nothing was found)
+         nBubbles: int | number of bubbles for d3 visualization
+    """
+    # catch for case with no results
+    if resultsString == '':
+        resultsString = 'No results found for "'+jobQuery+'"'
+        return {'resultsString':resultsString}
+    
+    # the top results by count (ties keep their order), two
+    # extra in case R and C are filtered below
+    newResults = heapq.nsmallest(nBubbles+2, results + biResults, key=lambda r: -int(r[2]))
+        
+    # filter single letters R and C if at top
+    # more likely a bug than reality
+    if newResults[0][0]+newResults[1][0] in ['cr','rc']:
+        newResults = newResults[2:]
+        
+    # update results to newResults
+    results = newResults[:nBubbles]
+    
+    # if results is an empty list
+    if not results:
+        # return empty dict
+        return {}
+        
+    # build the results dictionary for d3
+    dictResults = {'items':[]}
+    
+    # put words and bigrams in the results dictionary
+    for term, relevance, count in results:
+            dictResults['items'].append({'term':term, 'relevance':relevance,
+                                         'count':float(count), 'len':len(term.split())})
+                                         
+    # add the jobQuery to the results dictonary for quick reference
+    dictResults['query'] = str(jobQuery).replace(' ','+')
+    
+    # add the resultsString to the results dictionary
+    dictResults['resultsString'] = resultsString
+    
+    return dictResults
+
+
+def cacheResults(jobQuery, dictResults, store=None):
+    """
+    Cache a query's results under its normalized form (only results
+    with bubbles) and pass them on to store
+    params:
+         jobQuery: string | job query from user input
+      dictResults: dict | results dictionary for d3
+            store: function | called with the normalized query and the
+                              results, e.g. to materialize them for other
+                              workers (failures are printed, not raised)
+    """
+    if 'items' not in dictResults: return
+    key = cache.normalizeQuery(jobQuery)
+    cache.getCache(cache.ResultCache).set(key, dictResults)
+    if store is None: return
+    try:
+        store(key, dictResults)
+    except Exception, e:
+        print 'storing results failed for', key, '|', e
+
+
+def refreshQuery(jobQuery, store=None):
+    """
+    Run the full skillrank analysis for a job query (cached or not)
+    and cache it (see cacheResults)
+    
+    return: dict | results dictionary for d3
+    params:
+         jobQuery: string | job query from user input (the normalized
+                            query for background refreshes)
+            store: function | see cacheResults
+    """
+    # set nJobs to 50 ---> good balance of quality/speed
+    nJobs = 50
     
-    # close the database cursor and connection
-    if cur: cur.close()
-    if con: con.close()
+    # start from the first indeed.com API results
+    start = 0
+    
+    # get the results as list[tuple(term,relevance,count)]
+    results, biResults, resultsString = getResults(jobQuery=jobQuery, nJobs=nJobs, start=start)
+    
+    # build the results dictionary for d3
+    dictResults = bubbleResults(jobQuery, results, biResults, resultsString)
+    
+    # add results to the cache (evicts least recently used/expired)
+    cacheResults(jobQuery, dictResults, store=store)
+    
+    return dictResults
+
+
+def analyzeQuery(jobQuery, store=None):
+    """
+    Results of a job query from the results cache, or a full
+    skillrank analysis (see refreshQuery)
+    
+    return: dict | results dictionary for d3
+    params:
+         jobQuery: string | job query from user input
+            store: function | see cacheResults
+    """
+    # another worker may have finished jobQuery while we waited
+    cached = cache.getCache(cache.ResultCache).get(cache.normalizeQuery(jobQuery))
+    if cached is not None:
+        return cached
     
-    return results, biResults, resultsString
+    return refreshQuery(jobQuery, store=store)
 
 
 if __name__ == '__main__':
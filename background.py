@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+"""
+background.py
+Author: Brian Boates
+
+Process-wide in-memory index of the skillrank bkgd tables.
+Each table is loaded once per worker process and refreshed
+atomically by a daemon thread whenever the table changes, so
+the request path never has to pull the full table from MySQL.
+
+If a snapshot file of a table has been exported
+(python background.py export), workers memory-map it instead
+of querying MySQL, so every worker on the host shares one copy
+of the counts in the page cache. Re-exporting writes a new file
+and renames it over the old one; workers notice the new file on
+their next refresh and requests in flight keep reading the old
+mapping.
+
+SNAPSHOT FILE (native byte order, sections 8-byte aligned):
+header:   SNAPSHOT_HEADER (magic, sizes, sum, max, avg, table version)
+offsets:  nTerms+1 file offsets of the terms (4 or 8 bytes each)
+counts:   nTerms counts (4 or 8 bytes each)
+slots:    nSlots term ids of the hash table (4 bytes each)
+terms:    the sorted terms, concatenated (see compact.py)
+"""
+import os, sys, time, mmap, struct, threading
+import numpy as np
+import database, metrics, compact, storage
+
+# seconds between checks for a changed bkgd table
+refreshInterval = 60.0
+
+# n-grams seen fewer times are left out when the n-gram tables are
+# loaded (analysis treats bkgd counts <= threshold (1) like missing
+# terms); the tables themselves keep every count, so counts add up
+# across ingestion runs (unless pruned, see database.pruneNgrams)
+minNgramCount = 2
+
+# directory for exported snapshot files
+snapshotDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots')
+
+# snapshot file header: magic, nTerms, nSlots, offset bytes, count
+# bytes, sum, max, avg, table version (repr)
+SNAPSHOT_MAGIC  = 'SKBKGD01'
+SNAPSHOT_HEADER = struct.Struct('=8sQQIIddd64s')
+
+
+def connect():
+    """
+    return: connection to the skillrank database (from the pool,
+            closing it returns it)
+    """
+    return storage.connect()
+
+
+def tableVersion(cur, table):
+    """
+    return: tuple | cheap "version" of a bkgd table; changes whenever
+                    postings are ingested or rows are added/removed
+    params:
+            cur: cursor to skillrank db
+          table: string | db table to check
+    """
+    # every ingested posting adds a jobkey (count updates alone
+    # don't change the size of the terms table)
+    cur.execute("SELECT MAX(id) FROM bkgd_jobkeys")
+    jobkeys = cur.fetchone()[0]
+
+    # row count and newest row of the table itself
+    cur.execute("SELECT COUNT(*), MAX(id) FROM "+table)
+    rows, newest = cur.fetchone()
+
+    return (jobkeys, rows, newest)
+
+
+def tableLoad(cur, table):
+    """
+    return: CompactCounts | bkgd terms and counts, with the lookups of
+                            a dict (n-gram terms as "word1 word2 ...",
+                            n-grams seen fewer than minNgramCount
+                            times left out, see compact.py)
+    params:
+            cur: cursor to skillrank db
+          table: string | db table to retrieve
+    """
+    columns = database.NGRAM_TABLES.get(table)
+    if columns is None:
+        cur.execute("SELECT term,count FROM "+table)
+        return compact.CompactCounts.fromItems(cur.fetchall())
+
+    # n-gram tables hold word ids, map them back to the words
+    cur.execute("SELECT id,term FROM bkgd_words")
+    words = dict(cur.fetchall())
+    cur.execute("SELECT "+','.join(columns)+",count FROM "+table+" WHERE count >= ?",
+                (minNgramCount,))
+    return compact.CompactCounts.fromItems((' '.join([words[i] for i in row[:-1]]), row[-1])
+                                           for row in cur.fetchall())
+
+
+class BkgdSnapshot(object):
+    """
+    An immutable snapshot of a bkgd table: the term counts
+    (a CompactCounts or dict) plus their precomputed sum, max
+    and average
+    """
+    def __init__(self, counts, version=None, stats=None, fileId=None):
+        """
+        params:
+           counts: CompactCounts or dict | bkgd terms and counts
+          version: tuple | table version (see tableVersion)
+            stats: tuple(float, float) | sum and max of the counts
+                                         (computed if not given)
+           fileId: tuple | identity of the snapshot file it was read
+                           from (None if loaded from the database)
+        """
+        self.counts  = counts
+        self.version = version
+        self.fileId  = fileId
+        self.size = len(counts)
+        if stats is None:
+            values = np.fromiter(counts.itervalues(), dtype=np.int64, count=len(counts))
+            stats  = (float(values.sum()), float(values.max())) if self.size else (0.0, 0.0)
+        self.sum, self.max = stats
+        self.avg  = self.sum / float(self.size) if self.size else 0.0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, term):
+        return term in self.counts
+
+    def __getitem__(self, term):
+        return self.counts[term]
+
+    def get(self, term, default=None):
+        return self.counts.get(term, default)
+
+
+def snapshotPath(table):
+    """
+    return: string | exported snapshot file of a bkgd table
+    """
+    return os.path.join(snapshotDir, table+'.snapshot')
+
+
+def snapshotLayout(nTerms, nSlots, offsetBytes, countBytes):
+    """
+    return: int, int, int, int | file positions of the offsets, counts,
+                                 slots and terms sections
+    """
+    align = lambda n: (n+7) // 8 * 8
+    offsetsAt = align(SNAPSHOT_HEADER.size)
+    countsAt  = align(offsetsAt + (nTerms+1)*offsetBytes)
+    slotsAt   = align(countsAt + nTerms*countBytes)
+    blobAt    = align(slotsAt + nSlots*4)
+    return offsetsAt, countsAt, slotsAt, blobAt
+
+
+def writeSnapshot(path, counts, version=None):
+    """
+    Write bkgd counts to a snapshot file, replacing any existing
+    file atomically (readers keep their mapping of the old one)
+    params:
+             path: string | snapshot file
+           counts: CompactCounts or dict | bkgd terms and counts
+          version: tuple | table version the counts were loaded at
+    """
+    if not isinstance(counts, compact.CompactCounts):
+        counts = compact.CompactCounts.fromItems(counts.iteritems())
+    nTerms, nSlots = len(counts), len(counts.slots)
+    values = counts.counts()
+    total  = float(values.sum()) if nTerms else 0.0
+    peak   = float(values.max()) if nTerms else 0.0
+
+    # the terms and their offsets relative to the first term
+    offsets = np.asarray(counts.offsets, dtype=np.int64)
+    blob    = counts.blob[offsets[0]:offsets[-1]]
+    offsets = offsets - offsets[0]
+
+    # stored offsets are file positions (8 bytes only if needed)
+    countBytes = counts.termCounts.itemsize
+    for offsetBytes in (4, 8):
+        offsetsAt, countsAt, slotsAt, blobAt = snapshotLayout(nTerms, nSlots, offsetBytes, countBytes)
+        if blobAt + len(blob) < 2**(8*offsetBytes-1): break
+
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, nTerms, nSlots, offsetBytes, countBytes,
+                                  total, peak, total/nTerms if nTerms else 0.0,
+                                  repr(version)[:64])
+    sections = [(0, header),
+                (offsetsAt, (offsets + blobAt).astype('i%d' % offsetBytes).tobytes()),
+                (countsAt, values.tobytes()),
+                (slotsAt, np.asarray(counts.slots, dtype=np.int32).tobytes()),
+                (blobAt, blob)]
+
+    # write a temporary file in the same directory, then swap it in
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        for at, data in sections:
+            f.write('\0' * (at - f.tell()))
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
+
+
+def snapshotFileId(path):
+    """
+    return: tuple | identity of the file at path (changes when a new
+                    snapshot is renamed over it), None if there is none
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_mtime, st.st_size)
+
+
+def readSnapshot(path):
+    """
+    return: BkgdSnapshot | the counts of a snapshot file, read in place
+                           from a read-only memory map (no copies)
+    params:
+             path: string | snapshot file
+    """
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, nTerms, nSlots, offsetBytes, countBytes, total, peak, avg, version = \
+        SNAPSHOT_HEADER.unpack_from(mm, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError('not a bkgd snapshot file: '+path)
+
+    # the offsets are file positions, so the map itself is the blob
+    offsetsAt, countsAt, slotsAt, blobAt = snapshotLayout(nTerms, nSlots, offsetBytes, countBytes)
+    counts = compact.MappedCounts(mm, nTerms, nSlots, offsetsAt, offsetBytes,
+                                  countsAt, countBytes, slotsAt)
+    return BkgdSnapshot(counts, version=version.rstrip('\0'), stats=(total, peak),
+                        fileId=(st.st_dev, st.st_ino, st.st_mtime, st.st_size))
+
+
+def exportTable(table, path=None, connect=None):
+    """
+    Export a bkgd table from the database to its snapshot file
+    return: int | number of terms exported
+    params:
+            table: string | db table (bkgd_words, bkgd_bigrams, bkgd_trigrams)
+             path: string | snapshot file (default=snapshotPath(table))
+          connect: function | returns a database connection
+    """
+    if path is None: path = snapshotPath(table)
+
+    # load the table from the database (never from a snapshot file)
+    index = BkgdIndex(table, connect=connect, path=False)
+    index.reload()
+    writeSnapshot(path, index._snapshot.counts, index._snapshot.version)
+    return len(index._snapshot)
+
+
+class BkgdIndex(object):
+    """
+    A shared, lazily loaded bkgd table. snapshot() returns the
+    current BkgdSnapshot; a daemon thread checks the table
+    version (or the snapshot file) every "interval" seconds and
+    swaps in a freshly loaded snapshot when it changes
+    """
+    def __init__(self, table, connect=None, interval=None, path=None):
+        """
+        params:
+            table: string | db table
+          connect: function | returns a database connection
+         interval: float | seconds between refresh checks
+             path: string | snapshot file to map when it exists
+                            (default=snapshotPath(table), False for
+                             the database only)
+        """
+        self.table    = table
+        self.connect  = connect
+        self.interval = interval
+        self.path     = snapshotPath(table) if path is None else path
+        self._snapshot = None
+        self._lock   = threading.Lock()
+        self._thread = None
+        self._pid    = None
+
+    def snapshot(self):
+        """
+        return: BkgdSnapshot | current snapshot (loaded on first use)
+        """
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self.reload()
+        if self._pid != os.getpid():
+            self.start()
+        return self._snapshot
+
+    def reload(self, version=None):
+        """
+        Load the full table (or map its snapshot file) and
+        atomically swap it in
+        params:
+            version: tuple | table version if already known
+        """
+        # an exported snapshot file replaces the database
+        if self.path and os.path.exists(self.path):
+            self._snapshot = readSnapshot(self.path)
+            return
+
+        con = (self.connect or connect)()
+        try:
+            cur = con.cursor()
+            if version is None:
+                version = tableVersion(cur, self.table)
+            with metrics.timer('bkgdLoad'):
+                counts = tableLoad(cur, self.table)
+            cur.close()
+        finally:
+            con.close()
+
+        # build the new snapshot completely before swapping it in,
+        # requests in flight keep using the old one
+        self._snapshot = BkgdSnapshot(counts, version)
+
+    def refresh(self):
+        """
+        return: True if the table changed and a new snapshot was loaded
+        """
+        # snapshot files: reload when a new file is renamed in (or the
+        # file appears or disappears)
+        fileId  = snapshotFileId(self.path) if self.path else None
+        current = self._snapshot
+        if fileId is not None or (current is not None and current.fileId is not None):
+            if current is not None and current.fileId == fileId:
+                return False
+            with self._lock:
+                self.reload()
+            return True
+
+        con = (self.connect or connect)()
+        try:
+            cur = con.cursor()
+            version = tableVersion(cur, self.table)
+            cur.close()
+        finally:
+            con.close()
+
+        current = self._snapshot
+        if current is not None and current.version == version:
+            return False
+
+        with self._lock:
+            self.reload(version)
+        return True
+
+    def start(self):
+        """
+        Start the refresh thread for this process (threads
+        don't survive a fork, so each worker starts its own)
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval or refreshInterval)
+            try:
+                self.refresh()
+            except Exception, e:
+                print 'bkgd refresh failed for', self.table, '|', e
+
+
+# one index per bkgd table, shared by all threads in the process
+indexes = {}
+indexesLock = threading.Lock()
+
+def getIndex(table):
+    """
+    return: BkgdIndex | the shared index for a bkgd table
+    params:
+          table: string | db table (bkgd_words, bkgd_bigrams, bkgd_trigrams)
+    """
+    try:
+        return indexes[table]
+    except KeyError:
+        with indexesLock:
+            if table not in indexes:
+                indexes[table] = BkgdIndex(table)
+            return indexes[table]
+
+
+def main():
+
+    # retrieve user input
+    try:
+        assert sys.argv[1] == 'export'
+        tables = sys.argv[2:] or ['bkgd_words'] + sorted(database.NGRAM_TABLES)
+    except (IndexError, AssertionError):
+        print '\n usage: '+sys.argv[0]+' export [table ...]'
+        sys.exit(1)
+
+    # write every table to its snapshot file
+    for table in tables:
+        t0 = time.time()
+        nTerms = exportTable(table)
+        print 'exported', nTerms, table, 'terms to', snapshotPath(table), \
+              'in %.1f s' % (time.time()-t0)
+
+
+if __name__ == '__main__':
+    main()
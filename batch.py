@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+batch.py
+Author: Brian Boates
+
+Offline skillrank analysis of many job queries: reads a JSONL file
+of queries and runs them on a pool of worker processes, writing one
+JSON line per query (the same results dictionary as /analyze) to an
+output JSONL file. Workers share the on-disk posting and results
+caches (see cache.py); every worker loads the bkgd index once.
+Queries already in the output file are skipped, so an interrupted
+run picks up where it left off.
+
+usage: python batch.py queries.jsonl results.jsonl [nProcs]
+"""
+import os, sys, time, json
+from multiprocessing import Pool
+import cache, analysis
+
+# keys that may hold the job query in an input line
+queryKeys = ['jobQuery', 'query', 'title']
+
+
+def readQueries(path):
+    """
+    return: list[string] | job queries in file order as written (queries
+                           with the same normalized form removed), bad
+                           lines are skipped and reported
+    params:
+            path: string | JSONL file, each line a JSON string or an
+                           object with a jobQuery, query or title key
+    """
+    queries, seen = [], set()
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip(): continue
+            try:
+                item = json.loads(line)
+                if isinstance(item, dict):
+                    item = [item[k] for k in queryKeys if k in item][0]
+                jobQuery = item.strip()
+                key = cache.normalizeQuery(jobQuery)
+            except (ValueError, IndexError, AttributeError):
+                print 'skipping line', n, 'of', path, '| no job query:', line.strip()[:80]
+                continue
+            if key and key not in seen:
+                seen.add(key)
+                queries.append(jobQuery)
+    return queries
+
+
+def readDone(path):
+    """
+    return: set | normalized job queries with results in an existing
+                  output file (failed queries, lines without a job query
+                  and a truncated last line are not done)
+    params:
+            path: string | output JSONL file
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            try:
+                item = json.loads(line)
+                if 'error' in item: continue
+                done.add(cache.normalizeQuery(item['jobQuery']))
+            except (ValueError, KeyError, TypeError, AttributeError):
+                if line.strip():
+                    print 'skipping line', n, 'of', path, '| no results:', line.strip()[:80]
+    return done
+
+
+def initWorker():
+    """
+    Load the bkgd index, lexicon and stopwords once per worker process
+    """
+    import background, lexicon
+    background.getIndex('bkgd_words').snapshot()
+    lexicon.getLexicon()
+    lexicon.getStopwords()
+
+
+def analyzeOne(jobQuery):
+    """
+    return: dict | output line for jobQuery: the results dictionary
+                   (or the error) and the seconds it took
+    params:
+         jobQuery: string | job query as written in the input file
+    """
+    t0 = time.time()
+    try:
+        line = {'jobQuery':jobQuery, 'results':analysis.analyzeQuery(jobQuery)}
+    except Exception, e:
+        line = {'jobQuery':jobQuery, 'error':repr(e)}
+    line['seconds'] = time.time() - t0
+    return line
+
+
+def runBatch(inPath, outPath, nProcs=4, resume=True):
+    """
+    Analyze every query in inPath, appending a line per query to outPath
+    return: dict | number of queries done, failed and skipped, seconds
+                   and queries per second
+    params:
+           inPath: string | input JSONL file of job queries
+          outPath: string | output JSONL file of results
+           nProcs: int | number of worker processes
+           resume: bool | skip queries already in outPath
+    """
+    queries = readQueries(inPath)
+    done = readDone(outPath) if resume else set()
+    todo = [q for q in queries if cache.normalizeQuery(q) not in done]
+    print len(queries), 'queries,', len(queries)-len(todo), 'already done,', len(todo), 'to run'
+
+    nDone, nFailed, t0 = 0, 0, time.time()
+    pool = Pool(nProcs, initializer=initWorker)
+    try:
+        with open(outPath, 'a+' if resume else 'w') as out:
+
+            # end a truncated last line so it doesn't swallow the next result
+            out.seek(0, os.SEEK_END)
+            if out.tell() > 0:
+                out.seek(-1, os.SEEK_END)
+                last = out.read(1)
+                out.seek(0, os.SEEK_END)
+                if last != '\n': out.write('\n')
+
+            # write each result as soon as any worker finishes it
+            for line in pool.imap_unordered(analyzeOne, todo):
+                out.write(json.dumps(line)+'\n')
+                out.flush()
+                if 'error' in line: nFailed += 1
+                else: nDone += 1
+
+                # progress and throughput so far
+                elapsed = time.time() - t0
+                print '%d/%d | %s | %.1fs | %.2f queries/s' % (nDone+nFailed, len(todo),
+                      line['jobQuery'], line['seconds'], (nDone+nFailed) / max(elapsed, 1e-9))
+    finally:
+        # every result is in (or the run was interrupted)
+        pool.terminate()
+        pool.join()
+
+    elapsed = time.time() - t0
+    stats = {'done':nDone, 'failed':nFailed, 'skipped':len(queries)-len(todo),
+             'seconds':elapsed, 'qps':(nDone+nFailed) / max(elapsed, 1e-9)}
+    print 'done %(done)d, failed %(failed)d, skipped %(skipped)d in %(seconds).1f s ' \
+          '(%(qps).2f queries/s)' % stats
+    return stats
+
+
+def main():
+
+    # retrieve user input
+    try:
+        inPath  = sys.argv[1]
+        outPath = sys.argv[2]
+    except IndexError:
+        print '\n usage: '+sys.argv[0]+' queries.jsonl results.jsonl [nProcs] [--no-resume]'
+        sys.exit(1)
+    try:
+        nProcs = int(sys.argv[3])
+    except (IndexError, ValueError):
+        nProcs = 4
+
+    # start over with --no-resume
+    resume = '--no-resume' not in sys.argv
+
+    runBatch(inPath, outPath, nProcs=nProcs, resume=resume)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,524 @@
+#!/usr/bin/env python
+"""
+benchanalysis.py
+Author: Brian Boates
+
+Benchmarks for the analysis: term scoring, collocations, ranking,
+incremental and compared analyses, and word lookups
+
+usage: python benchanalysis.py
+"""
+import os, sys, math, time, threading, subprocess, tempfile, shutil
+import analysis, indeed, lexicon, utils, cache, background, fixtures
+from benchtools import timeIt, zipfCorpus, zipfBkgd, descriptionCorpus, FixtureServer
+
+def legacyScore(terms, d_bkgd, x=0.6, threshold=1):
+    """
+    The original per-term analysis.analyze loop (O(unique x total)),
+    kept here only as the reference for benchScoreTerms
+
+    return: dict, dict | term relevances and term counts
+    """
+    C_bkgd_sum = float(sum(d_bkgd.values()))
+    C_bkgd_avg = float(C_bkgd_sum) / float( len(d_bkgd) )
+    termSet = set(terms)
+    C_query_sum = float(sum( [terms.count(term) for term in termSet] ))
+    C_query_avg = float(C_query_sum) / float( len(termSet) )
+    qRelevance, qCount = {}, {}
+    for term in termSet:
+        C_query = float(terms.count(term))
+        f_query = C_query / C_query_avg
+        try: C_bkgd = float(d_bkgd[term])
+        except KeyError: C_bkgd = 0
+        if C_bkgd <= threshold:
+            if not utils.isWord(term): f_bkgd = 100.0
+            else: f_bkgd = 1.0
+        else: f_bkgd = C_bkgd / C_bkgd_avg
+        qRelevance[term] = ( x*math.log(f_query/f_bkgd) + (1-x) ) * C_query
+        qCount[term]     = C_query
+    return qRelevance, qCount
+
+
+def benchScoreTerms(sizes=(1000, 10000, 100000, 1000000), legacyMax=10000):
+    """
+    Time analysis.scoreTerms from 1k to 1M tokens and compare
+    against the legacy loop (only up to legacyMax tokens, it's slow)
+
+    return: list[dict] | one timing record per corpus size
+    params:
+            sizes: list[int] | corpus sizes in tokens
+        legacyMax: int | largest corpus to run the legacy loop on
+    """
+    # isWord is a wordnet lookup, keep it out of the timings
+    isWord = utils.isWord
+    utils.isWord = lambda word: word[-1] in '02468'
+
+    d_bkgd = zipfBkgd()
+    records = []
+    try:
+        for n in sizes:
+            terms = zipfCorpus(n)
+            t_new, new = timeIt(analysis.scoreTerms, terms, d_bkgd)
+            record = {'tokens':n, 'unique':len(new[0]), 'scoreTerms':t_new}
+            if n <= legacyMax:
+                t_old, old = timeIt(legacyScore, terms, d_bkgd, repeat=1)
+                record['legacy'] = t_old
+                record['speedup'] = t_old / t_new
+                record['identical'] = [str(r) for r in sorted(old[0].items())] == \
+                                      [str(r) for r in sorted(new[0].items())] and \
+                                      old[1] == new[1]
+            records.append(record)
+    finally:
+        utils.isWord = isWord
+
+    return records
+
+
+def legacyBestBigrams(words, num=100):
+    """
+    The original utils.getBigrams (nltk Text.collocations) plus the
+    allBigrams.count loop of analysis.bestBigrams, kept here only as
+    the reference for benchCollocations
+
+    return: list[tuple(string, int)] | top bigrams and their query counts
+    """
+    from nltk.collocations import BigramCollocationFinder, BigramAssocMeasures
+    ignored = lexicon.getStopwords()
+    finder = BigramCollocationFinder.from_words(words, 2)
+    finder.apply_freq_filter(2)
+    finder.apply_word_filter(lambda w: len(w) < 3 or w.lower() in ignored)
+    topBigrams = [w1+' '+w2 for w1, w2 in finder.nbest(BigramAssocMeasures().likelihood_ratio, num)]
+    allBigrams = utils.getNgrams(words, N=2)
+    return [(b, allBigrams.count(b)) for b in topBigrams]
+
+
+def benchCollocations(sizes=(1000, 10000, 100000)):
+    """
+    Time utils.collocations against the nltk collocation finder plus
+    per-candidate list counts it replaces
+
+    return: list[dict] | one timing record per corpus size
+    params:
+            sizes: list[int] | corpus sizes in tokens
+    """
+    records = []
+    for n in sizes:
+        words = zipfCorpus(n, nVocab=5000)
+        t_old, old = timeIt(legacyBestBigrams, words)
+        t_new, new = timeIt(utils.collocations, words)
+        records.append({'tokens':n, 'legacy':t_old, 'collocations':t_new,
+                        'speedup':t_old/t_new, 'identical':old == new})
+    return records
+
+
+def legacyRankResults(jobQuery, qRelevance, qCount, collocations, nReturn=100):
+    """
+    The original analysis.rankResults (full sort of the scored terms,
+    list membership tests), kept here only as the reference for
+    benchRanking
+    """
+    # sort by relevance, build raw results list
+    results = []
+    for key, value in sorted(qRelevance.iteritems(), key=lambda (k,v): (v,k)):
+         results.append( (key, value, str(qCount[key])) )
+         
+    # reverse ordering, and only keep top "nReturn" values
+    results = results[::-1][:nReturn]
+    
+    # create list of top nReturn words only
+    topTerms = [r[0] for r in results if (len(r[0])>1 or r[0] in ['c','r'])]
+    
+    # retrieve list of N best bigrams (with their counts)
+    topBigrams = analysis.selectBigrams(collocations, topTerms, N=10)
+        
+    # create list of bigram words to remove from results
+    toRemove = []
+    for b in topBigrams:
+        # grab the current bigram
+        bigram = b[0].split()     
+        # concatenate individual bigram words to remove list
+        toRemove += bigram
+    
+    # only keep bigram removal words for words occuring more than once
+    toRemove = list(set( [r for r in toRemove if toRemove.count(r) > 1] ))
+    toRemove += ['statistical']
+    
+    # also concatenate bigram with no space
+    for b in topBigrams:
+        bigram = b[0].split()
+        toRemove += [bigram[0]+bigram[1]]
+        
+    # append jobQuery words to removal list
+    if ' ' in str(jobQuery):
+        jq = jobQuery.split()
+        for j in jq:
+            toRemove.append(str(j))
+            toRemove.append(str(j)+'s')
+        toRemove.append(str(jobQuery)+'s')
+    else:
+        toRemove.append(str(jobQuery))
+        toRemove.append(str(jobQuery)+'s')
+        
+    # get list of all relevances
+    maxRelevance = max( [float(r[1]) for r in results if r[0] not in toRemove] )
+    
+    # get the best bigrams with artificial relevances (limit to top 5)
+    topBigrams = [b for b in topBigrams if b[0] not in [str(jobQuery),str(jobQuery)+'s']][:5]
+    topBigrams = [b for b in topBigrams if 'html' not in b[0]]
+    biResults = []
+    fakeRelevances = [0.60, 0.50, 0.24, 0.12, 0.08, 0.06, 0.04, 0.02, 0.01, 0.01]
+    for i in range(len(topBigrams)):
+        term, count = topBigrams[i]
+        biResults.append((term, fakeRelevances[i], count))
+        toRemove += term.split()
+        
+    # perform removal of bigram and jobQuery words and normalize R
+    results = [(r[0],str(r[1]/maxRelevance),str(int(float(r[2])))) \
+                                  for r in results if r[0] not in toRemove]
+    
+    # remove pluralities (might break other words only 
+    # differing by one extra letter, probably rare/okay)
+    resultWords = [r[0] for r in results]
+    results = [r for r in results if r[0][:-1] not in resultWords]
+    
+    # remove 'ing words if stemmed word in list
+    ingRemoval = []
+    for w, r, c in results:
+        if w+'ing' in resultWords:
+            ingRemoval.append(w)
+            print w, 'to be removed'
+    results = [r for r in results if r[0] not in ingRemoval]
+        
+    return results, biResults
+
+
+def legacyBubbleResults(jobQuery, results, biResults, resultsString, nBubbles=25):
+    """
+    The original analysis.bubbleResults (selection sort by count), kept
+    here only as the reference for benchRanking
+    """
+    # catch for case with no results
+    if resultsString == '':
+        resultsString = 'No results found for "'+jobQuery+'"'
+        return {'resultsString':resultsString}
+    
+    results = results + biResults
+    
+    # sort the list in the most horrible way imaginable
+    # but it's short so it's okay :)
+    counts = [int(r[2]) for r in results] # create list of all counts
+    newResults = []
+    while counts:
+        # find the max count index, then remove it
+        maxC = counts.index(max(counts))
+        # put the max count result in newResults
+        newResults.append(results[maxC])
+        # pop the result out of both lists to keep in sync
+        counts.pop(maxC)
+        results.pop(maxC)
+        
+    # filter single letters R and C if at top
+    # more likely a bug than reality
+    if newResults[0][0]+newResults[1][0] in ['cr','rc']:
+        newResults = newResults[2:]
+        
+    # update results to newResults
+    results = newResults[:nBubbles]
+    
+    # if results is an empty list
+    if not results:
+        # return empty dict
+        return {}
+        
+    # build the results dictionary for d3
+    dictResults = {'items':[]}
+    
+    # put words and bigrams in the results dictionary
+    for term, relevance, count in results:
+            dictResults['items'].append({'term':term, 'relevance':relevance,
+                                         'count':float(count), 'len':len(term.split())})
+                                         
+    # add the jobQuery to the results dictonary for quick reference
+    dictResults['query'] = str(jobQuery).replace(' ','+')
+    
+    # add the resultsString to the results dictionary
+    dictResults['resultsString'] = resultsString
+    
+    return dictResults
+
+
+def benchRanking(sizes=((1000, 100, 25), (10000, 1000, 250), (100000, 10000, 2500))):
+    """
+    Time analysis.rankResults and analysis.bubbleResults against the
+    sorts and list scans they replace, on zipfian query terms scored
+    against a zipfian bkgd
+
+    return: list[dict] | one timing record per (vocabulary, nReturn, nBubbles)
+    params:
+            sizes: list[tuple(int, int, int)] | unique terms, nReturn and nBubbles
+    """
+    records = []
+    for nVocab, nReturn, nBubbles in sizes:
+        terms = zipfCorpus(20*nVocab, nVocab=nVocab, a=1.1)
+        qRelevance, qCount = analysis.scoreTerms(terms, zipfBkgd(nVocab))
+        collocations = utils.collocations(terms, num=100)
+
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            tLegacy, expected = timeIt(legacyRankResults, 'w1', qRelevance, qCount,
+                                       collocations, nReturn)
+            tRank, found = timeIt(analysis.rankResults, 'w1', qRelevance, qCount,
+                                  collocations, nReturn)
+            resultsString = analysis.resultsString('w1', len(terms), 1)
+            tLegacyBubbles, bubbles = timeIt(legacyBubbleResults, 'w1', found[0], found[1],
+                                             resultsString, nBubbles)
+            tBubbles, newBubbles = timeIt(analysis.bubbleResults, 'w1', found[0], found[1],
+                                          resultsString, nBubbles)
+        finally:
+            sys.stdout = stdout
+
+        records.append({'terms':len(qRelevance), 'nReturn':nReturn, 'nBubbles':nBubbles,
+                        'rank':tRank, 'legacyRank':tLegacy, 'bubbles':tBubbles,
+                        'legacyBubbles':tLegacyBubbles,
+                        'identical':found == expected and newBubbles == bubbles})
+    return records
+
+
+def benchIncremental(nPostings=200, nWords=400, every=10):
+    """
+    Time analysis.IncrementalAnalyzer against recomputing the full
+    analysis, both ranking after every "every" postings (rankings of
+    short postings, one word or none, added in and out of order are
+    checked too)
+
+    return: dict | total seconds for both and whether every ranking matches
+    params:
+        nPostings: int | number of job postings
+           nWords: int | words per posting
+            every: int | postings between rankings
+    """
+    # isWord is a wordnet lookup, keep it out of the timings
+    isWord = utils.isWord
+    utils.isWord = lambda word: word[-1] in '02468'
+
+    d_bkgd = zipfBkgd()
+    postings = [zipfCorpus(nWords, seed=i) for i in range(nPostings)]
+    jobQuery = 'w1'
+
+    def full():
+        rankings, terms = [], []
+        for i, words in enumerate(postings):
+            terms += words
+            if (i+1) % every: continue
+            qRelevance, qCount = analysis.scoreTerms(terms, d_bkgd)
+            rankings.append(analysis.rankResults(jobQuery, qRelevance, qCount,
+                                                 utils.collocations(terms, num=100)))
+        return rankings
+
+    def incremental():
+        rankings = []
+        analyzer = analysis.IncrementalAnalyzer(jobQuery, d_bkgd=d_bkgd)
+        for i, words in enumerate(postings):
+            analyzer.add(words)
+            if (i+1) % every: continue
+            rankings.append(analyzer.results())
+        return rankings
+
+    # short postings (one word, none) added first, in order or not:
+    # (postings, order they are added in)
+    short = [['w3', 'w5', 'w3', 'w5'], [], ['w7'], ['w3', 'w5'], ['w2']]
+    cases = [([['w3']], [0]), ([['w3'], ['w5']], [0, 1]), ([['w3'], ['w5']], [1, 0]),
+             (short, range(len(short))), (short, [2, 4, 0, 1, 3]), (short, [1, 2, 4, 3, 0])]
+
+    def ranking(rank):
+        # rankResults raises ValueError when every term is filtered out
+        try: return rank()
+        except Exception, e: return type(e).__name__
+
+    def edges():
+        rankings = []
+        for posts, order in cases:
+            analyzer = analysis.IncrementalAnalyzer(jobQuery, d_bkgd=d_bkgd)
+            added = []
+            for i in order:
+                added.append(i)
+                terms = [w for j in sorted(added) for w in posts[j]]
+                def fullRank():
+                    if not terms: return [], []
+                    qRelevance, qCount = analysis.scoreTerms(terms, d_bkgd)
+                    return analysis.rankResults(jobQuery, qRelevance, qCount,
+                                                utils.collocations(terms, num=100))
+                rankings.append((ranking(fullRank),
+                                 ranking(lambda: analyzer.add(posts[i], index=i) or analyzer.results())))
+        return rankings
+
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        t_old, old = timeIt(full, repeat=1)
+        t_new, new = timeIt(incremental, repeat=1)
+        short = edges()
+    finally:
+        sys.stdout = stdout
+        utils.isWord = isWord
+
+    return {'postings':nPostings, 'words':nWords, 'rankings':len(new), 'full':t_old,
+            'incremental':t_new, 'speedup':t_old/t_new,
+            'identical':old == new and all(a == b for a, b in short)}
+
+
+def benchCompare(nJobs=50, latency=0.02):
+    """
+    Three overlapping job queries (one shares its postings with the
+    other two) analyzed by concurrent getResults calls versus together
+    with analysis.compareResults, each from cold caches
+
+    return: dict | seconds and stub server requests of both, and
+                   whether every query got the same results
+    params:
+            nJobs: int | job postings per query
+          latency: float | stub server seconds per request
+    """
+    corpus = fixtures.synthetic()
+    api = corpus['api']
+    api['data engineer'] = api['data scientist'][:3] + api['software engineer'][3:]
+    jobQueries = sorted(api)
+
+    # stub Indeed.com, fixture bkgd and fresh caches (restored at the end)
+    server = FixtureServer(corpus, latency).start()
+    tmpDir = tempfile.mkdtemp()
+    saved  = indeed.apiURL, cache.cacheDir, dict(background.indexes)
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    record = {'queries':len(jobQueries), 'postings':len(corpus['postings'])}
+
+    def cold(name):
+        cache.cacheDir = os.path.join(tmpDir, name)
+        cache.caches.clear()
+        server.nRequests = 0
+
+    try:
+        indeed.apiURL = server.apiURL()
+        fixtures.useBackground(fixtures.sqliteBackground(corpus, os.path.join(tmpDir, 'bkgd.db')))
+        background.getIndex('bkgd_words').snapshot()
+
+        # the /analyze calls a comparison page makes, all at once
+        cold('separate')
+        separate = {}
+        def analyze(q): separate[q] = analysis.getResults(q, nJobs)
+        threads = [threading.Thread(target=analyze, args=(q,)) for q in jobQueries]
+        t0 = time.time()
+        for t in threads: t.start()
+        for t in threads: t.join()
+        record['separate'] = {'seconds':time.time()-t0, 'requests':server.nRequests}
+
+        cold('compare')
+        t0 = time.time()
+        together, matrix = analysis.compareResults(jobQueries, nJobs)
+        record['compare'] = {'seconds':time.time()-t0, 'requests':server.nRequests}
+        record['identical'] = together == separate
+
+    finally:
+        sys.stdout = stdout
+        server.shutdown()
+        indeed.apiURL, cache.cacheDir = saved[0], saved[1]
+        cache.caches.clear()
+        with background.indexesLock:
+            background.indexes.clear()
+            background.indexes.update(saved[2])
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+    record['speedup'] = record['separate']['seconds'] / record['compare']['seconds']
+    return record
+
+
+def coldStart(statement):
+    """
+    return: float | wall time in seconds to run statement in a fresh
+                    python process (imports and first use included)
+    params:
+        statement: string | python code to run
+    """
+    t0 = time.time()
+    subprocess.check_call([sys.executable, '-c', statement],
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.time() - t0
+
+
+def benchLexicon(nWords=10000):
+    """
+    Time the cold start and per-lookup cost of lexicon.isWord against
+    nltk wordnet synsets (needs the lexicon built, python lexicon.py,
+    and the nltk wordnet data)
+
+    return: dict | cold start seconds, lookups per second and whether
+                   both agree on every word
+    params:
+           nWords: int | number of words to look up
+    """
+    # words with inflections and non-words, like low-bkgd query terms
+    docs  = descriptionCorpus(50, 400)
+    words = [w for d in docs for w in indeed.jdClean(d).split()]
+    words = [w+s for w, s in zip(words, ['', 's', 'ing', 'ed', 'er'] * len(words))][:nWords]
+    words += ['geese', 'children', 'ran', 'better', 'pythonic', 'hadoop', 'datas']
+
+    from nltk.corpus import wordnet
+    synsets = lambda: [bool(wordnet.synsets(w)) for w in words]
+    lookups = lambda: [lexicon.isWord(w) for w in words]
+
+    cold_old = coldStart("from nltk.corpus import wordnet; wordnet.synsets('skill')")
+    cold_new = coldStart("import lexicon; lexicon.isWord('skill')")
+    t_old, old = timeIt(synsets)
+    t_new, new = timeIt(lookups)
+
+    return {'words':len(words), 'coldNltk':cold_old, 'coldLexicon':cold_new,
+            'nltk':len(words)/t_old, 'lexicon':len(words)/t_new,
+            'speedup':t_old/t_new, 'identical':old == new}
+
+
+def main():
+
+    print '%10s %10s %12s %12s %10s %10s' % ('tokens', 'unique', 'scoreTerms',
+                                             'legacy', 'speedup', 'identical')
+    for r in benchScoreTerms():
+        print '%10d %10d %11.4fs %12s %10s %10s' % (r['tokens'], r['unique'], r['scoreTerms'],
+                    '%.4fs' % r['legacy'] if 'legacy' in r else '-',
+                    '%.1fx' % r['speedup'] if 'speedup' in r else '-',
+                    r.get('identical', '-'))
+
+    print
+    print '%10s %12s %12s %10s %10s' % ('tokens', 'collocations', 'legacy', 'speedup', 'identical')
+    for r in benchCollocations():
+        print '%10d %11.4fs %11.4fs %9.1fx %10s' % (r['tokens'], r['collocations'], r['legacy'],
+                                                   r['speedup'], r['identical'])
+
+    print
+    print '%10s %8s %8s %12s %12s %12s %12s %10s' % ('terms', 'nReturn', 'nBubbles', 'rank',
+          'legacy', 'bubbles', 'legacy', 'identical')
+    for r in benchRanking():
+        print '%10d %8d %8d %11.4fs %11.4fs %11.4fs %11.4fs %10s' % (r['terms'], r['nReturn'],
+              r['nBubbles'], r['rank'], r['legacyRank'], r['bubbles'], r['legacyBubbles'],
+              r['identical'])
+
+    print
+    r = benchIncremental()
+    print 'incremental analysis: %(postings)d postings x %(words)d words, %(rankings)d rankings' % r
+    print '  full recompute: %(full).3fs' % r
+    print '  incremental:    %(incremental).3fs (%(speedup).1fx, identical=%(identical)s)' % r
+
+    print
+    r = benchCompare()
+    print 'compare: %(queries)d overlapping job queries, %(postings)d postings' % r
+    print '  separately:    %.3fs, %d requests' % (r['separate']['seconds'], r['separate']['requests'])
+    print '  compared:      %.3fs, %d requests (%.1fx, identical=%s)' % (r['compare']['seconds'],
+          r['compare']['requests'], r['speedup'], r['identical'])
+
+    print
+    if lexicon.getLexicon() is None: return
+    r = benchLexicon()
+    print 'isWord: %(words)d words' % r
+    print '  nltk wordnet: %(coldNltk).2fs cold start, %(nltk).0f lookups/s' % r
+    print '  lexicon:      %(coldLexicon).2fs cold start, %(lexicon).0f lookups/s ' \
+          '(%(speedup).1fx, identical=%(identical)s)' % r
+
+
+if __name__ == '__main__':
+    main()
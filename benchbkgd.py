@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""
+benchbkgd.py
+Author: Brian Boates
+
+Benchmarks for the bkgd: compact counts, snapshots shared by worker
+processes, the connection pool and sharded builds
+
+usage: python benchbkgd.py
+"""
+import os, sys, gc, time, sqlite3, threading, tempfile, shutil
+import multiprocessing
+from Queue import Queue
+import numpy as np
+import indeed, cache, background, fixtures, compact, database, storage, metrics
+from benchtools import timeIt, wordBkgd, memoryKB, FixtureServer
+
+def dictBytes(d):
+    """
+    return: int | bytes held by a dict of str ---> int: the hash table
+                  plus every key and value object
+    """
+    return sys.getsizeof(d) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in d.iteritems())
+
+
+def benchCompact(sizes=(10000, 100000, 1000000), nLookups=100000):
+    """
+    Compare compact.CompactCounts with the dict it replaces for the
+    bkgd counts: bytes per entry, build time and lookups per second
+    (3/4 hits, 1/4 misses like query vocabularies)
+
+    return: list[dict] | one record per bkgd size
+    params:
+            sizes: list[int] | bkgd sizes in terms
+         nLookups: int | number of lookups to time
+    """
+    records = []
+    for n in sizes:
+        d_bkgd = wordBkgd(n)
+        terms  = d_bkgd.keys()
+        queries = [terms[i] for i in np.random.RandomState(5).randint(0, n, nLookups*3//4)]
+        queries += [t+'x' for t in queries[:nLookups//4]]
+
+        t_build, store = timeIt(compact.CompactCounts.fromItems, d_bkgd.iteritems(), repeat=1)
+        t_dict, old = timeIt(lambda: [d_bkgd.get(q, 0) for q in queries])
+        t_new, new  = timeIt(lambda: [store.get(q, 0) for q in queries])
+
+        records.append({'terms':n, 'dictBytes':dictBytes(d_bkgd)/float(n),
+                        'compactBytes':store.nbytes()/float(n), 'build':t_build,
+                        'dictLookups':len(queries)/t_dict, 'compactLookups':len(queries)/t_new,
+                        'identical':old == new and sorted(store.iteritems()) == sorted(d_bkgd.iteritems())})
+    return records
+
+
+def snapshotWorker(load, keys, ready, done, results):
+    """
+    Worker process for benchSnapshot: load the bkgd, look up keys,
+    report memory once every worker has loaded
+    """
+    before = memoryKB()
+    t0 = time.time()
+    counts = load().counts
+    seconds = time.time() - t0
+    hits = sum(1 for key in keys if counts.get(key) is not None)
+    gc.collect()
+    ready.put(None)
+    done.wait()
+    after = memoryKB()
+    results.put({'seconds':seconds, 'hits':hits,
+                 'pss':after.get('pss', 0) - before.get('pss', 0),
+                 'private':after.get('private', 0) - before.get('private', 0)})
+
+
+def benchSnapshot(nTerms=200000, nWorkers=4):
+    """
+    Memory and load time of nWorkers processes holding the bkgd:
+    each loading the table from the database (SQLite here) into a
+    CompactCounts, versus all mapping one exported snapshot file
+
+    return: dict | load seconds and memory (kB, summed over workers)
+                   for both, and whether every worker found every key
+    params:
+           nTerms: int | bkgd terms
+         nWorkers: int | worker processes
+    """
+    tmpDir = tempfile.mkdtemp()
+    try:
+        # a bkgd_words table and its snapshot file
+        path = os.path.join(tmpDir, 'bkgd.db')
+        d_bkgd = wordBkgd(nTerms)
+        con = sqlite3.connect(path)
+        database.createTables(con.cursor(), dialect='sqlite')
+        con.execute("INSERT INTO bkgd_jobkeys(jobkey) VALUES('fixture')")
+        con.executemany("INSERT INTO bkgd_words(term,count) VALUES(?,?)", d_bkgd.iteritems())
+        con.commit()
+        con.close()
+        def connect():
+            con = sqlite3.connect(path)
+            con.text_factory = str
+            return con
+        snapshot = os.path.join(tmpDir, 'bkgd_words.snapshot')
+        background.exportTable('bkgd_words', snapshot, connect=connect)
+        keys = d_bkgd.keys()[:10000]
+        del d_bkgd
+        gc.collect()
+
+        loaders = [('database', lambda: background.BkgdIndex('bkgd_words', connect=connect,
+                                                             path=False).snapshot()),
+                   ('snapshot', lambda: background.readSnapshot(snapshot))]
+        record = {'terms':nTerms, 'workers':nWorkers}
+        for name, load in loaders:
+            ready, results, done = multiprocessing.Queue(), multiprocessing.Queue(), multiprocessing.Event()
+            workers = [multiprocessing.Process(target=snapshotWorker,
+                                               args=(load, keys, ready, done, results))
+                       for i in range(nWorkers)]
+            for w in workers: w.start()
+            for w in workers: ready.get()
+            done.set()
+            stats = [results.get() for w in workers]
+            for w in workers: w.join()
+            record[name] = {'seconds':max(r['seconds'] for r in stats),
+                            'pss':sum(r['pss'] for r in stats),
+                            'private':sum(r['private'] for r in stats),
+                            'identical':all(r['hits'] == len(keys) for r in stats)}
+        record['fileKB'] = os.path.getsize(snapshot) // 1024
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+    return record
+
+
+class SlowConnectBackend(storage.SQLiteBackend):
+    """
+    SQLite backend with the connection setup time of a database
+    server (TCP handshake and authentication)
+    """
+    def __init__(self, path, latency):
+        storage.SQLiteBackend.__init__(self, path)
+        self.latency = latency
+
+    def connect(self):
+        time.sleep(self.latency)
+        return storage.SQLiteBackend.connect(self)
+
+
+def benchStorage(nTerms=10000, nRequests=400, nThreads=8, poolSize=4, connectLatency=0.005):
+    """
+    Requests of bkgd lookups from nThreads threads, each request
+    opening its own connection (as database.py and background.py
+    did) versus borrowing one from a storage.Pool of poolSize
+
+    return: dict | seconds and requests/s of both, the mean pool wait
+                   and query time, and whether both found the same counts
+    params:
+           nTerms: int | bkgd terms
+        nRequests: int | requests (20 lookups each)
+         nThreads: int | concurrent threads
+         poolSize: int | pooled connections
+   connectLatency: float | seconds to open a connection
+    """
+    tmpDir = tempfile.mkdtemp()
+    try:
+        # a bkgd_words table
+        path = os.path.join(tmpDir, 'bkgd.db')
+        d_bkgd = wordBkgd(nTerms)
+        con = sqlite3.connect(path)
+        database.createTables(con.cursor(), dialect='sqlite')
+        con.executemany("INSERT INTO bkgd_words(term,count) VALUES(?,?)", d_bkgd.iteritems())
+        con.commit()
+        con.close()
+        terms = d_bkgd.keys()
+        requests = [terms[i*20 % len(terms):i*20 % len(terms) + 20] for i in range(nRequests)]
+
+        backend = SlowConnectBackend(path, connectLatency)
+        pool = storage.Pool(backend, size=poolSize)
+        sql = "SELECT count FROM bkgd_words WHERE term = ?"
+
+        def perRequest(words):
+            con = backend.connect()
+            try:
+                cur = con.cursor()
+                return [cur.execute(sql, (w,)).fetchone()[0] for w in words]
+            finally:
+                con.close()
+
+        def pooled(words):
+            con = pool.connect()
+            try:
+                cur = con.cursor()
+                counts = []
+                for w in words:
+                    cur.execute(sql, (w,))
+                    counts.append(cur.fetchone()[0])
+                return counts
+            finally:
+                con.close()
+
+        def run(func):
+            todo, results = Queue(), {}
+            for i in range(nRequests): todo.put(i)
+            def worker():
+                while True:
+                    try: i = todo.get_nowait()
+                    except Exception: return
+                    results[i] = func(requests[i])
+            t0 = time.time()
+            threads = [threading.Thread(target=worker) for i in range(nThreads)]
+            for t in threads: t.start()
+            for t in threads: t.join()
+            return time.time() - t0, [results[i] for i in range(nRequests)]
+
+        record = {'requests':nRequests, 'threads':nThreads, 'poolSize':poolSize,
+                  'connectLatency':connectLatency}
+        record['perRequest'], expected = run(perRequest)
+        metrics.reset()
+        record['pooled'], found = run(pooled)
+        pool.close()
+
+        # mean pool wait and query time from the stage histograms
+        for stage in ['poolWait', 'query']:
+            h = metrics.values[('skillrank_stage_seconds', (('stage', stage),))]
+            record[stage] = h.sum / max(h.count, 1)
+        record['speedup'] = record['perRequest'] / record['pooled']
+        record['identical'] = found == expected
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+    return record
+
+
+def tableCounts(con):
+    """
+    return: dict | table ---> {term (or tuple of words): count} of the
+                   bkgd tables, and the set of jobkeys
+    params:
+              con: connection to a bkgd database
+    """
+    cur = con.cursor()
+    cur.execute("SELECT id, term, count FROM bkgd_words")
+    rows = cur.fetchall()
+    terms = dict((i, term) for i, term, count in rows)
+    tables = {'bkgd_words':dict((term, count) for i, term, count in rows)}
+    for table, columns in database.NGRAM_TABLES.iteritems():
+        cur.execute("SELECT "+','.join(columns)+",count FROM "+table)
+        tables[table] = dict((tuple(terms[i] for i in row[:-1]), row[-1]) for row in cur.fetchall())
+    cur.execute("SELECT jobkey FROM bkgd_jobkeys")
+    tables['bkgd_jobkeys'] = set(row[0] for row in cur.fetchall())
+    cur.close()
+    return tables
+
+
+def benchBuilder(procs=(1, 4), nJobs=50, shardSize=20, latency=0.005, pruneBelow=None):
+    """
+    Sharded bkgd builds (builder.build) of three overlapping job queries
+    from the fixture server into SQLite, against a serial build of the
+    same postings (fixtures.buildBackground)
+
+    return: list[dict] | seconds and postings of each build by number
+                         of processes, and whether its tables match the
+                         serial build
+    params:
+            procs: list[int] | numbers of worker processes
+            nJobs: int | job postings per query
+        shardSize: int | job postings per shard
+          latency: float | stub server seconds per request
+       pruneBelow: int | prune both builds' n-grams seen fewer times
+                         (see database.pruneNgrams, None keeps every count)
+    """
+    import builder
+    corpus = fixtures.synthetic()
+    api = corpus['api']
+    api['data engineer'] = api['data scientist'][:3] + api['software engineer'][3:]
+    jobQueries = sorted(api)
+
+    server = FixtureServer(corpus, latency).start()
+    tmpDir = tempfile.mkdtemp()
+    saved  = indeed.apiURL, cache.cacheDir
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    records = []
+    try:
+        indeed.apiURL = server.apiURL()
+        connect = fixtures.sqliteBackground(corpus, os.path.join(tmpDir, 'serial.db'))
+        con = connect()
+        if pruneBelow is not None:
+            with con: database.pruneNgrams(con.cursor(), pruneBelow)
+        expected = tableCounts(con)
+        con.close()
+
+        for n in procs:
+            backend = storage.SQLiteBackend(os.path.join(tmpDir, 'sharded%d.db' % n))
+            con = storage.connect(backend)
+            database.createTables(con.cursor(), dialect='sqlite')
+            con.commit()
+            con.close()
+            cache.cacheDir = os.path.join(tmpDir, 'cache%d' % n)
+            cache.caches.clear()
+
+            t0 = time.time()
+            nPostings = builder.build(jobQueries, nJobs, nProcs=n, shardSize=shardSize,
+                                      backend=backend, pruneBelow=pruneBelow)
+            seconds = time.time() - t0
+            con = storage.connect(backend)
+            found = tableCounts(con)
+            con.close()
+            records.append({'procs':n, 'shards':len(builder.makeShards(jobQueries, nJobs, shardSize)),
+                            'postings':nPostings, 'seconds':seconds, 'identical':found == expected,
+                            'pruneBelow':pruneBelow})
+    finally:
+        sys.stdout = stdout
+        server.shutdown()
+        indeed.apiURL, cache.cacheDir = saved
+        cache.caches.clear()
+        shutil.rmtree(tmpDir, ignore_errors=True)
+    return records
+
+
+def main():
+
+    print '%10s %12s %12s %10s %14s %14s %10s' % ('terms', 'dict', 'compact', 'build',
+                                                  'dict', 'compact', 'identical')
+    for r in benchCompact():
+        print '%10d %7.1f B/term %7.1f B/term %9.2fs %9.0f get/s %9.0f get/s %10s' % (r['terms'],
+              r['dictBytes'], r['compactBytes'], r['build'], r['dictLookups'],
+              r['compactLookups'], r['identical'])
+
+    print
+    r = benchSnapshot()
+    print 'bkgd in %(workers)d workers: %(terms)d terms, %(fileKB)d kB snapshot file' % r
+    for name in ['database', 'snapshot']:
+        print '  %-9s %6.3fs load, %8d kB pss, %8d kB private (identical=%s)' % (name+':',
+              r[name]['seconds'], r[name]['pss'], r[name]['private'], r[name]['identical'])
+
+    print
+    print '%6s %8s %10s %10s %10s %8s' % ('procs', 'shards', 'postings', 'seconds', 'identical',
+                                          'prune')
+    for r in benchBuilder() + benchBuilder(procs=(4,), pruneBelow=background.minNgramCount):
+        print '%6d %8d %10d %9.3fs %10s %8s' % (r['procs'], r['shards'], r['postings'],
+                                                r['seconds'], r['identical'], r['pruneBelow'])
+
+    print
+    r = benchStorage()
+    print 'storage: %(requests)d requests from %(threads)d threads, ' \
+          '%(connectLatency).3fs/connection' % r
+    print '  connection per request: %(perRequest).3fs' % r
+    print '  pool of %(poolSize)d:              %(pooled).3fs (%(speedup).1fx, identical=%(identical)s)' % r
+    print '  %.2f ms mean pool wait, %.3f ms mean query' % (r['poolWait']*1000, r['query']*1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+benchfetch.py
+Author: Brian Boates
+
+Benchmarks for getting job postings: the shared fetch pool,
+cleaning job descriptions and the parsing processes
+
+usage: python benchfetch.py
+"""
+import os, sys, re, threading, urllib2
+import multiprocessing
+from Queue import Queue, Empty
+import indeed, fetch, fixtures, parsepool
+from benchtools import timeIt, descriptionCorpus, StubServer, FixtureServer
+
+def legacyThreadResults(urls, nThreads=8):
+    """
+    The original indeed.threadResults: 8 new threads per call
+    (the removed indeed.getIndeed class), each posting on a new
+    urllib2 connection (reference for benchThreadResults)
+    """
+    q = Queue()
+    for url in urls: q.put(url)
+    documents = []
+
+    def getIndeed():
+        while True:
+            try: url = q.get_nowait()
+            except Empty: return
+            returnItems = indeed.parsePage(url, urllib2.urlopen(url).read())
+            documents.append(returnItems)
+            print returnItems[:-1]
+
+    threads = [threading.Thread(target=getIndeed) for i in xrange(nThreads)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return documents
+
+
+def benchThreadResults(nPostings=50, nRequests=5, latency=0.05, connectLatency=0.05):
+    """
+    Time indeed.threadResults against the legacy per-request
+    threads on a local stub server with injected latency
+
+    return: dict | timings (seconds per request) for both fetch paths
+    params:
+        nPostings: int | job postings per request
+        nRequests: int | number of requests (postings repeat across requests)
+          latency: float | stub server seconds per request
+   connectLatency: float | stub server seconds per new connection
+    """
+    server = StubServer(latency, connectLatency).start()
+    urls = server.postingURLs(nPostings)
+
+    # silence the per-posting logging while timing
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        t_old, old = timeIt(lambda: [legacyThreadResults(urls) for i in range(nRequests)], repeat=1)
+        t_new, new = timeIt(lambda: [indeed.threadResults(urls) for i in range(nRequests)], repeat=1)
+    finally:
+        sys.stdout = stdout
+        server.shutdown()
+
+    return {'postings':nPostings, 'requests':nRequests, 'latency':latency,
+            'connectLatency':connectLatency, 'workers':fetch.nWorkers,
+            'legacy':t_old/nRequests, 'pooled':t_new/nRequests, 'speedup':t_old/t_new,
+            'identical':sorted(old[-1]) == sorted(new[-1])}
+
+
+def legacyJdClean(jd):
+    """
+    The original indeed.jdClean: a replace over the whole description
+    for every ' wordPUNCTUATIONword ' term and a string built by
+    concatenation, quadratic in the description length (reference
+    for benchTokenizer)
+    """
+    jd = re.sub(r'<\w+>', ' ', jd)
+    jd = re.sub(r'</\w+>', ' ', jd)
+    jd = re.sub(r'<\w+/>', ' ', jd)
+    jd = re.sub(r"'\w\s", ' ', jd)
+    jd = re.sub('\\xe2\\x80\\x99\w', '', jd)
+    fix = re.findall(r'\s\w+[^\w\s]\w+\s', jd)
+    for term in fix:
+        punc = re.search(r'[^\w\s]', term).group()
+        if punc == '/' or punc == ',':
+            jd = jd.replace(punc,' and ')
+        else:
+            jd = jd.replace(term, term.replace(punc,''))
+    jd = re.sub('[^A-Za-z0-9\s\+\#-]+', ' ', jd)
+    jd = jd.lower()
+    jd = re.sub(r'\s\d+\s', ' ', jd)
+    jd = re.sub(r'\s[\+\#-]+\s', ' ', jd)
+    Nr = jd.split().count('r')
+    Nc = jd.split().count('c')
+    fix = re.findall(r'\w\w+', jd)
+    jdnew = ''
+    for f in fix: jdnew += f+' '
+    for i in range(Nr): jdnew += 'r '
+    for i in range(Nc): jdnew += 'c '
+    jd = jdnew
+    jd = re.sub(r'html\s+css','html and css', jd)
+    jd = jd.replace('objectoriented','object oriented')
+    jd = jd.replace('java script','javascript')
+    jd = jd.replace(' js ',' javascript ')
+    jd = jd.replace('css3','css')
+    return jd
+
+
+def benchTokenizer(nDocs=200, nWords=400):
+    """
+    Time indeed.jdClean against the original (legacyJdClean) on a
+    corpus of job descriptions and compare their token lists (jdClean
+    replaces "/" and "," before removing other punctuation rather than
+    in the order the terms are found, so descriptions mixing both can
+    differ)
+
+    return: dict | tokens per second for both and the fraction of
+                   descriptions with the same tokens
+    params:
+            nDocs: int | number of descriptions
+           nWords: int | words per description
+    """
+    docs = descriptionCorpus(nDocs, nWords)
+    t_old, old = timeIt(lambda: [legacyJdClean(d).split() for d in docs])
+    t_new, new = timeIt(lambda: [indeed.jdClean(d).split() for d in docs])
+    nTokens = sum(len(t) for t in new)
+    return {'docs':nDocs, 'tokens':nTokens, 'legacy':nTokens/t_old,
+            'jdClean':nTokens/t_new, 'speedup':t_old/t_new,
+            'same':sum(a == b for a, b in zip(old, new)) / float(nDocs)}
+
+
+def benchParsing(procs=None, nWords=4000, latency=0.005, repeat=3):
+    """
+    Download and parse the fixture postings (synthetic, with long
+    descriptions) through indeed.threadResults: parsed in the fetch
+    threads (0 processes) versus on parsepool processes
+
+    return: list[dict] | seconds per run for each number of processes,
+                         speedup over the fetch threads and whether the
+                         postings are identical
+    params:
+            procs: list[int] | numbers of processes (default=0 up to the
+                               core count, doubling)
+           nWords: int | words per job description
+          latency: float | stub server seconds per request
+           repeat: int | timing repeats
+    """
+    if procs is None:
+        procs, n = [0], 1
+        while n <= multiprocessing.cpu_count():
+            procs.append(n)
+            n *= 2
+    corpus = fixtures.synthetic(nWords=nWords)
+    saved = parsepool.nProcs
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    records, expected = [], None
+    try:
+        for n in procs:
+            # the pool is forked before the stub server starts its threads
+            parsepool.start(n)
+            server = FixtureServer(corpus, latency).start()
+            try:
+                urls = [server.url+'/viewjob?jk='+jobkey+'&amp;from=api'
+                        for jobkey in sorted(corpus['postings'])]
+                t, documents = timeIt(indeed.threadResults, urls, useCache=False, repeat=repeat)
+            finally:
+                server.shutdown()
+            if expected is None: expected, base = documents, t
+            records.append({'procs':n, 'postings':len(urls), 'seconds':t,
+                            'speedup':base/t, 'identical':documents == expected})
+    finally:
+        sys.stdout = stdout
+        parsepool.configure(procs=saved)
+    return records
+
+
+def main():
+
+    r = benchThreadResults()
+    print 'threadResults: %(postings)d postings x %(requests)d requests, ' \
+          '%(latency).3fs/request + %(connectLatency).3fs/connection' % r
+    print '  legacy threads: %(legacy).3fs/request' % r
+    print '  pooled fetch:   %(pooled).3fs/request (%(speedup).1fx, identical=%(identical)s)' % r
+
+    print
+    # typical postings, then very long ones (jdClean is quadratic there)
+    for nDocs, nWords in [(200, 400), (5, 40000)]:
+        r = benchTokenizer(nDocs, nWords)
+        print 'jdClean: %(docs)d descriptions, %(tokens)d tokens' % r
+        print '  legacy:  %(legacy).0f tokens/s' % r
+        print '  jdClean: %(jdClean).0f tokens/s (%(speedup).1fx, same tokens=%(same).3f)' % r
+
+    print
+    print '%6s %10s %10s %10s %10s' % ('procs', 'postings', 'seconds', 'speedup', 'identical')
+    for r in benchParsing():
+        print '%6d %10d %9.3fs %9.1fx %10s' % (r['procs'], r['postings'], r['seconds'],
+                                              r['speedup'], r['identical'])
+
+
+if __name__ == '__main__':
+    main()
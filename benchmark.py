@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+benchmark.py
+Author: Brian Boates
+
+Benchmarks for the skillrank analysis pipeline
+(synthetic data, no Indeed.com or MySQL access needed), by area:
+
+    benchanalysis.py | term scoring, collocations, ranking, lookups
+       benchfetch.py | fetch pool, jdClean and parsing processes
+        benchbkgd.py | compact counts, snapshots, pool, sharded builds
+     benchserving.py | precomputed results and batch analysis
+      benchstages.py | stage suite (see below)
+       benchtools.py | shared timing helpers, corpora and stub servers
+
+The stage suite replays the fixture corpus (see fixtures.py) from a
+local stub server against a fixture bkgd database, times every stage
+of an /analyze request and writes the timings as JSON, so runs on
+different commits can be compared.
+
+usage: python benchmark.py
+       python benchmark.py --stages [stages.json] [--latency seconds] [--mysql]
+       python benchmark.py --compare old.json new.json
+"""
+import sys, json
+import benchanalysis, benchfetch, benchbkgd, benchserving
+from benchstages import benchStages, compareStages, printStages
+
+def main():
+
+    # stage suite: time the stages and write them as json
+    if '--stages' in sys.argv:
+        args = sys.argv[sys.argv.index('--stages')+1:]
+        path = args[0] if args and not args[0].startswith('--') else 'stages.json'
+        try:
+            latency = float(sys.argv[sys.argv.index('--latency')+1])
+        except (ValueError, IndexError):
+            latency = 0.02
+        report = benchStages(latency=latency, mysql='--mysql' in sys.argv)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        printStages(report)
+        print 'wrote', path
+        return
+
+    # compare two stage reports (e.g. from different commits)
+    if '--compare' in sys.argv:
+        try:
+            args = sys.argv[sys.argv.index('--compare')+1:]
+            old, new = [json.load(open(path)) for path in args[:2]]
+        except (ValueError, IOError):
+            print '\n usage: '+sys.argv[0]+' --compare old.json new.json'
+            sys.exit(1)
+        print 'commit %s ---> %s' % (old['commit'], new['commit'])
+        print '%16s %12s %12s %10s' % ('stage', 'old', 'new', 'new/old')
+        for stage, a, b, ratio in compareStages(old, new):
+            print '%16s %12s %12s %10s' % (stage, '%.4fs' % a if a is not None else '-',
+                  '%.4fs' % b if b is not None else '-', '%.2fx' % ratio if ratio else '-')
+        return
+
+    # every area's benchmarks
+    benchanalysis.main()
+    print
+    benchfetch.main()
+    print
+    benchbkgd.main()
+    print
+    benchserving.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+benchserving.py
+Author: Brian Boates
+
+Benchmarks for serving results: the precomputed query_results
+table and offline batch analysis
+
+usage: python benchserving.py
+"""
+import os, sys, time, json, tempfile, shutil
+from collections import Counter
+import numpy as np
+import indeed, cache, background, fixtures, storage, scheduler
+from benchtools import percentile, FixtureServer
+
+def benchPrecompute(nQueries=30, nRequests=1500, ttl=1.0, analysisSeconds=0.05, topK=5, seed=5):
+    """
+    Latency of a zipfian stream of /analyze requests whose results
+    expire after ttl seconds: with the results cache only (every
+    expiry pays for an analysis) versus with the scheduler refreshing
+    the topK queries ahead of expiry and serving stale results
+
+    return: dict | p50/p99 latency in seconds of the topK queries and
+                   of all queries in both modes, and analyses run
+                   on requests
+    params:
+         nQueries: int | distinct job queries
+        nRequests: int | requests, spread over 4*ttl seconds
+              ttl: float | seconds results stay fresh
+  analysisSeconds: float | seconds of one analysis (the scrape)
+             topK: int | queries kept precomputed
+             seed: int | random seed
+    """
+    rng = np.random.RandomState(seed)
+    stream = ['query %d' % ((r-1) % nQueries) for r in rng.zipf(1.5, nRequests)]
+    popular = set(q for q, n in Counter(stream).most_common(topK))
+    gap = 4*ttl / nRequests
+
+    def analyze(jobQuery):
+        time.sleep(analysisSeconds)
+        return {'items':[{'term':jobQuery}], 'query':jobQuery}
+
+    def run(precompute):
+        tmpDir, sched = tempfile.mkdtemp(), None
+        try:
+            resultCache = cache.ResultCache(os.path.join(tmpDir, 'results.db'), ttl=ttl)
+            if precompute:
+                sched = scheduler.Scheduler(analyze, storage.SQLiteBackend(os.path.join(tmpDir, 'q.db')),
+                                            topK=topK, maxAge=ttl, staleAge=100*ttl, refreshAhead=0.5,
+                                            interval=ttl/10, flushEvery=ttl/10, lease=10*ttl)
+            latencies, misses = {}, 0
+            for jobQuery in stream:
+                t0 = time.time()
+                results = resultCache.get(jobQuery)
+                if results is None and sched is not None:
+                    sched.hit(jobQuery)
+                    results = sched.lookup(jobQuery)
+                elif sched is not None:
+                    sched.hit(jobQuery)
+                if results is None:
+                    misses += 1
+                    results = analyze(jobQuery)
+                    resultCache.set(jobQuery, results)
+                    if sched is not None: sched.store(jobQuery, results)
+                latencies.setdefault(jobQuery, []).append(time.time()-t0)
+                time.sleep(gap)
+            top = [t for q in popular for t in latencies[q]]
+            every = [t for ts in latencies.values() for t in ts]
+            return {'p50':percentile(top, 50), 'p99':percentile(top, 99),
+                    'allP99':percentile(every, 99), 'analyses':misses}
+        finally:
+            if sched is not None: sched.stop()
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+    return {'queries':nQueries, 'requests':nRequests, 'ttl':ttl, 'topK':topK,
+            'analysisSeconds':analysisSeconds, 'cache':run(False), 'precompute':run(True)}
+
+
+def benchBatch(nProcs=2, nJobs=50, latency=0.005):
+    """
+    Offline batch analysis (batch.runBatch) of the fixture job queries
+    from an input file with repeated queries (other spellings) and bad
+    lines: a full run, then a run resumed from an output file holding
+    one result, one failure and a truncated line
+
+    return: dict | seconds of both runs, their done/failed/skipped counts,
+                   whether every query has exactly one result in the
+                   resumed output and whether those match the full run
+    params:
+           nProcs: int | worker processes
+            nJobs: int | job postings per query (batch analyzes 50)
+          latency: float | stub server seconds per request
+    """
+    import batch
+    corpus = fixtures.synthetic(nJobs=nJobs)
+    jobQueries = sorted(corpus['api'])
+
+    # every query as written, again with another spelling, then bad lines
+    lines  = [json.dumps(q) for q in jobQueries]
+    lines += [json.dumps({'title':'  '+q.upper()+' '}) for q in jobQueries]
+    lines += ['{"jobQuery": "data sci', json.dumps({'location':'SF'}), '42', '']
+
+    server = FixtureServer(corpus, latency).start()
+    tmpDir = tempfile.mkdtemp()
+    saved  = indeed.apiURL, cache.cacheDir, dict(background.indexes)
+    inPath = os.path.join(tmpDir, 'queries.jsonl')
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    record = {'queries':len(jobQueries), 'procs':nProcs}
+
+    def results(path):
+        found = {}
+        for line in open(path):
+            try: item = json.loads(line)
+            except ValueError: continue
+            if 'results' in item:
+                found.setdefault(cache.normalizeQuery(item['jobQuery']), []).append(item['results'])
+        return found
+
+    try:
+        indeed.apiURL = server.apiURL()
+        fixtures.useBackground(fixtures.sqliteBackground(corpus, os.path.join(tmpDir, 'bkgd.db')))
+        with open(inPath, 'w') as f:
+            f.write('\n'.join(lines)+'\n')
+
+        # full run from cold caches
+        cache.cacheDir = os.path.join(tmpDir, 'full')
+        cache.caches.clear()
+        fullPath = os.path.join(tmpDir, 'full.jsonl')
+        t0 = time.time()
+        record['full'] = batch.runBatch(inPath, fullPath, nProcs=nProcs, resume=False)
+        record['full']['seconds'] = time.time() - t0
+        expected = results(fullPath)
+
+        # an interrupted run: one result, one failure, a truncated line
+        cache.cacheDir = os.path.join(tmpDir, 'resumed')
+        cache.caches.clear()
+        resumedPath = os.path.join(tmpDir, 'resumed.jsonl')
+        with open(resumedPath, 'w') as f:
+            f.write(json.dumps({'jobQuery':jobQueries[0].title(),
+                                'results':expected[jobQueries[0]][0]})+'\n')
+            f.write(json.dumps({'jobQuery':jobQueries[1], 'error':'timeout'})+'\n')
+            f.write('{"jobQuery": "'+jobQueries[-1])
+        t0 = time.time()
+        record['resumed'] = batch.runBatch(inPath, resumedPath, nProcs=nProcs)
+        record['resumed']['seconds'] = time.time() - t0
+        found = results(resumedPath)
+        record['once'] = (sorted(found) == jobQueries and
+                          all(len(r) == 1 for r in found.values()))
+        record['identical'] = found == expected
+
+    finally:
+        sys.stdout = stdout
+        server.shutdown()
+        indeed.apiURL, cache.cacheDir = saved[0], saved[1]
+        cache.caches.clear()
+        with background.indexesLock:
+            background.indexes.clear()
+            background.indexes.update(saved[2])
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+    return record
+
+
+def main():
+
+    r = benchPrecompute()
+    print 'precompute: %(requests)d requests of %(queries)d queries, %(ttl).1fs ttl, ' \
+          '%(analysisSeconds).3fs/analysis, top %(topK)d precomputed' % r
+    for name in ['cache', 'precompute']:
+        print '  %-11s top p50 %.4fs, top p99 %.4fs, all p99 %.4fs, %d analyses on requests' % (
+              name+':', r[name]['p50'], r[name]['p99'], r[name]['allP99'], r[name]['analyses'])
+
+    print
+    r = benchBatch()
+    print 'batch: %(queries)d job queries (each twice, plus bad lines) on %(procs)d processes' % r
+    for name in ['full', 'resumed']:
+        print '  %-8s %.3fs, done %d, failed %d, skipped %d' % (name+':', r[name]['seconds'],
+              r[name]['done'], r[name]['failed'], r[name]['skipped'])
+    print '  every query once: %(once)s (identical=%(identical)s)' % r
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+benchstages.py
+Author: Brian Boates
+
+Stage suite: replays the fixture corpus (see fixtures.py) from a
+local stub server against a fixture bkgd database, times every stage
+of an /analyze request and writes the timings as JSON, so runs on
+different commits can be compared (see benchmark.py)
+"""
+import os, sys, time, tempfile, shutil
+import analysis, indeed, fetch, cache, background, fixtures
+from benchtools import timeIt, gitCommit, FixtureServer
+
+def benchStages(corpus=None, nJobs=50, latency=0.02, repeat=3, mysql=False):
+    """
+    Time every stage of /analyze on the fixture corpus: the stub server
+    replays the corpus with "latency" seconds per request and the bkgd
+    indexes read a fixture database built from the corpus postings
+
+    return: dict | report: commit, configuration and, for every stage,
+                   its best time in seconds over "repeat" runs for all
+                   corpus job queries, the number of items and seconds
+                   per item
+    params:
+           corpus: dict | fixture corpus (default=fixtures.load())
+            nJobs: int | job postings per query (as in analysis.refreshQuery)
+          latency: float | stub server seconds per request
+           repeat: int | timing repeats per stage
+            mysql: bool | build the fixture bkgd in MySQL rather than SQLite
+    """
+    import routes
+    if corpus is None: corpus = fixtures.load()
+    jobQueries = sorted(corpus['api'])
+
+    # stub Indeed.com, fixture bkgd and fresh caches (restored at the end)
+    server  = FixtureServer(corpus, latency).start()
+    tmpDir  = tempfile.mkdtemp()
+    saved   = indeed.apiURL, cache.cacheDir, dict(background.indexes)
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    stages = {}
+
+    def record(stage, seconds, items, unit):
+        stages[stage] = {'seconds':seconds, 'items':items, 'unit':unit,
+                         'perItem':seconds/max(items, 1)}
+
+    try:
+        indeed.apiURL = server.apiURL()
+        if mysql: connect = fixtures.mysqlBackground(corpus)
+        else:     connect = fixtures.sqliteBackground(corpus, os.path.join(tmpDir, 'bkgd.db'))
+        fixtures.useBackground(connect)
+        t, bkgd = timeIt(lambda: background.getIndex('bkgd_words').snapshot(), repeat=1)
+        record('bkgdLoad', t, len(bkgd), 'term')
+
+        # api pages
+        t, urls = timeIt(lambda: [indeed.getJobURLs(q, nURLs=nJobs) for q in jobQueries],
+                         repeat=repeat)
+        record('getJobURLs', t, len(jobQueries), 'query')
+
+        # posting pages, one at a time
+        allURLs = [url for u in urls for url in u]
+        t, documents = timeIt(lambda: [indeed.parseJobPosting(url) for url in allURLs],
+                              repeat=repeat)
+        record('parseJobPosting', t, len(allURLs), 'posting')
+
+        # cleaning the descriptions alone
+        pages = [corpus['postings'][indeed.jobkeyFromURL(url)] for url in allURLs]
+        descriptions = [indeed.jobDescription(raw.replace('\n',' ')) for raw in pages]
+        t, words = timeIt(lambda: [indeed.jdClean(jd) for jd in descriptions], repeat=repeat)
+        record('jdClean', t, len(descriptions), 'posting')
+
+        # analysis of each query's terms
+        terms, i = [], 0
+        for u in urls:
+            terms.append([w for d in documents[i:i+len(u)] for w in d[-1]])
+            i += len(u)
+        t, results = timeIt(lambda: [analysis.analyze(None, q, ts)
+                                     for q, ts in zip(jobQueries, terms)], repeat=repeat)
+        record('analyze', t, len(jobQueries), 'query')
+        topWords = [[r[0] for r in res[0]] for res in results]
+        t, bigrams = timeIt(lambda: [analysis.bestBigrams(ts, tw)
+                                     for ts, tw in zip(terms, topWords)], repeat=repeat)
+        record('bestBigrams', t, len(jobQueries), 'query')
+
+        # end-to-end /analyze with cold posting and results caches
+        best = None
+        for r in range(repeat):
+            cache.cacheDir = os.path.join(tmpDir, 'cache%d' % r)
+            cache.caches.clear()
+            client = routes.app.test_client()
+            t0 = time.time()
+            for q in jobQueries:
+                response = client.post('/analyze', data={'jobQuery':q})
+                assert response.status_code == 200, response.status_code
+            dt = time.time() - t0
+            if best is None or dt < best: best = dt
+        record('/analyze', best, len(jobQueries), 'query')
+
+    finally:
+        sys.stdout = stdout
+        server.shutdown()
+        indeed.apiURL, cache.cacheDir = saved[0], saved[1]
+        cache.caches.clear()
+        with background.indexesLock:
+            background.indexes.clear()
+            background.indexes.update(saved[2])
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+    return {'commit':gitCommit(), 'date':time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python':sys.version.split()[0],
+            'config':{'jobQueries':jobQueries, 'postings':len(allURLs), 'nJobs':nJobs,
+                      'latency':latency, 'repeat':repeat,
+                      'bkgd':'mysql' if mysql else 'sqlite', 'workers':fetch.nWorkers},
+            'stages':stages}
+
+
+def compareStages(old, new):
+    """
+    return: list[tuple(stage, old seconds, new seconds, new/old)] | stages
+                            of two benchStages reports (None if missing)
+    params:
+              old: dict | baseline benchStages report
+              new: dict | benchStages report to compare
+    """
+    rows = []
+    for stage in sorted(set(old['stages']) | set(new['stages'])):
+        a = old['stages'].get(stage, {}).get('seconds')
+        b = new['stages'].get(stage, {}).get('seconds')
+        rows.append((stage, a, b, b/a if a and b is not None else None))
+    return rows
+
+
+def printStages(report):
+    print 'stages: %d postings for %s (%.3fs/request, commit %s)' % (report['config']['postings'],
+          ', '.join(report['config']['jobQueries']), report['config']['latency'], report['commit'])
+    print '%16s %12s %8s %14s' % ('stage', 'seconds', 'items', 'per item')
+    for stage in sorted(report['stages'], key=lambda s: -report['stages'][s]['seconds']):
+        r = report['stages'][stage]
+        print '%16s %11.4fs %8d %12.6fs/%s' % (stage, r['seconds'], r['items'],
+                                               r['perItem'], r['unit'])
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""
+benchtools.py
+Author: Brian Boates
+
+Shared benchmark helpers: timing, zipfian corpora and bkgds, and
+the local stub servers standing in for Indeed.com
+"""
+import os, time, threading, urlparse, subprocess
+import BaseHTTPServer, SocketServer
+import numpy as np
+import cache, fixtures
+
+def timeIt(func, *args, **kwargs):
+    """
+    return: float, object | best wall time in seconds and the return value
+    params:
+           func: callable | function to time
+         repeat: int | number of timing repeats (keyword only, default=3)
+    """
+    repeat = kwargs.pop('repeat', 3)
+    best, value = None, None
+    for i in range(repeat):
+        t0 = time.time()
+        value = func(*args, **kwargs)
+        dt = time.time() - t0
+        if best is None or dt < best: best = dt
+    return best, value
+
+
+def zipfCorpus(nTokens, nVocab=50000, a=1.2, seed=0):
+    """
+    return: list[string] | synthetic terms list with a zipfian distribution
+    params:
+          nTokens: int | number of tokens to generate
+           nVocab: int | maximum vocabulary size
+                a: float | zipf distribution exponent
+             seed: int | random seed
+    """
+    rng = np.random.RandomState(seed)
+    ranks = rng.zipf(a, nTokens) % nVocab
+    return ['w'+str(r) for r in ranks]
+
+
+def zipfBkgd(nVocab=50000, missing=0.05, seed=1):
+    """
+    return: dict | synthetic bkgd terms and counts
+    params:
+           nVocab: int | bkgd vocabulary size
+          missing: float | fraction of vocabulary left out of the bkgd
+             seed: int | random seed
+    """
+    rng = np.random.RandomState(seed)
+    d_bkgd = {}
+    for r in range(nVocab):
+        if rng.rand() < missing: continue
+        d_bkgd['w'+str(r)] = int(1e6/(r+1)) + rng.randint(0, 3)
+    return d_bkgd
+
+
+def wordBkgd(nTerms, seed=4):
+    """
+    return: dict | synthetic bkgd of nTerms random lower-case words
+                   (3 to 14 letters) with zipfian counts
+    params:
+           nTerms: int | number of terms
+             seed: int | random seed
+    """
+    rng = np.random.RandomState(seed)
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    d_bkgd = {}
+    while len(d_bkgd) < nTerms:
+        term = ''.join(letters[rng.randint(0, 26, rng.randint(3, 15))])
+        d_bkgd[term] = int(1e6/(len(d_bkgd)+1)) + 1
+    return d_bkgd
+
+
+def descriptionCorpus(nDocs=200, nWords=400, seed=2):
+    """
+    return: list[string] | synthetic job descriptions with the mark-up,
+                           punctuation and synonym cases jdClean handles
+    params:
+            nDocs: int | number of descriptions
+           nWords: int | words per description
+             seed: int | random seed
+    """
+    rng = np.random.RandomState(seed)
+    extras = ['<b>', '</b>', '<br/>', "don't", "client's", 'and/or', 'a,b', 'e.g.',
+              'object-oriented', 'objectoriented', 'Java Script', 'JS', 'js', 'HTML CSS',
+              'css3', 'C', 'R', 'C++', 'C#', '5+', '10', '2013', '-', '+', '(SQL)',
+              'node.js', 'Ph.D.', 'u.s.', '\xe2\x80\x99s', '&amp;', 'R/Python']
+    docs = []
+    for i in range(nDocs):
+        words = ['w'+str(r % 3000) for r in rng.zipf(1.3, nWords)]
+        for j in rng.randint(0, nWords, nWords//8):
+            words[j] = extras[rng.randint(len(extras))]
+        seps = rng.choice([' ', ' ', ' ', '  ', '\n', ', ', '. '], nWords)
+        docs.append(''.join(w+s for w, s in zip(words, seps)))
+    return docs
+
+
+def postingHTML(jobkey, nWords=300):
+    """
+    return: string | synthetic Indeed.com job posting page, laid
+                     out the way indeed.parseJobPosting expects
+    params:
+           jobkey: string | job posting ID (seeds the description)
+           nWords: int | number of words in the description
+    """
+    rng = np.random.RandomState(int(jobkey, 16) % 2**32)
+    words = ['w'+str(r % 5000) for r in rng.zipf(1.2, nWords)]
+    for i in range(0, nWords, 12): words[i] += rng.choice(['.', ',', ' and/or', ';'])
+    html  = '<html><head><title>Data Scientist job - Acme - San Francisco, CA | Indeed.com'
+    html += '</title></head><body>\n<span class="company">Acme</span> - '
+    html += '<span class="location">San Francisco, CA</span>\n'
+    html += '<span class="summary">'+' '.join(words)+'</span>\n'
+    html += '<span class="sdn">Acme - 3 days ago</span></body></html>'
+    return html
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Keep-alive request handler for StubServer
+    """
+    protocol_version = 'HTTP/1.1'
+
+    # send each response in one packet (no delayed-ack stalls)
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # a new connection costs a handshake
+        time.sleep(self.server.connectLatency)
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        self.server.nRequests += 1
+        body = self.server.page(self.path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A local stand-in for Indeed.com that injects latency:
+    "latency" seconds per request plus "connectLatency" seconds
+    for every new connection
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.05, connectLatency=0.05, port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), StubHandler)
+        self.latency, self.connectLatency = latency, connectLatency
+        self.nRequests = 0
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def page(self, path):
+        jobkey = path.split('jk=')[-1].split('&')[0]
+        return postingHTML(jobkey)
+
+    def postingURLs(self, n, offset=0):
+        """
+        return: list[string] | n job posting URL's served by the stub
+        """
+        return [self.url+'/viewjob?jk=%016x&amp;from=api' % (offset+i) for i in range(n)]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+class FixtureServer(StubServer):
+    """
+    StubServer replaying a fixture corpus: api pages for the corpus
+    job queries and their job posting pages
+    """
+    def __init__(self, corpus, latency=0.02, connectLatency=0.0, port=0):
+        StubServer.__init__(self, latency, connectLatency, port)
+        self.corpus = corpus
+
+    def page(self, path):
+        url = urlparse.urlparse(path)
+        params = urlparse.parse_qs(url.query)
+
+        # api page: q="job+query"&start=N
+        if url.path.endswith('apisearch'):
+            jobQuery = cache.normalizeQuery(params.get('q', [''])[0].strip('"'))
+            pages = self.corpus['api'].get(jobQuery, [])
+            i = int(params.get('start', ['0'])[0]) // 10
+            if i >= len(pages): return '<response></response>'
+            return pages[i].replace(fixtures.HOST, self.url)
+
+        # job posting page: jk=jobkey
+        jobkey = params.get('jk', [''])[0]
+        return self.corpus['postings'].get(jobkey, '')
+
+    def apiURL(self):
+        """
+        return: string | indeed.apiURL for this server
+        """
+        return self.url+'/ads/apisearch?publisher=fixture&v=2'
+
+
+def memoryKB():
+    """
+    return: dict | proportional (Pss) and private memory of this process
+                   in kB (from /proc/self/smaps_rollup, empty elsewhere)
+    """
+    stats = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB': stats[parts[0].rstrip(':')] = int(parts[1])
+    except IOError:
+        return {}
+    return {'pss':stats.get('Pss', 0),
+            'private':stats.get('Private_Clean', 0) + stats.get('Private_Dirty', 0)}
+
+
+def percentile(values, q):
+    """
+    return: float | q-th percentile (0-100) of values
+    """
+    return float(np.percentile(values, q)) if values else float('nan')
+
+
+def gitCommit():
+    """
+    return: string | current git commit of the package (None outside git)
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
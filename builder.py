@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""
+builder.py
+Author: Brian Boates
+
+Sharded map-reduce build of the bkgd tables. The crawl is split
+into shards (a job query and a range of api start offsets) run on
+a pool of worker processes:
+
+list:    each shard lists the jobkeys and URL's of its postings
+assign:  every new jobkey goes to the first shard that listed it
+         (jobkeys already in bkgd_jobkeys go to none)
+count:   each shard downloads its postings and counts their words,
+         bigrams and trigrams into a partial file
+merge:   the partial counts are summed and loaded into the tables
+         in one transaction (rare n-grams are kept: they are only
+         left out when the bkgd is read, see background.minNgramCount)
+prune:   optional (--prune N), n-grams seen fewer than N times are
+         deleted from the tables (database.pruneNgrams)
+
+The tables end up with the same counts as a serial build
+(database.populateTables) of the same postings.
+
+usage: python builder.py "job query" ["job query" ...] [--jobs N] [--procs N] [--shard N] [--prune N]
+"""
+import os, sys, time, tempfile, shutil
+import cPickle as pickle
+from collections import Counter
+from multiprocessing import Pool
+import indeed, database, storage
+
+
+def makeShards(jobQueries, nJobs, shardSize=100, start=0):
+    """
+    return: list[tuple(string, int, int)] | (job query, start, nJobs) of
+                                            every shard, in crawl order
+    params:
+       jobQueries: list[string] | job queries to crawl
+            nJobs: int | job postings per query
+        shardSize: int | job postings per shard (a multiple of the 10
+                         postings of an api page)
+            start: int | index for api job search starting point
+    """
+    return [(jobQuery, s, min(shardSize, start+nJobs-s))
+            for jobQuery in jobQueries for s in range(start, start+nJobs, shardSize)]
+
+
+def listShard(shard):
+    """
+    return: list[tuple(string, string)] | (jobkey, url) of the shard's
+                                          postings, in api order
+    params:
+            shard: tuple(string, int, int) | job query, start and nJobs
+    """
+    jobQuery, start, nJobs = shard
+    urls = indeed.getJobURLs(jobQuery, nURLs=nJobs, start=start)
+    return [(indeed.jobkeyFromURL(url), url) for url in urls]
+
+
+def assignPostings(listings, known):
+    """
+    return: list[list[string]] | URL's each shard downloads: a jobkey
+                                 goes to the first shard listing it
+    params:
+         listings: list[list[tuple(string, string)]] | (jobkey, url) of
+                                                       every shard
+            known: set | jobkeys already in the database (skipped)
+    """
+    seen, assigned = set(known), []
+    for listing in listings:
+        urls = []
+        for jobkey, url in listing:
+            if jobkey in seen: continue
+            seen.add(jobkey)
+            urls.append(url)
+        assigned.append(urls)
+    return assigned
+
+
+def countPostings(allwords):
+    """
+    return: dict | table ---> Counter of its terms (words, and word
+                   tuples for the n-gram tables; n-grams don't cross
+                   job postings, as in database.insertNgrams)
+    params:
+         allwords: list[list[string]] | words of each job posting
+    """
+    counts = {'bkgd_words':Counter()}
+    for table in database.NGRAM_TABLES: counts[table] = Counter()
+    for words in allwords:
+        counts['bkgd_words'].update(words)
+        for table, columns in database.NGRAM_TABLES.iteritems():
+            counts[table].update(zip(*[words[j:] for j in range(len(columns))]))
+    return counts
+
+
+def countShard(args):
+    """
+    Download and count the postings of one shard into a partial file
+    return: string | path of the partial file
+    params:
+             args: tuple(int, list[string], string) | shard number, its
+                                                      URL's and the
+                                                      directory for
+                                                      partial files
+    """
+    i, urls, partDir = args
+    documents = indeed.threadResults(urls, nThreads=8)
+    part = countPostings([d[-1] for d in documents])
+    part['jobkeys'] = [d[0] for d in documents]
+
+    path = os.path.join(partDir, 'shard%05d.pickle' % i)
+    with open(path, 'wb') as f:
+        pickle.dump(part, f, 2)
+    return path
+
+
+def mergePartials(paths):
+    """
+    return: list[string], dict | jobkeys and summed counts of the partial files
+    params:
+            paths: list[string] | partial files (see countShard)
+    """
+    jobkeys, counts = [], countPostings([])
+    for path in paths:
+        with open(path, 'rb') as f:
+            part = pickle.load(f)
+        jobkeys += part.pop('jobkeys')
+        for table, partCounts in part.iteritems():
+            counts[table].update(partCounts)
+    return jobkeys, counts
+
+
+def loadCounts(con, jobkeys, counts):
+    """
+    Add merged counts to the bkgd tables in one transaction
+    params:
+              con: connection to skillrank database (from storage.connect)
+          jobkeys: list[string] | jobkeys of the counted postings (new ones)
+           counts: dict | table ---> Counter (see countPostings)
+    """
+    dialect = con.dialect
+    cur = con.cursor()
+    try:
+        cur.executemany("INSERT INTO bkgd_jobkeys(jobkey) VALUES(?)", [(k,) for k in jobkeys])
+        database.upsertCounts(cur, 'bkgd_words', counts['bkgd_words'], dialect=dialect)
+
+        # n-grams are keyed by the ids of their words
+        wordIds = {}
+        database.loadWordIds(cur, counts['bkgd_words'], wordIds)
+        for table, columns in sorted(database.NGRAM_TABLES.items()):
+            ngrams = dict((tuple(wordIds[w] for w in gram), n)
+                          for gram, n in counts[table].iteritems())
+            database.upsertCounts(cur, table, ngrams, columns=columns, dialect=dialect)
+
+        con.commit()
+    except:
+        con.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def build(jobQueries, nJobs, nProcs=4, shardSize=100, start=0, backend=None, pruneBelow=None):
+    """
+    Crawl job postings for jobQueries on nProcs worker processes and
+    add their counts to the bkgd tables
+    return: int | number of new postings loaded
+    params:
+       jobQueries: list[string] | job queries to crawl
+            nJobs: int | job postings per query
+           nProcs: int | number of worker processes
+        shardSize: int | job postings per shard
+            start: int | index for api job search starting point
+          backend: storage.Backend | database of the bkgd tables
+                                     (default storage backend if None)
+       pruneBelow: int | if given, delete n-grams seen fewer times once
+                         the counts are loaded (see database.pruneNgrams,
+                         default None keeps every count)
+    """
+    t0 = time.time()
+    shards = makeShards(jobQueries, nJobs, shardSize=shardSize, start=start)
+    partDir = tempfile.mkdtemp(prefix='skillrank-build-')
+    pool = Pool(nProcs)
+    con = storage.connect(backend)
+    try:
+        # the upserts need the unique keys of the tables
+        cur = con.cursor()
+        database.requireKeys(cur, con.dialect)
+        cur.close()
+
+        # list the postings of every shard, then give each new
+        # jobkey to a single shard
+        listings = pool.map(listShard, shards)
+        cur = con.cursor()
+        known = database.loadJobkeys(cur)
+        cur.close()
+        assigned = assignPostings(listings, known)
+        print len(shards), 'shards,', sum(map(len, listings)), 'postings listed,', \
+              sum(map(len, assigned)), 'new'
+
+        # count the shards as the workers finish them
+        work = [(i, urls, partDir) for i, urls in enumerate(assigned) if urls]
+        paths = []
+        for path in pool.imap_unordered(countShard, work):
+            paths.append(path)
+            print 'counted', len(paths), 'out of', len(work), 'shards'
+
+        # merge the partial counts and load them in one transaction
+        jobkeys, counts = mergePartials(sorted(paths))
+        loadCounts(con, jobkeys, counts)
+
+        # optionally prune the rare n-grams
+        if pruneBelow is not None:
+            with con:
+                cur = con.cursor()
+                print 'pruned', database.pruneNgrams(cur, pruneBelow), \
+                      'n-grams seen fewer than', pruneBelow, 'times'
+                cur.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        con.close()
+        shutil.rmtree(partDir, ignore_errors=True)
+
+    # report the posting throughput
+    elapsed = time.time() - t0
+    print "loaded", len(jobkeys), "postings in %.1f s (%.1f postings/s)" % \
+          (elapsed, len(jobkeys) / max(elapsed, 1e-9))
+    return len(jobkeys)
+
+
+def main():
+
+    # retrieve user input
+    args = sys.argv[1:]
+    options = {'--jobs':100, '--procs':4, '--shard':100, '--prune':None}
+    try:
+        for name in options:
+            if name in args:
+                i = args.index(name)
+                options[name] = int(args[i+1])
+                del args[i:i+2]
+        assert args
+    except (IndexError, ValueError, AssertionError):
+        print '\n usage: '+sys.argv[0]+' "job query" ["job query" ...] ' \
+              '[--jobs N] [--procs N] [--shard N] [--prune N]'
+        sys.exit(1)
+
+    build(args, options['--jobs'], nProcs=options['--procs'], shardSize=options['--shard'],
+          pruneBelow=options['--prune'])
+
+
+if __name__ == '__main__':
+    main()
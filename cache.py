@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+cache.py
+Author: Brian Boates
+
+SQLite backed caches for the skillrank package. The cache
+files live on local disk and are shared by every thread and
+worker process on the host (SQLite does the locking).
+"""
+import os, time, sqlite3, threading, contextlib
+import cPickle as pickle
+
+# directory for the cache files
+cacheDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+# seconds /analyze results are cached (routes.py caps it at the
+# scheduler's maxAge, so a cached result never hides a refresh)
+resultTTL = 86400.0
+
+
+class DiskCache(object):
+    """
+    A key ---> value cache stored in a SQLite file, with a time
+    to live for every entry and least-recently-used eviction once
+    there are more than maxEntries entries. Hit and miss counters
+    are kept for the current process.
+    """
+    def __init__(self, path, maxEntries=10000, ttl=86400.0, evictEvery=100):
+        self.path       = path
+        self.maxEntries = maxEntries
+        self.ttl        = ttl
+        self.evictEvery = evictEvery
+        self.hits, self.misses, self.writes = 0, 0, 0
+        self.lock  = threading.Lock()
+        self.local = threading.local()
+
+        # create the cache file and table
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            try: os.makedirs(directory)
+            except OSError: pass
+        con = self.connection()
+        con.execute("CREATE TABLE IF NOT EXISTS entries(key TEXT PRIMARY KEY, \
+                     value BLOB, created REAL, accessed REAL)")
+        con.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+
+    def connection(self):
+        """
+        return: sqlite3 connection for the current thread (and process)
+        """
+        con = getattr(self.local, 'con', None)
+        if con is None or self.local.pid != os.getpid():
+            con = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.text_factory = str
+            self.local.con, self.local.pid = con, os.getpid()
+        return con
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Run the statements of a with block in one transaction (the
+        connection is in autocommit mode, so without BEGIN ... COMMIT
+        every row of an executemany is committed on its own)
+        return: sqlite3 connection for the current thread
+        """
+        con = self.connection()
+        con.execute("BEGIN")
+        try:
+            yield con
+        except:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+
+    def count(self, hits=0, misses=0):
+        with self.lock:
+            self.hits   += hits
+            self.misses += misses
+
+    def get(self, key, default=None):
+        """
+        return: cached value for key (default if missing or expired)
+        params:
+              key: string | cache key
+          default: value to return on a miss
+        """
+        return self.getMany([key]).get(key, default)
+
+    def getMany(self, keys):
+        """
+        return: dict | key ---> value for the keys that are cached
+        params:
+             keys: list[string] | cache keys
+        """
+        keys = list(keys)
+        if not keys: return {}
+        con, now = self.connection(), time.time()
+
+        found = {}
+        for i in range(0, len(keys), 500):
+            part = keys[i:i+500]
+            rows = con.execute("SELECT key, value, created FROM entries WHERE key IN ("+ \
+                               ','.join(['?']*len(part))+")", part).fetchall()
+            for key, value, created in rows:
+                if now - created <= self.ttl:
+                    found[key] = pickle.loads(str(value))
+
+        # mark the hits as recently used (in one transaction)
+        if found:
+            with self.transaction() as con:
+                con.executemany("UPDATE entries SET accessed = ? WHERE key = ?",
+                                [(now, key) for key in found])
+
+        self.count(hits=len(found), misses=len(keys)-len(found))
+        return found
+
+    def set(self, key, value):
+        """
+        Store value for key
+        params:
+              key: string | cache key
+            value: picklable value to cache
+        """
+        self.setMany({key:value})
+
+    def setMany(self, items):
+        """
+        Store several values in one transaction
+        params:
+            items: dict | key ---> value
+        """
+        if not items: return
+        now  = time.time()
+        rows = [(key, sqlite3.Binary(pickle.dumps(value, 2)), now, now)
+                for key, value in items.iteritems()]
+        with self.transaction() as con:
+            con.executemany("INSERT OR REPLACE INTO entries(key, value, created, accessed) \
+                             VALUES(?,?,?,?)", rows)
+
+        # evict every so often rather than on every write
+        with self.lock:
+            before = self.writes
+            self.writes += len(rows)
+            evict = self.writes // self.evictEvery != before // self.evictEvery
+        if evict: self.evict()
+
+    def delete(self, key):
+        self.connection().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def evict(self):
+        """
+        Remove expired entries, then the least recently used
+        entries beyond maxEntries
+        """
+        with self.transaction() as con:
+            con.execute("DELETE FROM entries WHERE created < ?", (time.time()-self.ttl,))
+            con.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries \
+                         ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.maxEntries,))
+
+    def __len__(self):
+        return self.connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self):
+        """
+        return: dict | hits, misses and hit rate for this process,
+                       plus the number of entries in the cache
+        """
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {'hits':hits, 'misses':misses, 'entries':len(self),
+                'hitRate':hits / float(total) if total else 0.0}
+
+
+class PostingCache(DiskCache):
+    """
+    Parsed job postings keyed by Indeed.com jobkey:
+    jobkey ---> (jobkey, position, company, location, words)
+    """
+    def __init__(self, path=None, maxEntries=100000, ttl=7*86400.0):
+        if path is None: path = os.path.join(cacheDir, 'postings.db')
+        DiskCache.__init__(self, path, maxEntries=maxEntries, ttl=ttl)
+
+
+def normalizeQuery(jobQuery):
+    """
+    return: string | jobQuery lower-cased with whitespace collapsed,
+                     so "Data Scientist" and "data  scientist " match
+    params:
+         jobQuery: string | job query from user input
+    """
+    return ' '.join(jobQuery.lower().split())
+
+
+class ResultCache(DiskCache):
+    """
+    /analyze results (the d3 results dictionary) keyed by the
+    normalized job query
+    """
+    def __init__(self, path=None, maxEntries=1000, ttl=None):
+        if path is None: path = os.path.join(cacheDir, 'results.db')
+        if ttl is None: ttl = resultTTL
+        DiskCache.__init__(self, path, maxEntries=maxEntries, ttl=ttl)
+
+    def get(self, jobQuery, default=None):
+        return DiskCache.get(self, normalizeQuery(jobQuery), default)
+
+    def set(self, jobQuery, results):
+        DiskCache.set(self, normalizeQuery(jobQuery), results)
+
+
+# shared caches for the process (created on first use)
+caches = {}
+cachesLock = threading.Lock()
+
+def getCache(cls):
+    """
+    return: the process-wide instance of a cache class
+    params:
+            cls: DiskCache subclass (e.g. PostingCache, ResultCache)
+    """
+    try:
+        return caches[cls]
+    except KeyError:
+        with cachesLock:
+            if cls not in caches:
+                caches[cls] = cls()
+            return caches[cls]
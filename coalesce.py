@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+coalesce.py
+Author: Brian Boates
+
+Single-flight coalescing of concurrent identical computations:
+callers asking for the same key while it is being computed wait
+for that one computation and all receive its result. Streamed
+computations (generators, see SingleFlight.stream) run once on a
+background thread and every caller receives all of their values.
+"""
+import os, sys, hashlib, threading, fcntl
+
+class Call(object):
+    """
+    One in-flight computation and its outcome (and the values
+    published so far, for streamed computations)
+    """
+    def __init__(self):
+        self.done   = threading.Event()
+        self.result = None
+        self.error  = None
+        self.values = []
+        self.cond   = threading.Condition(threading.Lock())
+
+    def publish(self, value):
+        """
+        Hand a value of a streamed computation to its callers
+        """
+        with self.cond:
+            self.values.append(value)
+            self.cond.notify_all()
+
+    def finish(self):
+        """
+        Mark the computation done (result or error already set)
+        """
+        with self.cond:
+            self.done.set()
+            self.cond.notify_all()
+
+    def follow(self):
+        """
+        yield: every value published, in order, as it is published
+               (just (True, result) for a computation run by do())
+        """
+        i = 0
+        while True:
+            with self.cond:
+                while i == len(self.values) and not self.done.is_set():
+                    self.cond.wait()
+                values, finished = self.values[i:], self.done.is_set()
+            for value in values:
+                yield value
+            i += len(values)
+            if finished:
+                if self.error is not None:
+                    raise self.error[0], self.error[1], self.error[2]
+                if not self.values:
+                    yield True, self.result
+                return
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent calls by key. Within a process, followers
+    wait on the leader's Event; with a lockDir, leaders in different
+    processes also serialize on a per-key lock file (so the function
+    should check any shared cache first, see routes.analyzeQuery)
+    """
+    def __init__(self, lockDir=None):
+        self.lockDir = lockDir
+        self.calls = {}
+        self.lock  = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        return: func(*args, **kwargs), computed once for all
+                concurrent callers with the same key
+        params:
+              key: hashable | identifies identical computations
+             func: callable | the computation
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+
+        # followers wait for the leader's result (or its error)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error[0], call.error[1], call.error[2]
+            return call.result
+
+        try:
+            lockFile = self.acquire(key)
+            try:
+                call.result = func(*args, **kwargs)
+            finally:
+                self.release(lockFile)
+        except:
+            call.error = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.finish()
+
+        return call.result
+
+    def stream(self, key, func, *args, **kwargs):
+        """
+        Coalesce concurrent streamed computations by key: the generator
+        func(*args, **kwargs) yields (final, value) pairs and is run once,
+        on a background thread (so it completes even if its first caller
+        goes away), for all concurrent callers; the final value is the
+        result do() callers with the same key receive
+
+        return: generator | every (final, value) pair of the computation
+                            (the ones published before joining first); a
+                            caller joining a do() computation gets only
+                            (True, result)
+        params:
+              key: hashable | identifies identical computations
+             func: generator function | the computation
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = Call()
+                thread = threading.Thread(target=self.publish, args=(key, call, func, args, kwargs))
+                thread.daemon = True
+                thread.start()
+        return call.follow()
+
+    def publish(self, key, call, func, args, kwargs):
+        """
+        Run a streamed computation, publishing its values to the call
+        """
+        try:
+            lockFile = self.acquire(key)
+            try:
+                for final, value in func(*args, **kwargs):
+                    if final: call.result = value
+                    call.publish((final, value))
+            finally:
+                self.release(lockFile)
+        except Exception, e:
+            call.error = sys.exc_info()
+            print 'streamed computation failed for', key, '|', e
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.finish()
+
+    def inFlight(self):
+        """
+        return: int | number of keys currently being computed
+        """
+        with self.lock:
+            return len(self.calls)
+
+    def acquire(self, key):
+        """
+        return: file | exclusive lock file for key (None without a lockDir)
+        """
+        if self.lockDir is None:
+            return None
+        if not os.path.isdir(self.lockDir):
+            try: os.makedirs(self.lockDir)
+            except OSError: pass
+        name = hashlib.md5(unicode(key).encode('utf-8')).hexdigest()
+        lockFile = open(os.path.join(self.lockDir, name+'.lock'), 'a')
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        return lockFile
+
+    def release(self, lockFile):
+        if lockFile is not None:
+            fcntl.flock(lockFile, fcntl.LOCK_UN)
+            lockFile.close()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+"""
+compact.py
+Author: Brian Boates
+
+Compact read-only term ---> count store for the bkgd tables. A
+dict of str ---> int costs well over 100 bytes per entry (a str
+object, an int object and a hash table slot, in every worker);
+CompactCounts keeps the same lookups in four flat buffers:
+
+blob:     every term, sorted, concatenated into one string
+offsets:  array of term start offsets into the blob (n+1 entries)
+counts:   array of counts (the term id is its index)
+slots:    open-addressing hash table of term ids (crc32 of the term,
+          linear probing, at most 2/3 full)
+
+PER ENTRY: len(term) + 4 (offset) + 4 (count, 8 if any count is
+>= 2**31) + 6 to 12 (hash slots), i.e. about 20-30 bytes for
+typical words versus 120-150 bytes for a dict. A lookup costs a
+crc32 and usually one slice compare, a few times slower than a
+dict lookup (see benchbkgd.benchCompact).
+"""
+import zlib, struct
+from array import array
+import numpy as np
+
+
+def typecode(maximum):
+    """
+    return: string | smallest signed array typecode holding maximum
+    """
+    return 'i' if maximum < 2**31 else 'l'
+
+
+def packed(values, code):
+    """
+    return: array | numpy integer array as an array of typecode "code"
+    """
+    return array(code, np.asarray(values, dtype='i%d' % array(code).itemsize).tobytes())
+
+
+def hashTable(terms, size):
+    """
+    Linear probing hash table of term ids, filled in rounds: every
+    unplaced term claims the slot it probes (the lowest id wins a
+    contested slot), the rest move on to their next slot
+
+    return: array | slot ---> term id (-1 for empty)
+    params:
+            terms: list[string] | terms (ids are their indices)
+             size: int | number of slots (a power of two > len(terms))
+    """
+    mask  = size - 1
+    slots = np.empty(size, dtype=np.int32)
+    slots.fill(-1)
+    ids = np.arange(len(terms), dtype=np.int32)
+    pos = np.array(map(zlib.crc32, terms), dtype=np.int64) & mask
+    while len(ids):
+
+        # free slots go to the first id probing them
+        free = slots[pos] < 0
+        first = np.unique(pos[free], return_index=True)[1]
+        won = np.flatnonzero(free)[first]
+        slots[pos[won]] = ids[won]
+
+        # the others probe the next slot
+        lost = np.ones(len(ids), dtype=bool)
+        lost[won] = False
+        ids, pos = ids[lost], (pos[lost] + 1) & mask
+
+    return packed(slots, 'i')
+
+
+class CompactCounts(object):
+    """
+    Read-only mapping of terms (strings) to counts with the
+    lookups of a dict: get, [], in, len and iteration (in
+    sorted term order)
+    """
+    def __init__(self, blob, offsets, counts, slots):
+        """
+        params:
+             blob: string | sorted terms, concatenated
+          offsets: array | start of each term in blob (plus the end)
+           counts: array | count of each term
+            slots: array | hash table of term ids (-1 for empty)
+        """
+        self.blob       = blob
+        self.offsets    = offsets
+        self.termCounts = counts
+        self.slots      = slots
+        self.mask       = len(slots) - 1
+
+    @classmethod
+    def fromItems(cls, items):
+        """
+        return: CompactCounts | store of the (term, count) pairs
+        params:
+            items: iterable[tuple(string, int)] | terms and counts
+                                                  (e.g. dict.iteritems())
+        """
+        items = list(items)
+        terms, values = zip(*items) if items else ((), ())
+
+        # sort the terms (numpy's fixed-width strings sort like str)
+        sortedTerms = np.array(terms, dtype=str)
+        order = np.argsort(sortedTerms, kind='mergesort')
+        sortedTerms = sortedTerms[order]
+        for i in np.flatnonzero(sortedTerms[1:] == sortedTerms[:-1]):
+            raise ValueError('duplicate term: %r' % sortedTerms[i])
+        terms = sortedTerms.tolist()
+
+        # concatenated terms and their offsets
+        blob = ''.join(terms)
+        starts  = np.concatenate([[0], np.cumsum(map(len, terms), dtype=np.int64)])
+        offsets = packed(starts, typecode(len(blob)))
+
+        values  = np.array(values, dtype=np.int64)[order]
+        counts  = packed(values, typecode(values.max() if len(values) else 0))
+
+        # power of two hash table at most 2/3 full
+        size = 1
+        while size * 2 < len(terms) * 3: size *= 2
+        return cls(blob, offsets, counts, hashTable(terms, size))
+
+    def index(self, term):
+        """
+        return: int | id of term (-1 if not in the store)
+        params:
+            term: string | term to look up
+        """
+        blob, offsets, slots, mask = self.blob, self.offsets, self.slots, self.mask
+        h = zlib.crc32(term) & mask
+        while True:
+            i = slots[h]
+            if i < 0: return -1
+            if blob[offsets[i]:offsets[i+1]] == term: return i
+            h = (h+1) & mask
+
+    def term(self, i):
+        """
+        return: string | term with id i
+        """
+        return self.blob[self.offsets[i]:self.offsets[i+1]]
+
+    def get(self, term, default=None):
+        i = self.index(term)
+        return int(self.termCounts[i]) if i >= 0 else default
+
+    def __getitem__(self, term):
+        i = self.index(term)
+        if i < 0: raise KeyError(term)
+        return int(self.termCounts[i])
+
+    def __contains__(self, term):
+        return self.index(term) >= 0
+
+    def __len__(self):
+        return len(self.termCounts)
+
+    def __iter__(self):
+        return (self.term(i) for i in xrange(len(self)))
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        return iter(self.termCounts)
+
+    def iteritems(self):
+        return ((self.term(i), self.termCounts[i]) for i in xrange(len(self)))
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.termCounts)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def counts(self):
+        """
+        return: numpy.ndarray | counts of all terms by id (no copy)
+        """
+        return np.frombuffer(self.termCounts, dtype='i%d' % self.termCounts.itemsize)
+
+    def nbytes(self):
+        """
+        return: int | bytes used by the four buffers
+        """
+        return len(self.blob) + sum(len(a)*a.itemsize for a in
+                                     [self.offsets, self.termCounts, self.slots])
+
+
+class MappedCounts(CompactCounts):
+    """
+    CompactCounts read in place from one buffer (e.g. the mmap of
+    a bkgd snapshot file, see background.readSnapshot): lookups
+    unpack the slots, offsets and counts they need straight from
+    the buffer, and the sections are also exposed as read-only
+    numpy arrays over it (no copies either way)
+    """
+    def __init__(self, buf, nTerms, nSlots, offsetsAt, offsetBytes, countsAt, countBytes, slotsAt):
+        """
+        params:
+              buf: buffer | the whole snapshot (offsets are positions in buf)
+           nTerms: int | number of terms
+           nSlots: int | number of hash table slots (a power of two)
+        offsetsAt: int | position of the nTerms+1 term offsets
+      offsetBytes: int | size of an offset (4 or 8)
+         countsAt: int | position of the nTerms counts
+       countBytes: int | size of a count (4 or 8)
+          slotsAt: int | position of the nSlots 4-byte slots
+        """
+        CompactCounts.__init__(self, buf,
+            np.frombuffer(buf, dtype='i%d' % offsetBytes, count=nTerms+1, offset=offsetsAt),
+            np.frombuffer(buf, dtype='i%d' % countBytes, count=nTerms, offset=countsAt),
+            np.frombuffer(buf, dtype=np.int32, count=nSlots, offset=slotsAt))
+        code = {4:'i', 8:'q'}
+        self.slotAt,   self.slotUnpack  = slotsAt, struct.Struct('=i').unpack_from
+        self.offsetAt, self.offsetBytes = offsetsAt, offsetBytes
+        self.offsetUnpack = struct.Struct('='+code[offsetBytes]*2).unpack_from
+        self.countAt,  self.countBytes  = countsAt, countBytes
+        self.countUnpack  = struct.Struct('='+code[countBytes]).unpack_from
+
+    def index(self, term):
+        buf, mask, slot, offsets = self.blob, self.mask, self.slotUnpack, self.offsetUnpack
+        slotAt, offsetAt, offsetBytes = self.slotAt, self.offsetAt, self.offsetBytes
+        h = zlib.crc32(term) & mask
+        while True:
+            i = slot(buf, slotAt + 4*h)[0]
+            if i < 0: return -1
+            start, end = offsets(buf, offsetAt + offsetBytes*i)
+            if buf[start:end] == term: return i
+            h = (h+1) & mask
+
+    def term(self, i):
+        start, end = self.offsetUnpack(self.blob, self.offsetAt + self.offsetBytes*i)
+        return self.blob[start:end]
+
+    def count(self, i):
+        return self.countUnpack(self.blob, self.countAt + self.countBytes*i)[0]
+
+    def get(self, term, default=None):
+        i = self.index(term)
+        return self.count(i) if i >= 0 else default
+
+    def __getitem__(self, term):
+        i = self.index(term)
+        if i < 0: raise KeyError(term)
+        return self.count(i)
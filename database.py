@@ -11,10 +11,63 @@ DATABASE: "skillrank"
 TABLES:         COLUMNS:
 bkgd_jobkeys:   id | jobkey
 bkgd_words:     id | term   | count
+bkgd_bigrams:   id | w1 | w2      | count
+bkgd_trigrams:  id | w1 | w2 | w3 | count
+(w1, w2, w3 are bkgd_words ids)
 """
-import os, sys
-import MySQLdb as mdb
-import indeed
+import sys, time
+from collections import Counter
+import indeed, storage
+
+# table definitions for each supported SQL dialect
+# (sqlite is a local stand-in for testing the ingestion)
+# unique keys on jobkey/term allow batched multi-row upserts
+TABLES = {
+    'mysql':  ["CREATE TABLE IF NOT EXISTS \
+                bkgd_jobkeys(id INT PRIMARY KEY AUTO_INCREMENT, \
+                             jobkey CHAR(16), UNIQUE KEY (jobkey))",
+               "CREATE TABLE IF NOT EXISTS \
+                bkgd_words(id INT PRIMARY KEY AUTO_INCREMENT, \
+                           term VARCHAR(64), count INT, UNIQUE KEY (term))",
+               "CREATE TABLE IF NOT EXISTS \
+                bkgd_bigrams(id INT PRIMARY KEY AUTO_INCREMENT, \
+                             w1 INT, w2 INT, count INT, UNIQUE KEY (w1,w2))",
+               "CREATE TABLE IF NOT EXISTS \
+                bkgd_trigrams(id INT PRIMARY KEY AUTO_INCREMENT, \
+                              w1 INT, w2 INT, w3 INT, count INT, UNIQUE KEY (w1,w2,w3))"],
+    'sqlite': ["CREATE TABLE IF NOT EXISTS \
+                bkgd_jobkeys(id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                             jobkey CHAR(16) UNIQUE)",
+               "CREATE TABLE IF NOT EXISTS \
+                bkgd_words(id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                           term VARCHAR(64) UNIQUE, count INT)",
+               "CREATE TABLE IF NOT EXISTS \
+                bkgd_bigrams(id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                             w1 INT, w2 INT, count INT, UNIQUE (w1,w2))",
+               "CREATE TABLE IF NOT EXISTS \
+                bkgd_trigrams(id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                              w1 INT, w2 INT, w3 INT, count INT, UNIQUE (w1,w2,w3))"],
+}
+
+# n-gram tables and their key columns (ids of the words in bkgd_words,
+# much smaller than the n-gram strings)
+NGRAM_TABLES = {'bkgd_bigrams':  ('w1','w2'),
+                'bkgd_trigrams': ('w1','w2','w3')}
+
+# unique key of each bkgd table, which the multi-row upserts rely on
+# (tables created before the keys were added get them from migrateKeys)
+UNIQUE_KEYS = {'bkgd_jobkeys':  ('jobkey',),
+               'bkgd_words':    ('term',),
+               'bkgd_bigrams':  ('w1','w2'),
+               'bkgd_trigrams': ('w1','w2','w3')}
+
+# multi-row upsert that adds to existing counts
+UPSERT = {
+    'mysql':  "INSERT INTO %(table)s(%(columns)s,count) VALUES %(values)s \
+               ON DUPLICATE KEY UPDATE count = count + VALUES(count)",
+    'sqlite': "INSERT INTO %(table)s(%(columns)s,count) VALUES %(values)s \
+               ON CONFLICT(%(columns)s) DO UPDATE SET count = count + excluded.count",
+}
 
 def dbRemove(db='skillrank'):
     """
@@ -22,19 +75,23 @@ def dbRemove(db='skillrank'):
     params:
             db: string | the name of the MySQL database
     """
-    # connect to MySQL
-    con = mdb.connect(host='localhost', user='root')
+    # connect to MySQL (no database selected)
+    con = storage.connect(storage.MySQLBackend(db=None))
     
     # create cursor for MySQL
     cur = con.cursor()
     
     # check to see if skillrank database exists
-    cur.execute("SELECT SCHEMA_NAME FROM INFORMATION_SCHEMA.SCHEMATA WHERE SCHEMA_NAME = \'"+db+"\'")
+    cur.execute("SELECT SCHEMA_NAME FROM INFORMATION_SCHEMA.SCHEMATA WHERE SCHEMA_NAME = ?", (db,))
     exists = cur.fetchone()
     
     # if skillrank database exists, remove it entirely
     if exists:
-        cur.execute("DROP database "+db)
+        cur.execute("DROP database "+storage.identifier(db))
+    
+    # return the connection to the pool
+    cur.close()
+    con.close()
 
 
 def dbCreate(db='skillrank'):
@@ -43,17 +100,19 @@ def dbCreate(db='skillrank'):
     params:
             db: string | the name of the MySQL database
     """
-    # connect to MySQL
-    con = mdb.connect(host='localhost', user='root')
+    # connect to MySQL (no database selected)
+    con = storage.connect(storage.MySQLBackend(db=None))
     
     # create cursor for MySQL
     cur = con.cursor()
     
     # create the skillrank database if not already present
-    cur.execute("CREATE SCHEMA IF NOT EXISTS "+db)
+    cur.execute("CREATE SCHEMA IF NOT EXISTS "+storage.identifier(db))
+    cur.close()
+    con.close()
     
-    # change to newly created skillrank database
-    cur.execute("USE "+db)
+    # connect to the newly created skillrank database
+    con = storage.connect(storage.MySQLBackend(db=db))
     
     # with connection to the skillrank database
     with con:
@@ -61,36 +120,148 @@ def dbCreate(db='skillrank'):
         # create cursor to skillrank database        
         cur = con.cursor()
         
-        # create bkgd_jobkeys table: id (primary key) | jobkey
-        # indeed.com jobkeys are 16 characters long
-        cur.execute("CREATE TABLE IF NOT EXISTS \
-                     bkgd_jobkeys(id INT PRIMARY KEY AUTO_INCREMENT, \
-                                  jobkey CHAR(16))")
-                              
-        # create bkgd_words table: id (primary key) | term | count
-        cur.execute("CREATE TABLE IF NOT EXISTS \
-                     bkgd_words(id INT PRIMARY KEY AUTO_INCREMENT, \
-                                term VARCHAR(64), count INT)")
+        # create bkgd_jobkeys and bkgd_words tables
+        createTables(cur, dialect='mysql')
         
     # close cursor to skillrank database
     if cur: cur.close()
     
-    # close connection to skillrank database
+    # return the connection to the pool
     if con: con.close()
 
 
+def createTables(cur, dialect='mysql'):
+    """
+    Create the skillrank bkgd tables
+    params:
+            cur: cursor to skillrank database
+        dialect: string | SQL dialect ('mysql' or 'sqlite')
+    """
+    # bkgd_jobkeys: id (primary key) | jobkey
+    # (indeed.com jobkeys are 16 characters long)
+    # bkgd_words:   id (primary key) | term | count
+    # bkgd_bigrams/bkgd_trigrams: id (primary key) | w1 | w2 (| w3) | count
+    for table in TABLES[dialect]:
+        cur.execute(table)
+    
+    # tables of an existing database may lack the unique keys
+    if dialect == 'mysql':
+        for table in migrateKeys(cur):
+            print 'added the unique key of', table
+
+
+def missingKeys(cur):
+    """
+    return: list[string] | bkgd tables without their unique key (MySQL)
+    params:
+            cur: cursor to skillrank database
+    """
+    cur.execute("SELECT TABLE_NAME, GROUP_CONCAT(COLUMN_NAME ORDER BY SEQ_IN_INDEX) \
+                 FROM INFORMATION_SCHEMA.STATISTICS \
+                 WHERE TABLE_SCHEMA = DATABASE() AND NON_UNIQUE = 0 AND INDEX_NAME <> 'PRIMARY' \
+                 GROUP BY TABLE_NAME, INDEX_NAME")
+    keys = set((table, tuple(columns.split(','))) for table, columns in cur.fetchall())
+    return [table for table, columns in sorted(UNIQUE_KEYS.items()) if (table, columns) not in keys]
+
+
+def requireKeys(cur, dialect='mysql'):
+    """
+    Refuse to ingest into bkgd tables without their unique keys (the
+    upserts would insert duplicate rows instead of adding to counts)
+    params:
+            cur: cursor to skillrank database
+        dialect: string | SQL dialect ('mysql' or 'sqlite')
+    """
+    if dialect != 'mysql': return
+    missing = missingKeys(cur)
+    if missing:
+        raise RuntimeError('bkgd tables without their unique keys: '+', '.join(missing)+ \
+                           ' (run database.dbCreate() to migrate them)')
+
+
+def rebuildTable(cur, table, columns, select, addKey=True):
+    """
+    Replace the rows of a MySQL table with the rows of a SELECT: they
+    are written to a copy of the table (given its unique key) that is
+    then renamed over it
+    params:
+            cur: cursor to skillrank database
+          table: string | bkgd table
+        columns: list[string] | columns filled by the SELECT
+         select: string | SELECT of the new rows (no duplicate keys)
+         addKey: bool | add the unique key to the copy
+    """
+    cur.execute("DROP TABLE IF EXISTS "+table+"_new")
+    cur.execute("CREATE TABLE "+table+"_new LIKE "+table)
+    if addKey:
+        cur.execute("ALTER TABLE "+table+"_new ADD UNIQUE KEY ("+','.join(UNIQUE_KEYS[table])+")")
+    cur.execute("INSERT INTO "+table+"_new("+','.join(columns)+") "+select)
+    cur.execute("RENAME TABLE "+table+" TO "+table+"_old, "+table+"_new TO "+table)
+    cur.execute("DROP TABLE "+table+"_old")
+
+
+def migrateKeys(cur):
+    """
+    Add the unique keys to MySQL bkgd tables created without them,
+    first merging the duplicate rows the upserts may have inserted
+    (duplicate jobkeys are dropped, duplicate terms and n-grams keep
+    their first id with the sum of their counts, and n-grams of
+    merged words are moved to the kept word id)
+    return: list[string] | tables that got their unique key
+    params:
+            cur: cursor to skillrank database
+    """
+    missing = missingKeys(cur)
+    if not missing: return []
+    
+    # ids of duplicate words ---> id of the word kept
+    remap = False
+    if 'bkgd_words' in missing:
+        cur.execute("DROP TABLE IF EXISTS bkgd_word_ids")
+        cur.execute("CREATE TABLE bkgd_word_ids(id INT PRIMARY KEY, keep INT) \
+                     SELECT w.id AS id, k.keep AS keep FROM bkgd_words w JOIN \
+                     (SELECT term, MIN(id) AS keep FROM bkgd_words GROUP BY term) k \
+                     ON w.term = k.term AND w.id > k.keep")
+        cur.execute("SELECT COUNT(*) FROM bkgd_word_ids")
+        remap = cur.fetchone()[0] > 0
+    
+    for table in sorted(UNIQUE_KEYS):
+        columns = UNIQUE_KEYS[table]
+        if table not in missing and not (remap and table in NGRAM_TABLES): continue
+        addKey = table in missing
+        if table == 'bkgd_jobkeys':
+            select = "SELECT MIN(id), jobkey FROM bkgd_jobkeys GROUP BY jobkey"
+            rebuildTable(cur, table, ['id','jobkey'], select, addKey)
+        elif table == 'bkgd_words':
+            select = "SELECT MIN(id), term, SUM(count) FROM bkgd_words GROUP BY term"
+            rebuildTable(cur, table, ['id','term','count'], select, addKey)
+        else:
+            # word ids of merged words are replaced by the kept id
+            ids = ["COALESCE(d%d.keep, t.%s)" % (j, c) for j, c in enumerate(columns)] if remap \
+                  else ["t."+c for c in columns]
+            joins = ''.join(" LEFT JOIN bkgd_word_ids d%d ON t.%s = d%d.id" % (j, c, j)
+                            for j, c in enumerate(columns)) if remap else ''
+            select = "SELECT MIN(t.id), "+', '.join(ids)+", SUM(t.count) FROM "+table+" t"+ \
+                     joins+" GROUP BY "+', '.join(str(j+2) for j in range(len(columns)))
+            rebuildTable(cur, table, ['id']+list(columns)+['count'], select, addKey)
+    
+    if 'bkgd_words' in missing:
+        cur.execute("DROP TABLE bkgd_word_ids")
+    return missing
+
+
 def newJobkey(cur, jobkey):
     """
     Return True/False if jobkey is new/already in table
     params:
-           cur: cursor to skillrank database
+           cur: cursor to skillrank database (from storage.connect)
         jobkey: string | indeed.com unique job posting ID
     """
     # jobkeys table
     jTable = 'bkgd_jobkeys'
         
     # check to see if jobkey exists
-    cur.execute("SELECT * FROM "+jTable+" WHERE jobkey = \'"+jobkey+"\'")
+    cur.execute("SELECT * FROM "+jTable+" WHERE jobkey = ?", (jobkey,))
     
     # True if jobkey is new, False if already present
     new = not cur.fetchone()
@@ -104,23 +275,23 @@ def updateTermCount(cur, term, table='bkgd_words'):
     or initialize to 1 if not already present
     return: 0 if table update was successful
     params:
-            cur: cursor to skillrank database
+            cur: cursor to skillrank database (from storage.connect)
           table: skillrank db table to use
            term: term to update in skillrank database
     """
     # check to see if term is already in terms table
-    cur.execute("SELECT * FROM "+table+" WHERE term = \'"+term+"\'")
+    cur.execute("SELECT * FROM "+table+" WHERE term = ?", (term,))
     new = not cur.fetchone()
     
     # if term not in terms table
     if new:
         # insert term into term table with initial value of 1
-        cur.execute("INSERT INTO "+table+"(term,count) VALUES(\'"+term+"\',1)")
+        cur.execute("INSERT INTO "+table+"(term,count) VALUES(?,1)", (term,))
         
     # if term is already in terms table
     else:
         # increment the term's count by 1
-        cur.execute("UPDATE "+table+" SET count = count + 1 WHERE term = \'"+term+"\'")
+        cur.execute("UPDATE "+table+" SET count = count + 1 WHERE term = ?", (term,))
         
     return 0
 
@@ -154,16 +325,18 @@ def getPostings(jobQuery, nURLs=1, start=0):
     return jobkeys, allwords
 
 
-def insertPosting(cur, jobkey, words):
+def insertPosting(cur, jobkey, words, wordIds=None, dialect='mysql'):
     """
     Insert words, bigrams, and trigrams from a single job posting
     into their respective tables
     return: True if jobkey is new
             False if jobkey is not new
     params:
-            cur: cursor to skillrank database
+            cur: cursor to skillrank database (from storage.connect)
          jobkey: string | indeed.com unique job posting ID
           words: list[string] list of words from a single job posting
+        wordIds: dict | term ---> bkgd_words id (cache, updated in place)
+        dialect: string | SQL dialect ('mysql' or 'sqlite')
     """
     # bkgd tables
     jTable = 'bkgd_jobkeys'
@@ -173,11 +346,15 @@ def insertPosting(cur, jobkey, words):
     if newJobkey(cur, jobkey):
         
         # if new, insert jobkey into jobkeys table
-        cur.execute("INSERT INTO "+jTable+"(jobkey) VALUES(\'"+jobkey+"\')")
+        cur.execute("INSERT INTO "+jTable+"(jobkey) VALUES(?)", (jobkey,))
         
         # update word counts
         for word in words:
             val = updateTermCount(cur=cur, term=word, table=wTable)
+        
+        # update bigram and trigram counts
+        if wordIds is None: wordIds = {}
+        insertNgrams(cur, [words], wordIds, dialect=dialect)
             
         # return true if jobkey is new and insertion was performed
         return True
@@ -187,7 +364,152 @@ def insertPosting(cur, jobkey, words):
         return False
 
 
-def populateTables(jobQuery, nJobs=1, start=0):
+def loadJobkeys(cur):
+    """
+    return: set | all jobkeys already in the bkgd_jobkeys table
+    params:
+            cur: cursor to skillrank database
+    """
+    cur.execute("SELECT jobkey FROM bkgd_jobkeys")
+    return set(row[0] for row in cur.fetchall())
+
+
+def upsertCounts(cur, table, counts, columns=('term',), dialect='mysql', chunk=500):
+    """
+    Add counts to a table with multi-row upserts
+    (new keys are inserted, existing keys have their count incremented)
+    params:
+            cur: cursor to skillrank database
+          table: string | skillrank db table to use
+         counts: dict | key (or tuple of keys) ---> count to add
+        columns: tuple(string) | key column names of the table
+        dialect: string | SQL dialect ('mysql' or 'sqlite')
+          chunk: int | number of rows per INSERT statement
+    """
+    row = '('+','.join(['?']*(len(columns)+1))+')'
+    
+    # flatten the counts into rows of parameters
+    rows = []
+    for key, count in counts.iteritems():
+        if len(columns) == 1: key = (key,)
+        rows.append(tuple(key)+(count,))
+    
+    # send the rows in chunks of multi-row upserts
+    for i in range(0, len(rows), chunk):
+        part = rows[i:i+chunk]
+        sql = UPSERT[dialect] % {'table':table, 'columns':','.join(columns),
+                                 'values':','.join([row]*len(part))}
+        cur.execute(sql, [p for r in part for p in r])
+
+
+def loadWordIds(cur, words, wordIds, chunk=500):
+    """
+    Look up the bkgd_words ids of words that aren't in wordIds yet
+    params:
+            cur: cursor to skillrank database
+          words: iterable[string] | words (already in bkgd_words)
+        wordIds: dict | term ---> bkgd_words id (updated in place)
+          chunk: int | number of words per SELECT statement
+    """
+    missing = list(set(words).difference(wordIds))
+    for i in range(0, len(missing), chunk):
+        part = missing[i:i+chunk]
+        cur.execute("SELECT id,term FROM bkgd_words WHERE term IN ("+ \
+                    ','.join(['?']*len(part))+")", part)
+        for i, term in cur.fetchall():
+            wordIds[term] = i
+
+
+def insertNgrams(cur, allwords, wordIds, dialect='mysql'):
+    """
+    Add the bigram and trigram counts of job postings to the
+    n-gram tables (keyed by word ids, words must be inserted first)
+    params:
+            cur: cursor to skillrank database
+       allwords: list[list[string]] | words of each job posting
+        wordIds: dict | term ---> bkgd_words id (cache, updated in place)
+        dialect: string | SQL dialect ('mysql' or 'sqlite')
+    """
+    loadWordIds(cur, (w for words in allwords for w in words), wordIds)
+    
+    # n-grams don't cross job postings
+    allids = [[wordIds[w] for w in words] for words in allwords]
+    for table, columns in sorted(NGRAM_TABLES.items()):
+        N = len(columns)
+        counts = Counter()
+        for ids in allids:
+            counts.update(zip(*[ids[j:] for j in range(N)]))
+        upsertCounts(cur, table, counts, columns=columns, dialect=dialect)
+
+
+def pruneNgrams(cur, minCount):
+    """
+    Delete the n-grams seen fewer than minCount times from the n-gram
+    tables. The tables keep every count by default (rare n-grams are
+    left out when the bkgd is read, see background.minNgramCount), so
+    this is the explicit step that keeps them from growing without
+    bound. A pruned n-gram starts again from 0 if it is seen again.
+    return: int | number of n-grams deleted
+    params:
+            cur: cursor to skillrank database
+       minCount: int | n-grams with a count below this are deleted
+    """
+    deleted = 0
+    for table in sorted(NGRAM_TABLES):
+        cur.execute("DELETE FROM "+table+" WHERE count < ?", (minCount,))
+        deleted += cur.rowcount
+    return deleted
+
+
+def insertBatch(con, postings, jobkeys, dialect='mysql', wordIds=None):
+    """
+    Insert a batch of job postings in a single transaction: word and
+    n-gram counts are aggregated in memory and jobkeys checked against
+    a preloaded set
+    return: int | number of new postings inserted
+    params:
+            con: connection to skillrank database
+       postings: list[tuple(string, list[string])] | (jobkey, words) pairs
+        jobkeys: set | jobkeys already in the database (updated in place)
+        dialect: string | SQL dialect ('mysql' or 'sqlite')
+        wordIds: dict | term ---> bkgd_words id (cache, updated in place)
+    """
+    # bkgd tables
+    jTable = 'bkgd_jobkeys'
+    wTable = 'bkgd_words'
+    
+    # aggregate word counts over the new postings in the batch
+    newKeys, newWords, wordCounts = [], [], Counter()
+    for jobkey, words in postings:
+        if jobkey in jobkeys: continue
+        jobkeys.add(jobkey)
+        newKeys.append(jobkey)
+        newWords.append(words)
+        wordCounts.update(words)
+    
+    if not newKeys:
+        return 0
+    
+    # write jobkeys, word and n-gram counts in one transaction
+    if wordIds is None: wordIds = {}
+    cur = con.cursor()
+    try:
+        cur.executemany("INSERT INTO "+jTable+"(jobkey) VALUES(?)",
+                        [(jobkey,) for jobkey in newKeys])
+        upsertCounts(cur, wTable, wordCounts, dialect=dialect)
+        insertNgrams(cur, newWords, wordIds, dialect=dialect)
+        con.commit()
+    except:
+        con.rollback()
+        for jobkey in newKeys: jobkeys.discard(jobkey)
+        raise
+    finally:
+        cur.close()
+    
+    return len(newKeys)
+
+
+def populateTables(jobQuery, nJobs=1, start=0, bulk=False, batchSize=100, pruneBelow=None):
     """
     Populate tables with words from job postings
     return: 
@@ -195,9 +517,14 @@ def populateTables(jobQuery, nJobs=1, start=0):
          jobQuery: string | job query
             nURLs: int | number of job URL's to retrieve
             start: int | index for api job search starting point
+             bulk: bool | insert postings in batches (default=False)
+        batchSize: int | number of postings per batch in bulk mode
+       pruneBelow: int | if given, delete n-grams seen fewer times once
+                         the postings are in (see pruneNgrams, default
+                         None keeps every count)
     """
-    # connect to the skillrank database
-    con = mdb.connect(host='localhost', user='root', db='skillrank')
+    # connection to the skillrank database from the pool
+    con = storage.connect()
     
     # create cursor for the skillrank database
     cur = con.cursor()
@@ -209,6 +536,18 @@ def populateTables(jobQuery, nJobs=1, start=0):
     # initial number of URL's to try is just nJobs
     nURLs = nJobs
     
+    # the upserts need the unique keys of the tables
+    requireKeys(cur, con.dialect)
+    
+    # in bulk mode, check jobkeys against a preloaded set
+    if bulk: known = loadJobkeys(cur)
+    
+    # cache of bkgd_words ids for the n-gram tables
+    wordIds = {}
+    
+    # time the ingestion to report throughput
+    t0 = time.time()
+    
     # with connection to the bkgd database
     with con:
         
@@ -217,25 +556,34 @@ def populateTables(jobQuery, nJobs=1, start=0):
             
             # retrieve jobkeys and words from job postings
             jobkeys, allwords = getPostings(jobQuery=jobQuery, nURLs=1000, start=0)
-    
-            # add jobkeys to jobkeys table in bkgd database
-            for i in range(len(jobkeys)):
             
-                # select current jobkey and words list
-                jobkey = jobkeys[i]
-                words  = allwords[i]
+            # bulk mode: insert the postings a batch at a time
+            if bulk:
+                for i in range(0, len(jobkeys), batchSize):
+                    batch = zip(jobkeys[i:i+batchSize], allwords[i:i+batchSize])
+                    nUnique += insertBatch(con, batch, known, dialect=con.dialect,
+                                           wordIds=wordIds)
+                    print "done", nUnique, "out of", nJobs, "| i =", i+len(batch)
+            
+            # otherwise insert the postings one at a time
+            else:
+                for i in range(len(jobkeys)):
+            
+                    # select current jobkey and words list
+                    jobkey = jobkeys[i]
+                    words  = allwords[i]
                 
-                # insert the current job posting into its respective 
-                # jobkeys, words, bigrams, and trigrams tables
-                val = insertPosting(cur, jobkey, words)
+                    # insert the current job posting into its respective 
+                    # jobkeys, words, bigrams, and trigrams tables
+                    val = insertPosting(cur, jobkey, words, wordIds, dialect=con.dialect)
                 
-                # if val is True, posting was new ---> increment nUnique
-                if val:
-                    nUnique += 1
-                    print "done", nUnique, "out of", nJobs, "| i =", i
-                else:
-                    print "not unique - still at", nUnique, "out of", nJobs
-                    print "| i =", i, "out of", len(jobkeys), "start =", start
+                    # if val is True, posting was new ---> increment nUnique
+                    if val:
+                        nUnique += 1
+                        print "done", nUnique, "out of", nJobs, "| i =", i
+                    else:
+                        print "not unique - still at", nUnique, "out of", nJobs
+                        print "| i =", i, "out of", len(jobkeys), "start =", start
     
             # reset nURLs to number of jobs requested minus unique jobs found so far
             nURLs = nJobs - nUnique
@@ -245,11 +593,21 @@ def populateTables(jobQuery, nJobs=1, start=0):
             
             # api limited to 1000 job postings total
             if start >= 1100: break
+        
+        # optionally prune the rare n-grams in the same transaction
+        if pruneBelow is not None:
+            print "pruned", pruneNgrams(cur, pruneBelow), "n-grams seen fewer than", \
+                  pruneBelow, "times"
+    
+    # report the posting throughput
+    elapsed = time.time() - t0
+    print "inserted", nUnique, "postings in %.1f s (%.1f postings/s)" % \
+          (elapsed, nUnique / max(elapsed, 1e-9))
     
     # close the database cursor
     if cur: cur.close()
     
-    # close the database connection
+    # return the connection to the pool
     if con: con.close()
 
 
@@ -262,7 +620,7 @@ def main():
         start     = int(sys.argv[4])
     except:
         print '\n usage:'+sys.argv[0]+' jobQuery(in quotes), nJobs(max 500),' \
-                                     +' start(api starting index)'
+                                     +' start(api starting index) [--bulk] [--prune N]'
         print '\n using default values:'
         print '      jobQuery = "" (i.e. generic search)'
         print '         nJobs = 1'
@@ -271,8 +629,17 @@ def main():
         nJobs     = 1
         start     = 0
         
+    # insert postings in batches with --bulk
+    bulk = '--bulk' in sys.argv
+    
+    # delete n-grams seen fewer than N times afterwards with --prune N
+    pruneBelow = None
+    if '--prune' in sys.argv:
+        pruneBelow = int(sys.argv[sys.argv.index('--prune')+1])
+        
     # scan job postings and populate the bkgd tables
-    populateTables(jobQuery=jobQuery, nJobs=nJobs, start=start)
+    populateTables(jobQuery=jobQuery, nJobs=nJobs, start=start, bulk=bulk,
+                   pruneBelow=pruneBelow)
 
 
 if __name__ == '__main__':
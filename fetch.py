@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+fetch.py
+Author: Brian Boates
+
+Pooled HTTP fetching for the skillrank package. A persistent
+pool of worker threads is shared by all requests in a process,
+and every thread keeps one keep-alive connection open per host,
+so job postings (and API pages) reuse connections across
+postings and across requests.
+"""
+import os, sys, socket, threading
+import httplib, urllib2, urlparse
+from multiprocessing.pool import ThreadPool
+import metrics
+
+# default concurrency and timeout settings (see configure)
+nWorkers   = 8
+maxPerHost = 8
+timeout    = 10.0
+
+# maximum number of redirects to follow for a URL
+maxRedirects = 5
+
+# same user agent urllib2 sends
+userAgent = 'Python-urllib/%s' % sys.version[:3]
+
+
+class HostLimits(object):
+    """
+    Per-host semaphores limiting the number of requests
+    in flight to any one host
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def get(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.limit)
+            return self.semaphores[host]
+
+
+# keep-alive connections of the current thread: (scheme, host) ---> connection
+local = threading.local()
+
+# shared state for the process (created lazily, recreated after a fork)
+pool, hostLimits, poolPid = None, None, None
+poolLock = threading.Lock()
+
+
+def configure(workers=None, perHost=None, seconds=None):
+    """
+    Set the fetch layer's concurrency limits and timeout
+    (the worker pool is rebuilt on next use)
+    params:
+          workers: int | number of pooled worker threads
+          perHost: int | maximum requests in flight per host
+          seconds: float | socket timeout for each request
+    """
+    global nWorkers, maxPerHost, timeout, pool, poolPid
+    with poolLock:
+        if workers is not None: nWorkers = workers
+        if perHost is not None: maxPerHost = perHost
+        if seconds is not None: timeout = seconds
+        if pool is not None: pool.close()
+        pool, poolPid = None, None
+
+
+def getPool():
+    """
+    return: ThreadPool | the process-wide pool of fetch workers
+    """
+    global pool, hostLimits, poolPid
+    if poolPid != os.getpid():
+        with poolLock:
+            if poolPid != os.getpid():
+                pool = ThreadPool(nWorkers)
+                hostLimits = HostLimits(maxPerHost)
+                poolPid = os.getpid()
+    return pool
+
+
+def connection(scheme, host, seconds):
+    """
+    return: httplib connection to host, reused by the current thread
+    params:
+         scheme: string | 'http' or 'https'
+           host: string | host[:port] to connect to
+        seconds: float | socket timeout
+    """
+    if not hasattr(local, 'connections'):
+        local.connections = {}
+    key = (scheme, host)
+    con = local.connections.get(key)
+    if con is None:
+        if scheme == 'https':
+            con = httplib.HTTPSConnection(host, timeout=seconds)
+        else:
+            con = httplib.HTTPConnection(host, timeout=seconds)
+        local.connections[key] = con
+    return con
+
+
+def dropConnection(scheme, host):
+    """
+    Close and forget the current thread's connection to host
+    """
+    con = getattr(local, 'connections', {}).pop((scheme, host), None)
+    if con is not None:
+        con.close()
+
+
+def request(url, seconds):
+    """
+    return: httplib response, string | response and body of one GET
+            (retried once on a fresh connection if the kept-alive
+             connection was closed by the server)
+    params:
+            url: string | url to retrieve
+        seconds: float | socket timeout
+    """
+    parts = urlparse.urlsplit(url)
+    path  = parts.path or '/'
+    if parts.query: path += '?'+parts.query
+    headers = {'User-Agent':userAgent}
+
+    for attempt in range(2):
+        fresh = not (parts.scheme, parts.netloc) in getattr(local, 'connections', {})
+        con = connection(parts.scheme, parts.netloc, seconds)
+        try:
+            con.request('GET', path, headers=headers)
+            response = con.getresponse()
+            body = response.read()
+        except (httplib.HTTPException, socket.error):
+            dropConnection(parts.scheme, parts.netloc)
+            if fresh or attempt: raise
+            continue
+        if response.will_close:
+            dropConnection(parts.scheme, parts.netloc)
+        return response, body
+
+
+def getURL(url, seconds=None):
+    """
+    return: raw text from URL as a string
+    params:
+            url: string | url to retrieve data from
+        seconds: float | socket timeout (default=fetch.timeout)
+    """
+    if seconds is None: seconds = timeout
+
+    # limit the number of requests in flight to the host
+    getPool()
+    limit = hostLimits.get(urlparse.urlsplit(url).netloc)
+
+    with limit:
+        for i in range(maxRedirects+1):
+            try:
+                response, body = request(url, seconds)
+            except socket.timeout:
+                metrics.inc('skillrank_upstream_errors_total', kind='timeout')
+                raise
+            except (httplib.HTTPException, socket.error):
+                metrics.inc('skillrank_upstream_errors_total', kind='connection')
+                raise
+
+            # follow redirects like urllib2
+            if response.status in (301, 302, 303, 307) and response.getheader('location'):
+                url = urlparse.urljoin(url, response.getheader('location'))
+                continue
+
+            # raise on errors like urllib2
+            if response.status >= 400:
+                metrics.inc('skillrank_upstream_errors_total', kind='http_%d' % response.status)
+                raise urllib2.HTTPError(url, response.status, response.reason,
+                                        response.msg, None)
+            return body
+
+    metrics.inc('skillrank_upstream_errors_total', kind='redirects')
+    raise urllib2.HTTPError(url, response.status, 'too many redirects',
+                            response.msg, None)
+
+
+def fetchAll(func, items):
+    """
+    return: list | func(item) for each item, in order, computed on the
+                   shared pool (None for items whose func raised)
+    params:
+           func: callable | function of one item (e.g. indeed.parseJobPosting)
+          items: iterable | items to process (submitted as they are
+                            produced, so this may be a generator)
+    """
+    pending = [submit(func, item) for item in items]
+    return [p.get() for p in pending]
+
+
+def submit(func, item, callback=None):
+    """
+    return: AsyncResult | func(item) running on the shared pool
+                          (its result is None if func raised)
+    params:
+           func: callable | function of one item
+           item: argument for func
+       callback: callable | called with the result when it is ready
+                            (on the pool's result thread, keep it short)
+    """
+    return getPool().apply_async(Guarded(func), (item,), callback=callback)
+
+
+class Guarded(object):
+    """
+    Wrap a function so that an exception for one item is printed
+    and returns None instead of failing the whole batch
+    """
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, item):
+        try:
+            return self.func(item)
+        except Exception, e:
+            print 'fetch failed for', item, '|', repr(e)
+            return None
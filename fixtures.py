@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""
+fixtures.py
+Author: Brian Boates
+
+Fixture corpus for offline benchmarks: Indeed.com api pages and job
+posting pages for a few job queries, stored in fixtures/corpus.json
+and replayed by benchtools.FixtureServer, plus a bkgd database built
+from the corpus postings (SQLite file or MySQL schema) so nothing
+touches Indeed.com or the live skillrank database.
+
+CORPUS LAYOUT (json):
+api:      job query ---> list of api page XML (10 postings per page)
+postings: jobkey ---> job posting page HTML
+(posting URL's in the api pages start with "{host}")
+
+usage: python fixtures.py record "job query" ["job query" ...]
+       python fixtures.py synthetic
+"""
+import os, sys, re, json
+import numpy as np
+import utils, indeed, cache, database, background, storage
+
+# default location of the corpus
+corpusPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'corpus.json')
+
+# placeholder for the server in recorded posting URL's
+HOST = '{host}'
+
+# vocabulary for synthetic postings: words every posting uses,
+# then the skills of each job query
+COMMON = ['experience', 'team', 'work', 'skills', 'ability', 'strong', 'business',
+          'development', 'years', 'knowledge', 'environment', 'support', 'management',
+          'communication', 'company', 'opportunity', 'requirements', 'degree',
+          'responsibilities', 'including', 'position', 'working', 'customer', 'design',
+          'quality', 'help', 'high', 'new', 'written', 'verbal', 'benefits', 'time',
+          'process', 'solutions', 'technical', 'equal', 'employer', 'candidate',
+          'required', 'preferred', 'related', 'field', 'plus', 'across', 'build', 'growth']
+SKILLS = {
+    'data scientist':    ['python', 'statistics', 'machine', 'learning', 'sql', 'hadoop',
+                          'modeling', 'analytics', 'data', 'mining', 'regression', 'matlab',
+                          'visualization', 'algorithms', 'r', 'mathematics', 'physics',
+                          'predictive', 'clustering', 'scala', 'spark', 'hive'],
+    'software engineer': ['java', 'javascript', 'python', 'linux', 'c++', 'c', 'ruby',
+                          'rails', 'distributed', 'systems', 'scalable', 'testing', 'agile',
+                          'architecture', 'backend', 'frontend', 'database', 'git', 'code',
+                          'html', 'css', 'mysql', 'api', 'services'],
+}
+
+
+def record(jobQueries, nJobs=50, path=None):
+    """
+    Record the api pages and job posting pages for jobQueries
+    from Indeed.com into a corpus file
+
+    return: dict | the recorded corpus
+    params:
+       jobQueries: list[string] | job queries to record
+            nJobs: int | job postings per query
+             path: string | corpus file (default=corpusPath)
+    """
+    corpus = {'api':{}, 'postings':{}}
+    for jobQuery in jobQueries:
+        query = jobQuery.strip().lower().replace(' ','+')
+        pages = []
+
+        # api pages until nJobs postings (or no more results)
+        for start in range(0, nJobs, 10):
+            urls = indeed.apiPage(query, start=start)
+            if not urls: break
+            page = '<response>'
+            for url in urls:
+                html = utils.getURL(url).decode('utf-8', 'replace')
+                corpus['postings'][indeed.jobkeyFromURL(url)] = html
+                page += '\n<result><url>'+re.sub(r'^https?://[^/]+', HOST, url)+'</url></result>'
+            pages.append(page+'\n</response>')
+            print 'recorded', jobQuery, '| start =', start
+
+        corpus['api'][cache.normalizeQuery(jobQuery)] = pages
+
+    save(corpus, path)
+    return corpus
+
+
+def synthetic(jobQueries=None, nJobs=50, nWords=200, seed=3):
+    """
+    return: dict | corpus of generated postings for jobQueries (zipfian
+                   mixes of COMMON words and the query's SKILLS, with
+                   the mark-up and punctuation of real postings)
+    params:
+       jobQueries: list[string] | job queries (default=all of SKILLS)
+            nJobs: int | job postings per query
+           nWords: int | words per job description
+             seed: int | random seed
+    """
+    if jobQueries is None: jobQueries = sorted(SKILLS)
+    rng = np.random.RandomState(seed)
+    corpus = {'api':{}, 'postings':{}}
+
+    nPosting = 0
+    for jobQuery in jobQueries:
+        vocab = SKILLS[jobQuery] + COMMON
+        rng.shuffle(vocab)
+        pages = []
+        for start in range(0, nJobs, 10):
+            page = '<response>'
+            for i in range(start, min(start+10, nJobs)):
+                jobkey = '%016x' % (rng.randint(2**31) << 24 | nPosting)
+                nPosting += 1
+                words = [vocab[r % len(vocab)] for r in rng.zipf(1.3, nWords)]
+                for j in range(0, nWords, 12):
+                    words[j] += rng.choice(['.', ',', ' and/or', ';', "'s", ' (<b>5+</b>)'])
+                html  = '<html><head><title>'+jobQuery.title()+' job - Acme - San Francisco,'
+                html += ' CA | Indeed.com</title></head><body>\n<span class="company">Acme</span> - '
+                html += '<span class="location">San Francisco, CA</span>\n'
+                html += '<span class="summary">'+' '.join(words)+'</span>\n'
+                html += '<span class="sdn">Acme - 3 days ago</span></body></html>'
+                corpus['postings'][jobkey] = html
+                page += '\n<result><url>'+postingURL(jobkey)+'</url></result>'
+            pages.append(page+'\n</response>')
+        corpus['api'][jobQuery] = pages
+
+    return corpus
+
+
+def save(corpus, path=None):
+    """
+    Write a corpus file (replacing any existing one atomically)
+    params:
+           corpus: dict | the corpus
+             path: string | corpus file (default=corpusPath)
+    """
+    if path is None: path = corpusPath
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(corpus, f, indent=0, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def load(path=None):
+    """
+    return: dict | the corpus (strings as utf-8 encoded str, like
+                   the pages utils.getURL returns)
+    params:
+             path: string | corpus file (default=corpusPath)
+    """
+    if path is None: path = corpusPath
+    with open(path) as f:
+        corpus = json.load(f)
+    encode = lambda s: s.encode('utf-8')
+    return {'api':dict((encode(q), [encode(p) for p in pages])
+                       for q, pages in corpus['api'].iteritems()),
+            'postings':dict((encode(k), encode(html))
+                            for k, html in corpus['postings'].iteritems())}
+
+
+def postingURL(jobkey):
+    """
+    return: string | url of a corpus job posting (as in the api pages)
+    params:
+           jobkey: string | job posting ID
+    """
+    return HOST+'/viewjob?jk='+jobkey+'&amp;from=api'
+
+
+def postingWords(corpus):
+    """
+    return: list[tuple(string, list[string])] | (jobkey, words) of every
+                                                corpus posting, in jobkey order
+    params:
+           corpus: dict | the corpus
+    """
+    return [(jobkey, indeed.parsePage(postingURL(jobkey), corpus['postings'][jobkey])[-1])
+            for jobkey in sorted(corpus['postings'])]
+
+
+def buildBackground(con, corpus, dialect='sqlite'):
+    """
+    Fill the bkgd tables of a fresh database with the corpus postings
+    (the same ingestion as database.populateTables)
+
+    return: int | number of postings inserted
+    params:
+              con: connection to an empty database
+           corpus: dict | the corpus
+          dialect: string | SQL dialect ('mysql' or 'sqlite')
+    """
+    cur = con.cursor()
+    database.createTables(cur, dialect=dialect)
+    cur.close()
+
+    return database.insertBatch(con, postingWords(corpus), set(), dialect=dialect)
+
+
+def sqliteBackground(corpus, path):
+    """
+    return: function | connect() for a SQLite bkgd database built from
+                       the corpus at path (for background.BkgdIndex)
+    params:
+           corpus: dict | the corpus
+             path: string | SQLite file (rebuilt if it exists)
+    """
+    if os.path.exists(path): os.remove(path)
+
+    connect = storage.getPool(storage.SQLiteBackend(path)).connect
+    con = connect()
+    try:
+        buildBackground(con, corpus, dialect='sqlite')
+    finally:
+        con.close()
+    return connect
+
+
+def mysqlBackground(corpus, db='skillrank_fixture'):
+    """
+    return: function | connect() for a MySQL bkgd database built from
+                       the corpus (for background.BkgdIndex)
+    params:
+           corpus: dict | the corpus
+               db: string | MySQL database to (re)create
+                            (never the live skillrank database)
+    """
+    if db == 'skillrank':
+        raise ValueError('refusing to replace the live skillrank database')
+    database.dbRemove(db)
+    database.dbCreate(db)
+
+    connect = storage.getPool(storage.MySQLBackend(db=db)).connect
+    con = connect()
+    try:
+        buildBackground(con, corpus, dialect='mysql')
+    finally:
+        con.close()
+    return connect
+
+
+def useBackground(connect):
+    """
+    Point the shared bkgd indexes (see background.py) at a fixture database
+    params:
+          connect: function | returns a connection to the fixture database
+    """
+    with background.indexesLock:
+        for table in ['bkgd_words'] + sorted(database.NGRAM_TABLES):
+            background.indexes[table] = background.BkgdIndex(table, connect=connect, path=False)
+
+
+def main():
+
+    # retrieve user input
+    try:
+        command = sys.argv[1]
+        assert command in ['record', 'synthetic']
+        jobQueries = sys.argv[2:] or None
+        assert command == 'synthetic' or jobQueries
+    except (IndexError, AssertionError):
+        print '\n usage: '+sys.argv[0]+' record "job query" ["job query" ...]'
+        print '        '+sys.argv[0]+' synthetic'
+        sys.exit(1)
+
+    if command == 'record':
+        corpus = record(jobQueries)
+    else:
+        corpus = synthetic(jobQueries)
+        save(corpus)
+    print 'saved', len(corpus['postings']), 'postings for', len(corpus['api']), \
+          'job queries to', corpusPath
+
+
+if __name__ == '__main__':
+    main()
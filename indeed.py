@@ -11,50 +11,96 @@ threading functions.
 GHL's original threading source:
 https://gist.github.com/ghl3/4556336
 """
-import os, sys, re, nltk
-import urllib2, threading
+import re, time
 from Queue import Queue
-import utils
+from collections import deque
+import utils, fetch, cache, metrics, parsepool
 
-def getJobURLs(jobQuery, nURLs=1, start=0):
+# indeed.com search api (10 job postings per page)
+apiURL = 'http://api.indeed.com/ads/apisearch?publisher=6973678184764538&v=2'
+
+def apiPage(jobQuery, start=0):
     """
-    return: list of strings (each string is a URL to an
-            Indeed.com job posting for "jobQuery")
+    return: list of strings | job posting URL's on one page of
+                              api results for jobQuery
+    params:
+         jobQuery: string | pre-processed search terms (+'s for spaces)
+            start: int | index of the first job posting on the page
+    """
+    # api link for 10 postings for jobQuery at a time
+    api = apiURL+'&q=\"'+jobQuery+'\"&start='+str(start)
+
+    # get the content from api URL
+    with metrics.timer('api'):
+        raw = utils.getURL(api)
+    
+    # parse the raw data for individual job URL's
+    urls = re.findall(r'<url>.*</url>', raw)
+    
+    # remove the <link> and </link> tags from URL's
+    return [u.replace('<url>','').replace('</url>','') for u in urls]
+
+
+def iterJobURLs(jobQuery, nURLs=1, start=0, fanOut=4, maxPages=None):
+    """
+    Generator of unique job posting URL's for "jobQuery": api pages
+    are fetched concurrently (at most fanOut at a time) on the shared
+    fetch pool and URL's are yielded, in page order, as soon as their
+    page arrives. Stops once nURLs unique URL's have been yielded.
+    
+    yield: string | URL to an Indeed.com job posting for "jobQuery"
     params:
          jobQuery: string | search terms for Indeed.com
-                            (preprocessed for +'s rather than spaces, etc.)
-            nURLs: int | number of job posting URL's to return
+            nURLs: int | number of job posting URL's to yield
             start: int | beginning index for api job search
+           fanOut: int | maximum number of api pages in flight
+         maxPages: int | maximum number of pages to request
+                         (default: enough for nURLs plus duplicates)
     """
     # pre-process job query
     jobQuery = jobQuery.strip().lower().replace(' ','+')
     
-    # list for all URL's to be stored
-    allurls = []
+    # pages of 10 needed, plus room for duplicates across pages
+    if maxPages is None: maxPages = 2*(nURLs//10+1)
+    
+    pool = fetch.getPool()
+    pending, nextPage = deque(), 0
+    seen = set()
     
-    # loop through each page of 20 job postings for jobQuery
-    for i in range(nURLs//10+1):
+    while len(seen) < nURLs:
         
-        print 'url retrieval =', len(allurls)/float(nURLs)*100.0, 'percent complete'
+        # keep up to fanOut api pages in flight
+        while nextPage < maxPages and len(pending) < fanOut:
+            pending.append(pool.apply_async(apiPage, (jobQuery, start + nextPage*10)))
+            nextPage += 1
+        if not pending: break
         
-        # api link for 10 postings for jobQuery at a time
-        api  = 'http://api.indeed.com/ads/apisearch?publisher=6973678184764538&v=2'
-        api += '&q=\"'+jobQuery+'\"&start='+str(start + i*10)
-    
-        # get the content from api URL
-        raw = utils.getURL(api)
+        # wait for the next page in order
+        urls = pending.popleft().get(fetch.timeout*(fetch.maxRedirects+1))
         
-        # parse the raw data for individual job URL's
-        urls = re.findall(r'<url>.*</url>', raw)
+        # no more results for jobQuery
+        if not urls: break
         
-        # remove the <link> and </link> tags from URL's
-        urls = [u.replace('<url>','').replace('</url>','') for u in urls]
+        for url in urls:
+            if url in seen: continue
+            seen.add(url)
+            yield url
+            if len(seen) >= nURLs: break
         
-        # append current page of URL's to list of "all" URL's
-        allurls += urls
-    
-    # return only up to nURLs number of URL's for job postings
-    return allurls[:nURLs]
+        print 'url retrieval =', len(seen)/float(nURLs)*100.0, 'percent complete'
+
+
+def getJobURLs(jobQuery, nURLs=1, start=0):
+    """
+    return: list of strings (each string is a unique URL to an
+            Indeed.com job posting for "jobQuery")
+    params:
+         jobQuery: string | search terms for Indeed.com
+                            (preprocessed for +'s rather than spaces, etc.)
+            nURLs: int | number of job posting URL's to return
+            start: int | beginning index for api job search
+    """
+    return list(iterJobURLs(jobQuery, nURLs=nURLs, start=start))
 
 
 def jdClean(jd):
@@ -78,13 +124,19 @@ def jdClean(jd):
     
     # find all occurences of ' wordPUNCTUATIONword ' to "fix"
     fix = re.findall(r'\s\w+[^\w\s]\w+\s', jd)
-    for term in fix:
-        punc = re.search(r'[^\w\s]', term).group()
-        if punc == '/' or punc == ',':
-            # replace "/" or "," with an "and"
+    puncs = dict((term, re.search(r'[^\w\s]', term).group()) for term in fix)
+    
+    # replace "/" or "," with an "and"
+    for punc in ['/', ',']:
+        if punc in puncs.itervalues():
             jd = jd.replace(punc,' and ')
-        else:
-            jd = jd.replace(term, term.replace(punc,''))
+    
+    # remove other punctuation from every occurence of the terms, in
+    # one pass over the description rather than a replace per term
+    terms = set(term for term, punc in puncs.iteritems() if punc not in '/,')
+    if terms:
+        jd = re.sub(r'\s\w+[^\w\s]\w+\s', lambda m: m.group().replace(puncs[m.group()],'')
+                    if m.group() in terms else m.group(), jd)
          
     # convert unwanted punctuation into spaces (keep +'s)
     jd = re.sub('[^A-Za-z0-9\s\+\#-]+', ' ', jd)
@@ -99,14 +151,9 @@ def jdClean(jd):
     jd = re.sub(r'\s[\+\#-]+\s', ' ', jd)
     
     # only keep one-letter words that are C or R
-    Nr = jd.split().count('r')
-    Nc = jd.split().count('c')    
-    fix = re.findall(r'\w\w+', jd)
-    jdnew = ''
-    for f in fix: jdnew += f+' '
-    for i in range(Nr): jdnew += 'r '
-    for i in range(Nc): jdnew += 'c '
-    jd = jdnew
+    words = jd.split()
+    fix = re.findall(r'\w\w+', jd) + ['r']*words.count('r') + ['c']*words.count('c')
+    jd = ' '.join(fix)+' ' if fix else ''
 #    jd = re.sub(r'\s[^CR]\s',' ', jd)
     
     # fix "html css" bigrams / get rid of them
@@ -121,6 +168,15 @@ def jdClean(jd):
     return jd
 
 
+def jobkeyFromURL(url):
+    """
+    return: string | indeed.com unique job posting ID in a posting url
+    params:
+            url: string | url for the job posting
+    """
+    return re.search(r'jk=\w+&amp', url).group().replace('jk=','').replace('&amp','')
+
+
 def parseJobPosting(url):
     """
     return: jobkey[string], position[string], company[string], 
@@ -128,12 +184,47 @@ def parseJobPosting(url):
     params:
             url: string | url for the job posting to parse
     """
-    # extract raw data from URL and remove returns
-    raw = utils.getURL(url)
+    # extract raw data from URL
+    with metrics.timer('download'):
+        raw = utils.getURL(url)
+    
+    with metrics.timer('parse'):
+        return parsePage(url, raw)
+
+
+def jobDescription(raw):
+    """
+    return: string | the raw job description section of a job
+                     posting page ('' if there is none)
+    params:
+            raw: string | the job posting page (returns removed)
+    """
+    try:
+        start = 'span class="summary"'
+        end = 'days ago'
+        end   = '<span class="sdn">'#+company
+        #jd = re.search(r''+start+'.*'+end+'.*'+'days ago', raw,re.IGNORECASE).group()
+        jd = re.search(r''+start+'.*?'+end, raw).group()
+        jd = jd.replace('span class="summary"','').replace('<span class="sdn">','')
+        jd = jd.replace('<span class="date">',' ').replace('days ago',' ')
+    except AttributeError:
+        jd = ''
+    return jd
+
+
+def parsePage(url, raw):
+    """
+    return: jobkey[string], position[string], company[string], 
+                            location[string], words[list of strings]
+    params:
+            url: string | url of the job posting
+            raw: string | the job posting page
+    """
+    # remove returns
     raw = raw.replace('\n',' ')
     
     # retrieve the jobkey from the url
-    jobkey = re.search(r'jk=\w+&amp', url).group().replace('jk=','').replace('&amp','')
+    jobkey = jobkeyFromURL(url)
     
     # extract job position
     try:
@@ -160,77 +251,109 @@ def parseJobPosting(url):
         company = 'Unknown'
     
     # retrieve the job description section
-    try:
-        start = 'span class="summary"'
-        end = 'days ago'
-        end   = '<span class="sdn">'#+company
-        #jd = re.search(r''+start+'.*'+end+'.*'+'days ago', raw,re.IGNORECASE).group()
-        jd = re.search(r''+start+'.*?'+end, raw).group()
-        jd = jd.replace('span class="summary"','').replace('<span class="sdn">','')
-        jd = jd.replace('<span class="date">',' ').replace('days ago',' ')
-    except AttributeError:
-        jd = ''
+    jd = jobDescription(raw)
     
     # more advanced processing/cleaning of the job description
-    words = jdClean(jd).split() # list of words
+    with metrics.timer('tokenize'):
+        words = jdClean(jd).split() # list of words
     
     return jobkey, position, company, location, words
 
 
-class getIndeed(threading.Thread):
+def fetchPosting(url):
     """
-    A class to download indeed job postings
-    from a shared queue using threads for
-    boosted efficiency
+    return: indeed.parseJobPosting return tuple for url
+            (logged as the original posting threads did), the page
+            downloaded in this thread and parsed on the
+            parsing processes if started (see parsepool.py)
+    params:
+            url: string | url for the job posting to parse
     """
-    def __init__(self, queue):
-        threading.Thread.__init__(self)
-        self._stop = threading.Event()
-        self.articles = []
-        self.queue = queue
-        
-    def getArticles(self):
-        return self.articles
-        
-    def run(self):
-        while True:
-            if self.queue.empty(): 
-                return
-            url = self.queue.get()
-            returnItems = parseJobPosting(url)
-            self.articles.append(returnItems)
-            print returnItems[:-1]
+    with metrics.timer('download'):
+        raw = utils.getURL(url)
+    returnItems = parsepool.parse(parsePage, url, raw)
+    print returnItems[:-1]
+    return returnItems
 
 
-def threadResults(urls, nThreads=8):
+def threadResults(urls, nThreads=8, useCache=True):
     """
-    Download content from all urls
+    Download content from all urls using the shared pool of
+    keep-alive fetch workers (see fetch.py), skipping postings
+    already in the on-disk posting cache (see cache.py)
     
     return: list of indeed.parseJobPosting return tuples
     i.e. [(jobkey, position, company, location, words), ...]
      
     params:
-            urls: list[string] | list of urls as strings
-        nThreads: int | number of threads to use (default=8)
+            urls: iterable[string] | urls as strings (downloads start as
+                                     soon as each url arrives, e.g. from
+                                     iterJobURLs)
+        nThreads: int | unused, concurrency is set with fetch.configure
+        useCache: bool | look up and store postings in the posting cache
     """
-    q = Queue()
-    for url in urls:
-        q.put(url)
-        
-    # start threads to consume the queue
-    threads = [] 
-    for i in xrange(nThreads):
-        thread = getIndeed(q)
-        thread.start()
-        threads.append(thread)
+    # gather the results in url order, postings that failed to
+    # download are left out, as they were when their download
+    # thread died
+    done = dict(iterPostings(urls, useCache=useCache))
+    return [done[i] for i in sorted(done) if done[i] is not None]
+
+
+def iterPostings(urls, useCache=True):
+    """
+    Generate job postings as they become ready (cached postings
+    first, then downloads in the order they complete)
+    
+    yield: int, tuple | index of the url and its indeed.parseJobPosting
+                        tuple (None if the posting failed to download)
+    params:
+            urls: iterable[string] | urls as strings (downloads start as
+                                     soon as each url arrives)
+        useCache: bool | look up and store postings in the posting cache
+    """
+    postings = cache.getCache(cache.PostingCache) if useCache else None
+    
+    # finished postings, put by the cache lookups and fetch callbacks
+    done = Queue()
+    nURLs, nDone, nCached, nFailed, fetched = 0, 0, 0, 0, {}
+    t0 = time.time()
+    
+    try:
+        # consult the cache as each url arrives, fetch only the misses
+        for i, url in enumerate(urls):
+            document = None
+            if postings is not None:
+                try: document = postings.get(jobkeyFromURL(url))
+                except AttributeError: pass
+            if document is not None:
+                done.put((i, document, False))
+                nCached += 1
+            else: fetch.submit(fetchPosting, url,
+                               callback=lambda d, i=i: done.put((i, d, True)))
+            nURLs += 1
+            
+            # hand out whatever finished while the urls were arriving
+            while not done.empty() and nDone < nURLs:
+                i, document, new = done.get()
+                nDone += 1
+                if new and document is not None: fetched[document[0]] = document
+                if document is None: nFailed += 1
+                yield i, document
         
-    # collect results from threads
-    for thread in threads:
-        thread.join()
+        # then wait for the remaining downloads
+        while nDone < nURLs:
+            i, document, new = done.get()
+            nDone += 1
+            if new and document is not None: fetched[document[0]] = document
+            if document is None: nFailed += 1
+            yield i, document
+    
+    finally:
+        # store the newly fetched postings
+        if postings is not None: postings.setMany(fetched)
         
-    # gather and return all results
-    documents = []
-    for thread in threads:
-        documents += thread.getArticles()
-    return documents
-
+        # postings per request by source, and the time for all of them
+        metrics.observe('skillrank_postings_per_request', nCached, source='cache')
+        metrics.observe('skillrank_postings_per_request', len(fetched), source='fetched')
+        metrics.observe('skillrank_postings_per_request', nFailed, source='failed')
+        metrics.observe('skillrank_stage_seconds', time.time()-t0, stage='postings')
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+lexicon.py
+Author: Brian Boates
+
+Precomputed English lexicon for utils.isWord. The WordNet lemma
+names and morphological exception lists (and NLTK's English
+stopwords, see utils.collocations) are exported once into a
+pickle (python lexicon.py), which is loaded at startup so that
+isWord is a few set lookups with no NLTK import on the request
+path. isWord(word) matches bool(wordnet.synsets(word)), including
+WordNet's morphy rules (e.g. "dogs" ---> "dog", "geese" ---> "goose").
+"""
+import os, time, threading
+import cPickle as pickle
+
+# default location of the exported lexicon
+lexiconPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lexicon.pickle')
+
+# wordnet parts of speech (searched in this order by synsets)
+POS_LIST = ['n', 'v', 'a', 'r']
+FILEMAP  = {'n':'noun', 'v':'verb', 'a':'adj', 'r':'adv'}
+
+# wordnet's morphy suffix rules (nltk WordNetCorpusReader)
+SUBSTITUTIONS = {
+    'n': [('s', ''), ('ses', 's'), ('ves', 'f'), ('xes', 'x'), ('zes', 'z'),
+          ('ches', 'ch'), ('shes', 'sh'), ('men', 'man'), ('ies', 'y')],
+    'v': [('s', ''), ('ies', 'y'), ('es', 'e'), ('es', ''),
+          ('ed', 'e'), ('ed', ''), ('ing', 'e'), ('ing', '')],
+    'a': [('er', ''), ('est', ''), ('er', 'e'), ('est', 'e')],
+    'r': [],
+}
+
+
+class Lexicon(object):
+    """
+    WordNet lemma names and exception lists by part of speech
+    """
+    def __init__(self, lemmas, exceptions, stopwords=None):
+        """
+        params:
+                lemmas: dict | pos ---> frozenset of lemma names
+            exceptions: dict | pos ---> {inflected form: [base forms]}
+             stopwords: frozenset | english stopwords (None if not exported)
+        """
+        self.lemmas     = lemmas
+        self.exceptions = exceptions
+        self.stopwords  = stopwords
+
+        # lemma names of any part of speech (always words)
+        self.words = frozenset().union(*lemmas.values())
+
+    def morphy(self, form, pos):
+        """
+        return: True if form (or a base form of it) is a lemma for pos
+        params:
+             form: string | lower-cased word
+              pos: string | 'n', 'v', 'a' or 'r'
+        """
+        lemmas = self.lemmas[pos]
+
+        # the exception list replaces the rules entirely
+        exceptions = self.exceptions[pos]
+        if form in exceptions:
+            return form in lemmas or any(f in lemmas for f in exceptions[form])
+
+        if form in lemmas:
+            return True
+
+        # apply the suffix rules until a lemma is found or nothing applies
+        substitutions = SUBSTITUTIONS[pos]
+        forms = [form]
+        while forms:
+            forms = [f[:-len(old)]+new for f in forms
+                     for old, new in substitutions if f.endswith(old)]
+            for f in forms:
+                if f in lemmas: return True
+
+        return False
+
+    def isWord(self, word):
+        """
+        return: True if word is an english word, False otherwise
+        params:
+            word: string | word to check
+        """
+        word = word.lower()
+        if word in self.words:
+            return True
+        for pos in POS_LIST:
+            if self.morphy(word, pos):
+                return True
+        return False
+
+    __contains__ = isWord
+
+    def __len__(self):
+        return len(self.words)
+
+
+def build(path=None):
+    """
+    Export the WordNet lemma names, exception lists and english
+    stopwords (needs NLTK and its wordnet and stopwords data) to a
+    pickle, replacing any existing one
+    atomically
+
+    return: Lexicon | the exported lexicon
+    params:
+            path: string | output file (default=lexiconPath)
+    """
+    from nltk.corpus import wordnet, stopwords
+    if path is None: path = lexiconPath
+
+    lemmas, exceptions = {}, {}
+    for pos in POS_LIST:
+        lemmas[pos] = frozenset(wordnet.all_lemma_names(pos))
+        exceptions[pos] = {}
+        for line in wordnet.open('%s.exc' % FILEMAP[pos]):
+            terms = line.split()
+            exceptions[pos][terms[0]] = terms[1:]
+    ignored = frozenset(stopwords.words('english'))
+
+    # write to a temporary file, then swap it in
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        pickle.dump({'lemmas':lemmas, 'exceptions':exceptions, 'stopwords':ignored}, f, 2)
+    os.rename(tmp, path)
+
+    return Lexicon(lemmas, exceptions, ignored)
+
+
+def load(path=None):
+    """
+    return: Lexicon | the exported lexicon
+    params:
+            path: string | lexicon file (default=lexiconPath)
+    """
+    if path is None: path = lexiconPath
+    with open(path, 'rb') as f:
+        data = pickle.load(f)
+    return Lexicon(data['lemmas'], data['exceptions'], data.get('stopwords'))
+
+
+# lexicon for the process (loaded once, None if not built)
+lexicon, loaded = None, False
+
+# the lazy loads below run once per process, under this lock (the
+# compare and stream paths call them from several threads, and
+# nltk's lazy corpus loaders are not thread-safe)
+loadLock = threading.RLock()
+
+def getLexicon():
+    """
+    return: Lexicon | the process-wide lexicon (None if lexicon.py
+                      has not been run to build it)
+    """
+    global lexicon, loaded
+    if not loaded:
+        with loadLock:
+            if not loaded:
+                try:
+                    lexicon = load()
+                except (IOError, OSError):
+                    print 'no lexicon at', lexiconPath, '(run python lexicon.py), using nltk'
+                    lexicon = None
+                loaded = True
+    return lexicon
+
+
+# nltk wordnet for the process (loaded once, without a lexicon)
+wordnet = None
+
+def getWordnet():
+    """
+    return: nltk wordnet corpus reader, loaded
+    """
+    global wordnet
+    if wordnet is None:
+        with loadLock:
+            if wordnet is None:
+                from nltk.corpus import wordnet as reader
+                # the first attribute lookup loads the corpus
+                reader.synsets
+                wordnet = reader
+    return wordnet
+
+
+def isWord(word):
+    """
+    return: True if word is an english word, False otherwise
+            (falls back to nltk wordnet if the lexicon isn't built)
+    params:
+            word: string | word to check
+    """
+    lex = getLexicon()
+    if lex is not None:
+        return lex.isWord(word)
+
+    if getWordnet().synsets( word ):
+        return True
+    else: return False
+
+
+# english stopwords for the process (loaded once)
+stopwords = None
+
+def getStopwords():
+    """
+    return: frozenset | english stopwords (from nltk if they are
+                        not in the exported lexicon)
+    """
+    global stopwords
+    if stopwords is None:
+        with loadLock:
+            if stopwords is None:
+                lex = getLexicon()
+                if lex is not None and lex.stopwords is not None:
+                    stopwords = lex.stopwords
+                else:
+                    import nltk
+                    stopwords = frozenset(nltk.corpus.stopwords.words('english'))
+    return stopwords
+
+
+def main():
+
+    t0  = time.time()
+    lex = build()
+    print 'exported', len(lex), 'lemmas to', lexiconPath, 'in %.2f s' % (time.time()-t0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""
+metrics.py
+Author: Brian Boates
+
+In-process metrics for the skillrank package: per-stage latency
+histograms, upstream error counts and postings per request,
+rendered in the Prometheus text format by the /metrics route.
+Recording a value is a dictionary lookup and a few additions under
+a lock; the text (and the cache statistics, see cache.py) is only
+built when /metrics is scraped. Each worker process keeps its own
+metrics.
+
+STAGES (skillrank_stage_seconds{stage=...}):
+request:     /analyze or /analyze/stream request (cache hits included)
+getResults:  api pages, postings and analysis of one job query
+compare:     api pages, postings and analysis of compared job queries
+api:         one Indeed.com api page
+postings:    all job postings of one job query (cached and fetched)
+download:    one job posting page
+parse:       parsing one job posting page (jdClean included, on the
+             parsing processes when started, see parsepool.py)
+tokenize:    cleaning and tokenizing one job description
+analyze:     analysis.analyze (the stages below included)
+bkgd:        bkgd counts for the analysis (snapshot or table)
+bkgdLoad:    loading a full bkgd table into the shared index
+score:       term relevances and counts
+collocations: bigram step (top collocations and their counts)
+rank:        ranking, bigram selection and filtering
+refresh:     background refresh of a popular or stale query (see scheduler.py)
+poolWait:    waiting for a pooled database connection (see storage.py)
+query:       one database statement on a pooled connection
+"""
+import time, bisect, threading
+
+# histogram buckets for stage latencies in seconds
+SECONDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# histogram buckets for job postings per request
+POSTINGS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# metric name ---> (type, help, histogram buckets or None)
+METRICS = {
+    'skillrank_stage_seconds':
+        ('histogram', 'Seconds spent in each stage of an analysis', SECONDS),
+    'skillrank_postings_per_request':
+        ('histogram', 'Job postings per analysis by source (cache, fetched or failed)', POSTINGS),
+    'skillrank_upstream_errors_total':
+        ('counter', 'Failed requests to upstream hosts by error kind', None),
+    'skillrank_requests_total':
+        ('counter', 'Analysis requests by route and whether the results were cached', None),
+    'skillrank_parse_fallbacks_total':
+        ('counter', 'Job postings parsed in the fetch thread after the parsing process timed out', None),
+    'skillrank_refreshes_total':
+        ('counter', 'Background refreshes of precomputed results by reason and outcome', None),
+}
+
+
+class Histogram(object):
+    """
+    Cumulative-on-render histogram of observed values
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts  = [0] * (len(buckets)+1)
+        self.sum     = 0.0
+        self.count   = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+
+# recorded values: (name, labels) ---> Histogram or count
+values = {}
+lock = threading.Lock()
+
+# values recorded for another process instead (see capture)
+captured = None
+
+
+def observe(name, value, **labels):
+    """
+    Record value in histogram "name"
+    params:
+             name: string | histogram in METRICS
+            value: float | observed value
+           labels: string | label values (e.g. stage='download')
+    """
+    if captured is not None:
+        captured.append(('observe', name, value, labels))
+        return
+    key = (name, tuple(sorted(labels.iteritems())))
+    with lock:
+        histogram = values.get(key)
+        if histogram is None:
+            histogram = values[key] = Histogram(METRICS[name][2])
+        histogram.observe(value)
+
+
+def inc(name, n=1, **labels):
+    """
+    Add n to counter "name"
+    params:
+             name: string | counter in METRICS
+                n: int | amount to add
+           labels: string | label values (e.g. kind='timeout')
+    """
+    if captured is not None:
+        captured.append(('inc', name, n, labels))
+        return
+    key = (name, tuple(sorted(labels.iteritems())))
+    with lock:
+        values[key] = values.get(key, 0) + n
+
+
+class timer(object):
+    """
+    Time a block of code as a stage:
+
+        with metrics.timer('download'):
+            raw = utils.getURL(url)
+    """
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        observe('skillrank_stage_seconds', time.time()-self.t0, stage=self.stage)
+        return False
+
+
+class capture(object):
+    """
+    Keep the values recorded in a block of code (on a single threaded
+    worker process) in a list, for the process it works for to record
+    with replay:
+
+        with metrics.capture() as observed:
+            result = func(url, raw)
+    """
+    def __enter__(self):
+        global captured
+        captured = []
+        return captured
+
+    def __exit__(self, *exc):
+        global captured
+        captured = None
+        return False
+
+
+def replay(observed):
+    """
+    Record values kept by capture
+    params:
+         observed: list[tuple] | (kind, name, value, labels) of each value
+    """
+    for kind, name, value, labels in observed:
+        if kind == 'observe': observe(name, value, **labels)
+        else: inc(name, value, **labels)
+
+
+def timed(stage):
+    """
+    return: decorator timing every call of a function as a stage
+    params:
+            stage: string | stage name
+    """
+    def decorate(func):
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return func(*args, **kwargs)
+        wrapper.__name__, wrapper.__doc__ = func.__name__, func.__doc__
+        return wrapper
+    return decorate
+
+
+def formatLabels(labels, extra=()):
+    """
+    return: string | prometheus label set, e.g. {stage="api",le="0.5"}
+    """
+    pairs = list(labels) + list(extra)
+    if not pairs: return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{'+','.join('%s="%s"' % (k, escape(v)) for k, v in pairs)+'}'
+
+
+def formatValue(value):
+    if value == float('inf'): return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def cacheLines():
+    """
+    return: list[string] | prometheus lines for the hit ratio of
+                           every cache created in this process
+    """
+    import cache
+    stats = [(cls.__name__, c.stats()) for cls, c in cache.caches.items()]
+    lines = []
+    for name, kind, key, help in [
+            ('skillrank_cache_hits_total', 'counter', 'hits', 'Cache lookups that hit'),
+            ('skillrank_cache_misses_total', 'counter', 'misses', 'Cache lookups that missed'),
+            ('skillrank_cache_hit_ratio', 'gauge', 'hitRate', 'Fraction of cache lookups that hit'),
+            ('skillrank_cache_entries', 'gauge', 'entries', 'Entries in the cache file')]:
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for cacheName, s in sorted(stats):
+            lines.append(name+formatLabels([('cache', cacheName)])+' '+formatValue(s[key]))
+    return lines
+
+
+def poolLines():
+    """
+    return: list[string] | prometheus lines for the open and idle
+                           connections of every pool in this process
+    """
+    import storage
+    stats = [(':'.join(str(k) for k in key), pool.stats()) for key, pool in storage.pools.items()]
+    lines = []
+    for name, key, help in [
+            ('skillrank_pool_size', 'size', 'Maximum open connections of the pool'),
+            ('skillrank_pool_open', 'open', 'Open connections of the pool (idle or in use)'),
+            ('skillrank_pool_idle', 'idle', 'Idle connections of the pool')]:
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s gauge' % name)
+        for poolName, s in sorted(stats):
+            lines.append(name+formatLabels([('pool', poolName)])+' '+formatValue(s[key]))
+    return lines
+
+
+def render():
+    """
+    return: string | all metrics in the prometheus text format (0.0.4)
+    """
+    with lock:
+        snapshot = dict((key, (list(v.counts), v.sum, v.count) if isinstance(v, Histogram) else v)
+                        for key, v in values.iteritems())
+
+    lines = []
+    for name in sorted(METRICS):
+        kind, help, buckets = METRICS[name]
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for (n, labels), value in sorted(snapshot.iteritems()):
+            if n != name: continue
+            if kind == 'counter':
+                lines.append(name+formatLabels(labels)+' '+formatValue(value))
+                continue
+
+            # cumulative bucket counts, then the sum and count
+            counts, total, count = value
+            cumulative = 0
+            for le, c in zip(list(buckets)+[float('inf')], counts):
+                cumulative += c
+                lines.append(name+'_bucket'+formatLabels(labels, [('le', formatValue(le))])+
+                             ' '+str(cumulative))
+            lines.append(name+'_sum'+formatLabels(labels)+' '+formatValue(total))
+            lines.append(name+'_count'+formatLabels(labels)+' '+str(count))
+
+    return '\n'.join(lines + cacheLines() + poolLines())+'\n'
+
+
+def reset():
+    """
+    Forget all recorded values (e.g. between benchmark runs)
+    """
+    with lock:
+        values.clear()
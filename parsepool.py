@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+parsepool.py
+Author: Brian Boates
+
+Process pool for parsing job posting pages. The fetch threads
+(see fetch.py) only download; each page is handed to a pool of
+worker processes for the regexes and tokenization, which are
+CPU-bound and would otherwise all run under one GIL. The fetch
+thread waits for its page's result, so postings come back to
+indeed.iterPostings exactly as before. If a worker process dies
+(or a parse takes longer than "timeout"), the page is parsed in
+the fetch thread instead and the pool replaces the worker.
+
+The pool is off by default and only created by start(), which a
+process calls once at startup, before it has any threads: the
+workers are forked (python 2 has no other start method), and a
+fork while other threads hold locks can deadlock the children.
+Without a started pool pages are parsed in the fetch threads.
+Stage timings recorded on a worker (e.g. tokenize) are sent back
+and recorded in the process that asked for the parse.
+"""
+import os, threading
+import multiprocessing
+from multiprocessing import TimeoutError
+import metrics
+
+# number of parsing processes started by start() (0 parses in the
+# fetch threads) and seconds to wait for a parse before parsing in
+# the thread
+nProcs  = 0
+timeout = 10.0
+
+# shared state for the process (created by start, not inherited by
+# forked children)
+pool, poolPid = None, None
+poolLock = threading.Lock()
+
+
+def configure(procs=None, seconds=None):
+    """
+    Set the number of parsing processes and the parse timeout
+    (a running pool is stopped, see start)
+    params:
+            procs: int | number of worker processes (0 for none)
+          seconds: float | seconds to wait for a parse
+    """
+    global nProcs, timeout, pool, poolPid
+    with poolLock:
+        if procs is not None: nProcs = procs
+        if seconds is not None: timeout = seconds
+        if pool is not None and poolPid == os.getpid(): pool.terminate()
+        pool, poolPid = None, None
+
+
+def start(procs=None):
+    """
+    Start the pool of parsing processes for this process (call at
+    startup, before any threads are started)
+    return: Pool | the pool (None if disabled, or in a daemonic process
+                   such as a batch.py worker, which can't have children)
+    params:
+            procs: int | number of worker processes (default=nProcs)
+    """
+    global pool, poolPid
+    if procs is not None: configure(procs=procs)
+    if nProcs < 1 or multiprocessing.current_process().daemon:
+        return None
+    with poolLock:
+        if poolPid != os.getpid():
+            pool = multiprocessing.Pool(nProcs)
+            poolPid = os.getpid()
+    return pool
+
+
+def getPool():
+    """
+    return: Pool | the pool of parsing processes started in this
+                   process (None if there is none)
+    """
+    return pool if poolPid == os.getpid() else None
+
+
+def work(func, url, raw):
+    """
+    return: func(url, raw) and the metrics it recorded (computed on
+            a worker process, see metrics.capture)
+    """
+    with metrics.capture() as observed:
+        result = func(url, raw)
+    return result, observed
+
+
+def parse(func, url, raw):
+    """
+    return: func(url, raw), computed on the pool (or in this
+            thread without a pool or if the worker doesn't answer)
+    params:
+             func: function | picklable parser (e.g. indeed.parsePage)
+              url: string | url of the page
+              raw: string | the page
+    """
+    with metrics.timer('parse'):
+        processes = getPool()
+        if processes is None:
+            return func(url, raw)
+        try:
+            result, observed = processes.apply_async(work, (func, url, raw)).get(timeout)
+        except TimeoutError:
+            # a crashed worker never answers (the pool replaces it)
+            metrics.inc('skillrank_parse_fallbacks_total', reason='timeout')
+            return func(url, raw)
+        metrics.replay(observed)
+        return result
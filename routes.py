@@ -6,12 +6,21 @@ Author: Brian Boates
 Flask based script for Skill Rank web-app
 """
 from flask import Flask, render_template
-from flask import request, jsonify
-from collections import OrderedDict
-from analysis import getResults
+from flask import request, jsonify, Response, stream_with_context
+from analysis import streamResults, compareResults, bubbleResults
+import os, time, json, cache, analysis, coalesce, lexicon, metrics, parsepool, scheduler
 
 app = Flask(__name__)
 
+# load the english lexicon and stopwords at startup rather than
+# on the first request
+lexicon.getLexicon()
+lexicon.getStopwords()
+
+# fork the parsing processes (if any, see parsepool.nProcs) before
+# the server or the background refreshes start any threads
+parsepool.start()
+
 @app.route('/')
 def home():
     return render_template('home.html')
@@ -53,89 +62,255 @@ def contact():
     return render_template('contact.html')
 
 
-# dictionary for cached job queries
-cache = OrderedDict()
-cacheLimit = 1000
+# concurrent cache misses for the same query wait on a single
+# analysis (within a worker, and across workers via lock files)
+flights = coalesce.SingleFlight(lockDir=os.path.join(cache.cacheDir, 'locks'))
+
+# popular queries are refreshed ahead of expiry into the query_results
+# table, and stale results are served while they are refreshed (the
+# refreshes coalesce with requests for the same query)
+precompute = scheduler.Scheduler(analyze=lambda jobQuery: flights.do(jobQuery, refreshQuery, jobQuery))
+
+# cached results expire before the materialized ones would be refreshed,
+# so requests get to the query_results table (and trigger refreshes)
+cache.resultTTL = min(cache.resultTTL, precompute.maxAge)
 
 @app.route('/analyze', methods=['POST'] )
 def runAnalysis():
     
-    # get jobQuery and start
+    # get jobQuery (results are cached under its normalized form,
+    # so equivalent queries share them)
     jobQuery = request.form['jobQuery']
+    key = cache.normalizeQuery(jobQuery)
+    
+    # results cache shared by all workers (LRU + TTL, see cache.py)
+    resultCache = cache.getCache(cache.ResultCache)
+    
+    # count the query towards its popularity
+    precompute.hit(key)
     
-    # check to see if jobQuery already in cache
-    if jobQuery in cache:
-        print 'using cache brosef'
-        return jsonify(cache[jobQuery])
-    
-    # set nJobs to 50 ---> good balance of quality/speed
-    nJobs = 50
-    
-    # start from the first indeed.com API results
-    start = 0
-    
-    # set number of bubbles for d3 visualization
-    nBubbles = 25
-    
-    # get the results as list[tuple(term,relevance,count)]
-    results, biResults, resultsString = getResults(jobQuery=jobQuery, nJobs=nJobs, start=start)
-    
-    # catch for case with no results
-    if resultsString == '':
-        resultsString = 'No results found for "'+jobQuery+'"'
-        return jsonify({'resultsString':resultsString})
-    
-    results += biResults
-    
-    # sort the list in the most horrible way imaginable
-    # but it's short so it's okay :)
-    counts = [int(r[2]) for r in results] # create list of all counts
-    newResults = []
-    while counts:
-        # find the max count index, then remove it
-        maxC = counts.index(max(counts))
-        # put the max count result in newResults
-        newResults.append(results[maxC])
-        # pop the result out of both lists to keep in sync
-        counts.pop(maxC)
-        results.pop(maxC)
+    with metrics.timer('request'):
         
-    # filter single letters R and C if at top
-    # more likely a bug than reality
-    if newResults[0][0]+newResults[1][0] in ['cr','rc']:
-        newResults = newResults[2:]
+        # check to see if jobQuery already in cache, then whether
+        # it's precomputed (served even if stale, see scheduler.py)
+        cached = resultCache.get(key)
+        if cached is None: cached = materialized(key)
+        metrics.inc('skillrank_requests_total', route='/analyze',
+                    cached=str(cached is not None).lower())
+        if cached is not None:
+            print 'using cache brosef'
+            return jsonify(cached)
         
-    # update results to newResults
-    results = newResults[:nBubbles]
+        # run the analysis once for all concurrent requests of jobQuery
+        dictResults = flights.do(key, analyzeQuery, jobQuery)
     
-    # if results is an empty list
-    if not results:
-        # return empty jsonify dict
-        return jsonify({})
-        
-    # build the results dictionary for d3
-    dictResults = {'items':[]}
-    
-    # put words and bigrams in the results dictionary
-    for term, relevance, count in results:
-            dictResults['items'].append({'term':term, 'relevance':relevance,
-                                         'count':float(count), 'len':len(term.split())})
-                                         
-    # add the jobQuery to the results dictonary for quick reference
-    dictResults['query'] = str(jobQuery).replace(' ','+')
-    
-    # add the resultsString to the results dictionary
-    dictResults['resultsString'] = resultsString
-                                         
-    # add results to the cache (keep length below 1000)
-    if len(cache) > cacheLimit:
-        cache.popitem(last=False)
-    cache[jobQuery] = dictResults
+    # return in jsonified format
+    return jsonify(dictResults)
+
+
+def analyzeQuery(jobQuery):
+    """
+    Results of a job query, cached or from a full analysis that is
+    also stored in the query_results table (see analysis.analyzeQuery)
+    
+    return: dict | results dictionary for d3
+    params:
+         jobQuery: string | job query from user input
+    """
+    return analysis.analyzeQuery(jobQuery, store=precompute.store)
+
+
+def refreshQuery(jobQuery):
+    """
+    Full skillrank analysis of a job query, cached and stored in the
+    query_results table (see analysis.refreshQuery)
+    
+    return: dict | results dictionary for d3
+    params:
+         jobQuery: string | job query from user input (the normalized
+                            query for background refreshes)
+    """
+    return analysis.refreshQuery(jobQuery, store=precompute.store)
+
+
+def materialized(jobQuery):
+    """
+    return: dict | precomputed results of jobQuery (None if there are
+                   none or the query_results table is unavailable)
+    params:
+         jobQuery: string | normalized job query
+    """
+    try:
+        return precompute.lookup(jobQuery)
+    except Exception, e:
+        print 'results lookup failed for', jobQuery, '|', e
+        return None
+
+
+# most job queries compared in one request
+maxCompare = 5
+
+@app.route('/compare', methods=['POST'])
+def runComparison():
+    """
+    Compare job queries (form field jobQueries, separated by commas
+    or new lines): the results dictionary of every query, plus the
+    relevance and count of every query's words for all the queries
+    """
+    # get the job queries (duplicates by normalized form removed)
+    jobQueries, keys = [], set()
+    for jobQuery in request.form.get('jobQueries', '').replace('\n', ',').split(','):
+        key = cache.normalizeQuery(jobQuery)
+        if key and key not in keys:
+            keys.add(key)
+            jobQueries.append(jobQuery.strip())
+    if not 1 < len(jobQueries) <= maxCompare:
+        return jsonify({'error':'compare 2 to %d job queries' % maxCompare}), 400
+    
+    with metrics.timer('request'):
+        metrics.inc('skillrank_requests_total', route='/compare', cached='false')
+        dictResults = compareQueries(jobQueries)
     
     # return in jsonified format
     return jsonify(dictResults)
 
 
+def compareQueries(jobQueries, nBubbles=25):
+    """
+    Analyze job queries together (see analysis.compareResults) and
+    cache each query's results like /analyze
+    
+    return: dict | queries, results (job query ---> results dictionary
+                   for d3), terms (the words of all results) and their
+                   relevance (unnormalized, None where a query's postings
+                   lack the word) and count for every query
+    params:
+       jobQueries: list[string] | job queries from user input
+         nBubbles: int | number of bubbles per query
+    """
+    resultCache = cache.getCache(cache.ResultCache)
+    
+    # set nJobs to 50 ---> good balance of quality/speed (as /analyze)
+    perQuery, (vocab, R, C) = compareResults(jobQueries, nJobs=50)
+    
+    # build the results dictionary of each query
+    dictResults = {'queries':[q.replace(' ','+') for q in jobQueries], 'results':{}}
+    terms = []
+    for jobQuery in jobQueries:
+        results, biResults, resultsString = perQuery[jobQuery]
+        queryResults = bubbleResults(jobQuery, results, biResults, resultsString, nBubbles)
+        dictResults['results'][jobQuery] = queryResults
+        if 'items' in queryResults:
+            resultCache.set(cache.normalizeQuery(jobQuery), queryResults)
+            terms += [item['term'] for item in queryResults['items']
+                      if item['len'] == 1 and item['term'] not in terms]
+    
+    # every query's relevance and count of the words in any results
+    ids = dict((term, i) for i, term in enumerate(vocab))
+    columns = [ids[term] for term in terms]
+    dictResults['terms'] = terms
+    dictResults['relevance'] = [[None if C[q,i] == 0 else float(R[q,i]) for i in columns]
+                                for q in range(len(jobQueries))]
+    dictResults['counts'] = [[int(C[q,i]) for i in columns] for q in range(len(jobQueries))]
+    
+    return dictResults
+
+
+def event(name, data):
+    """
+    return: string | a Server-Sent Event with JSON data
+    params:
+             name: string | event name ('partial' or 'final')
+             data: dict | event data
+    """
+    return 'event: '+name+'\ndata: '+json.dumps(data)+'\n\n'
+
+
+@app.route('/analyze/stream')
+def streamAnalysis():
+    """
+    Server-Sent Events version of /analyze: "partial" events with
+    the bubbles for the postings downloaded so far, then a "final"
+    event with the same results dictionary as /analyze
+    """
+    # get jobQuery (results are cached under its normalized form,
+    # so equivalent queries share them)
+    jobQuery = request.args.get('jobQuery', '')
+    key = cache.normalizeQuery(jobQuery)
+    resultCache = cache.getCache(cache.ResultCache)
+    precompute.hit(key)
+    
+    def events():
+        
+        # cached and precomputed queries are sent straight away
+        t0 = time.time()
+        cached = resultCache.get(key)
+        if cached is None: cached = materialized(key)
+        metrics.inc('skillrank_requests_total', route='/analyze/stream',
+                    cached=str(cached is not None).lower())
+        if cached is not None:
+            yield event('final', cached)
+            return
+        
+        # one analysis for all concurrent requests of jobQuery (streamed
+        # or not): later requests get the partial results sent so far,
+        # then follow along
+        for final, dictResults in flights.stream(key, streamQuery, jobQuery):
+            if final:
+                metrics.observe('skillrank_stage_seconds', time.time()-t0, stage='request')
+                yield event('final', dictResults)
+            else:
+                yield event('partial', dictResults)
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control':'no-cache', 'X-Accel-Buffering':'no'})
+
+
+def streamQuery(jobQuery):
+    """
+    Run the full skillrank analysis for a job query as the postings
+    arrive, then cache it and store it in the query_results table
+    like refreshQuery
+    
+    yield: bool, dict | whether the results are final, results
+                        dictionary for d3 (partial results only once
+                        there are bubbles)
+    params:
+         jobQuery: string | job query from user input
+    """
+    # another worker may have finished jobQuery while we waited
+    resultCache = cache.getCache(cache.ResultCache)
+    key = cache.normalizeQuery(jobQuery)
+    cached = resultCache.get(key)
+    if cached is not None:
+        yield True, cached
+        return
+    
+    for results, biResults, resultsString, final in streamResults(jobQuery, nJobs=50):
+        
+        # partial results are only sent once there are bubbles
+        if not final:
+            try: dictResults = bubbleResults(jobQuery, results, biResults, resultsString)
+            except IndexError: continue
+            if 'items' in dictResults:
+                yield False, dictResults
+            continue
+        
+        # final results, cached and materialized like /analyze
+        dictResults = bubbleResults(jobQuery, results, biResults, resultsString)
+        analysis.cacheResults(jobQuery, dictResults, store=precompute.store)
+        yield True, dictResults
+
+
+@app.route('/metrics')
+def metricsText():
+    """
+    Stage latencies, cache hit ratios, upstream errors and postings
+    per request of this worker in the prometheus text format
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
 #    app.run(debug=True)
     app.run('0.0.0.0', port=8080)
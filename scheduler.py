@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+"""
+scheduler.py
+Author: Brian Boates
+
+Background precomputation of popular job queries. /analyze
+records every job query (counted in memory and added to the
+query_hits table by a daemon thread every few seconds); the same
+thread re-runs the analysis of the topK queries of the last
+"window" seconds before their results are "maxAge" seconds old
+and stores them in the query_results table, so the first request
+after an expiry doesn't pay for the scrape. Results up to "maxAge"
+old are served as is; older results (up to "staleAge") are served
+immediately while the query is refreshed in the background
+(stale-while-revalidate). A worker claims a query before
+refreshing it, so only one worker (on any host) refreshes it.
+
+TABLES:          COLUMNS:
+query_hits:      query | hour | count  (requests per query per hour)
+query_results:   query | results (json) | refreshed | claimed
+"""
+import os, time, json, threading
+from Queue import Queue, Empty
+from collections import Counter
+import database, metrics, storage
+
+# table definitions for each supported SQL dialect
+TABLES = {
+    'mysql':  ["CREATE TABLE IF NOT EXISTS \
+                query_hits(query VARCHAR(255), hour INT, count INT, \
+                           PRIMARY KEY (query, hour))",
+               "CREATE TABLE IF NOT EXISTS \
+                query_results(query VARCHAR(255) PRIMARY KEY, results MEDIUMTEXT, \
+                              refreshed DOUBLE, claimed DOUBLE)"],
+    'sqlite': ["CREATE TABLE IF NOT EXISTS \
+                query_hits(query VARCHAR(255), hour INT, count INT, \
+                           PRIMARY KEY (query, hour))",
+               "CREATE TABLE IF NOT EXISTS \
+                query_results(query VARCHAR(255) PRIMARY KEY, results TEXT, \
+                              refreshed DOUBLE, claimed DOUBLE)"],
+}
+
+# insert unless the key already exists
+INSERT_IGNORE = {'mysql': "INSERT IGNORE INTO", 'sqlite': "INSERT OR IGNORE INTO"}
+
+
+class Scheduler(object):
+    """
+    Popularity tracking and background refreshes of the query_results
+    table for one worker process
+    """
+    def __init__(self, analyze, backend=None, topK=50, window=7*86400.0, maxAge=6*3600.0,
+                 staleAge=7*86400.0, refreshAhead=0.8, interval=60.0, flushEvery=5.0, lease=600.0):
+        """
+        params:
+          analyze: function | jobQuery ---> results dictionary (always a
+                              fresh analysis, see routes.refreshQuery)
+          backend: storage.Backend | database of the tables (default
+                                     storage backend if None)
+             topK: int | number of popular queries kept precomputed
+           window: float | seconds of traffic that count for popularity
+           maxAge: float | seconds results are served without a refresh
+         staleAge: float | seconds stale results are still served
+     refreshAhead: float | fraction of maxAge after which popular queries
+                           are refreshed ahead of expiry
+         interval: float | seconds between checks for due popular queries
+       flushEvery: float | seconds between writes of the query counts
+            lease: float | seconds a claim on a query lasts
+        """
+        self.analyze      = analyze
+        self.backend      = backend
+        self.topK         = topK
+        self.window       = window
+        self.maxAge       = maxAge
+        self.staleAge     = staleAge
+        self.refreshAhead = refreshAhead
+        self.interval     = interval
+        self.flushEvery   = flushEvery
+        self.lease        = lease
+        self.hits    = Counter()
+        self.pending = Queue()
+        self.queued  = set()
+        self.lock    = threading.Lock()
+        self.created = False
+        self._thread = None
+        self._pid    = None
+        self._stop   = threading.Event()
+
+    def connect(self):
+        """
+        return: storage.PooledConnection | connection to the database
+                                           of the tables (created once)
+        """
+        con = storage.connect(self.backend)
+        if not self.created:
+            cur = con.cursor()
+            for table in TABLES[con.dialect]:
+                cur.execute(table)
+            con.commit()
+            cur.close()
+            self.created = True
+        return con
+
+    def hit(self, jobQuery):
+        """
+        Count a request for jobQuery (and start the refresh thread)
+        params:
+         jobQuery: string | normalized job query
+        """
+        if self._pid != os.getpid():
+            self.start()
+        with self.lock:
+            self.hits[jobQuery] += 1
+
+    def lookup(self, jobQuery):
+        """
+        return: dict | materialized results of jobQuery (None if missing
+                       or older than staleAge; results older than maxAge
+                       are returned and queued for a refresh)
+        params:
+         jobQuery: string | normalized job query
+        """
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute("SELECT results, refreshed FROM query_results WHERE query = ?", (jobQuery,))
+            row = cur.fetchone()
+            cur.close()
+        finally:
+            con.close()
+
+        if row is None or row[0] is None:
+            return None
+        age = time.time() - row[1]
+        if age > self.staleAge:
+            return None
+        if age > self.maxAge:
+            self.revalidate(jobQuery)
+        return json.loads(row[0])
+
+    def store(self, jobQuery, dictResults):
+        """
+        Materialize the results of jobQuery (and release its claim)
+        params:
+         jobQuery: string | normalized job query
+      dictResults: dict | results dictionary
+        """
+        con = self.connect()
+        try:
+            with con:
+                cur = con.cursor()
+                cur.execute(INSERT_IGNORE[con.dialect]+" query_results(query, claimed) \
+                             VALUES(?, 0)", (jobQuery,))
+                cur.execute("UPDATE query_results SET results = ?, refreshed = ?, claimed = 0 \
+                             WHERE query = ?", (json.dumps(dictResults), time.time(), jobQuery))
+                cur.close()
+        finally:
+            con.close()
+
+    def claim(self, jobQuery):
+        """
+        return: True if this worker may refresh jobQuery (nobody else
+                holds an unexpired claim)
+        params:
+         jobQuery: string | normalized job query
+        """
+        now = time.time()
+        con = self.connect()
+        try:
+            with con:
+                cur = con.cursor()
+                cur.execute(INSERT_IGNORE[con.dialect]+" query_results(query, claimed) \
+                             VALUES(?, 0)", (jobQuery,))
+                cur.execute("UPDATE query_results SET claimed = ? WHERE query = ? AND claimed < ?",
+                            (now, jobQuery, now-self.lease))
+                claimed = cur.rowcount == 1
+                cur.close()
+        finally:
+            con.close()
+        return claimed
+
+    def unclaim(self, jobQuery):
+        con = self.connect()
+        try:
+            with con:
+                con.execute("UPDATE query_results SET claimed = 0 WHERE query = ?", (jobQuery,)).close()
+        finally:
+            con.close()
+
+    def revalidate(self, jobQuery):
+        """
+        Queue a background refresh of jobQuery (once until it's done)
+        """
+        if self._pid != os.getpid():
+            self.start()
+        with self.lock:
+            if jobQuery in self.queued: return
+            self.queued.add(jobQuery)
+        self.pending.put((jobQuery, 'stale'))
+
+    def refresh(self, jobQuery, reason='popular'):
+        """
+        Re-run the analysis of jobQuery and materialize it, unless
+        another worker is already refreshing it
+        return: True if the query was refreshed
+        params:
+         jobQuery: string | normalized job query
+           reason: string | 'popular' (ahead of expiry) or 'stale'
+        """
+        if not self.claim(jobQuery):
+            return False
+        try:
+            with metrics.timer('refresh'):
+                dictResults = self.analyze(jobQuery)
+        except Exception:
+            self.unclaim(jobQuery)
+            metrics.inc('skillrank_refreshes_total', reason=reason, outcome='failed')
+            raise
+        if 'items' not in dictResults:
+            self.unclaim(jobQuery)
+            metrics.inc('skillrank_refreshes_total', reason=reason, outcome='empty')
+            return False
+        self.store(jobQuery, dictResults)
+        metrics.inc('skillrank_refreshes_total', reason=reason, outcome='refreshed')
+        return True
+
+    def flush(self):
+        """
+        Add the counted requests to query_hits (and drop counts
+        older than the popularity window)
+        """
+        with self.lock:
+            hits, self.hits = self.hits, Counter()
+        if not hits: return
+        hour = int(time.time() // 3600)
+        con = self.connect()
+        try:
+            with con:
+                cur = con.cursor()
+                database.upsertCounts(cur, 'query_hits', dict(((q, hour), n) for q, n in hits.iteritems()),
+                                      columns=('query','hour'), dialect=con.dialect)
+                cur.execute("DELETE FROM query_hits WHERE hour < ?", (hour - int(self.window // 3600),))
+                cur.close()
+        finally:
+            con.close()
+
+    def popular(self):
+        """
+        return: list[tuple(string, int)] | the topK queries of the window
+                                           and their requests, most first
+        """
+        since = int((time.time()-self.window) // 3600)
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute("SELECT query, SUM(count) AS n FROM query_hits WHERE hour >= ? \
+                         GROUP BY query ORDER BY n DESC, query LIMIT ?", (since, self.topK))
+            rows = [(q, int(n)) for q, n in cur.fetchall()]
+            cur.close()
+        finally:
+            con.close()
+        return rows
+
+    def due(self):
+        """
+        return: list[string] | popular queries without results or with
+                               results older than refreshAhead * maxAge
+        """
+        queries = [q for q, n in self.popular()]
+        if not queries: return []
+        con = self.connect()
+        try:
+            cur = con.cursor()
+            cur.execute("SELECT query, refreshed FROM query_results WHERE results IS NOT NULL \
+                         AND query IN ("+','.join(['?']*len(queries))+")", queries)
+            refreshed = dict(cur.fetchall())
+            cur.close()
+        finally:
+            con.close()
+        oldest = time.time() - self.refreshAhead*self.maxAge
+        return [q for q in queries if refreshed.get(q, 0) < oldest]
+
+    def start(self):
+        """
+        Start the refresh thread for this process (threads
+        don't survive a fork, so each worker starts its own)
+        """
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # counts and queued refreshes of the parent process stay there
+            self.hits, self.queued = Counter(), set()
+            self.pending = Queue()
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the refresh thread (after its current refresh)
+        """
+        self._stop.set()
+
+    def run(self):
+        nextFlush = nextCheck = time.time()
+        while not self._stop.is_set():
+            # stale queries are refreshed as soon as they are queued
+            try:
+                jobQuery, reason = self.pending.get(timeout=max(0.0, min(nextFlush, nextCheck)-time.time()))
+                try:
+                    self.refresh(jobQuery, reason)
+                except Exception, e:
+                    print 'refresh failed for', jobQuery, '|', e
+                with self.lock:
+                    self.queued.discard(jobQuery)
+            except Empty:
+                pass
+
+            try:
+                now = time.time()
+                if now >= nextFlush:
+                    self.flush()
+                    nextFlush = now + self.flushEvery
+
+                # refresh popular queries ahead of expiry
+                if now >= nextCheck:
+                    for jobQuery in self.due():
+                        try:
+                            self.refresh(jobQuery, 'popular')
+                        except Exception, e:
+                            print 'refresh failed for', jobQuery, '|', e
+                    nextCheck = time.time() + self.interval
+            except Exception, e:
+                print 'scheduler failed |', e
+                nextFlush = nextCheck = time.time() + self.flushEvery
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""
+storage.py
+Author: Brian Boates
+
+Pooled database access for the skillrank package. A backend
+(MySQL or SQLite) opens connections; a bounded per-process pool
+of them is shared by every thread, so a request reuses an open,
+authenticated connection instead of connecting to MySQL each
+time. Pooled connections look like DB-API connections (close()
+returns them to the pool, "with con:" commits or rolls back) and
+their cursors take "?" placeholders for every backend: each
+statement is translated once to the backend's parameter style
+and cached, and SQLite keeps the compiled statements per
+connection. Pool wait times and query times are recorded as the
+poolWait and query stages (see metrics.py).
+
+usage:
+    con = storage.connect()                  # default backend (MySQL skillrank)
+    cur = con.cursor()
+    cur.execute("SELECT count FROM bkgd_words WHERE term = ?", (term,))
+    con.close()                              # back to the pool
+"""
+import os, re, time, sqlite3, threading
+import metrics
+
+
+class PoolTimeout(Exception):
+    """
+    No pooled connection became free within the pool's timeout
+    """
+    pass
+
+
+def identifier(name):
+    """
+    return: string | name, checked to be a plain SQL identifier (for
+                     database and table names, which can't be parameters)
+    """
+    if not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', name):
+        raise ValueError('invalid SQL identifier: %r' % name)
+    return name
+
+
+# quoted SQL literals and identifiers (kept as they are), or a "?"
+# placeholder (translated to the backend's parameter style)
+literals = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)|\?""")
+
+
+class Backend(object):
+    """
+    A database to connect to: its SQL dialect, parameter style
+    and how to open a connection
+    """
+    dialect = None
+    paramstyle = '?'
+
+    def __init__(self):
+        self.statements = {}
+
+    def key(self):
+        """
+        return: tuple | identity of the database (one pool per key)
+        """
+        raise NotImplementedError
+
+    def connect(self):
+        """
+        return: a new DB-API connection to the database
+        """
+        raise NotImplementedError
+
+    def prepare(self, sql):
+        """
+        return: string | sql with "?" placeholders in this backend's
+                         parameter style (translated once per statement,
+                         a "?" inside a quoted literal is left alone)
+        """
+        try:
+            return self.statements[sql]
+        except KeyError:
+            prepared = literals.sub(lambda m: m.group(1) or self.paramstyle, sql)
+            if len(self.statements) < 1000: self.statements[sql] = prepared
+            return prepared
+
+
+class MySQLBackend(Backend):
+    """
+    A MySQL database (db=None for server-level statements)
+    """
+    dialect = 'mysql'
+    paramstyle = '%s'
+
+    def __init__(self, db='skillrank', host='localhost', user='root'):
+        Backend.__init__(self)
+        self.db, self.host, self.user = db, host, user
+
+    def key(self):
+        return (self.dialect, self.host, self.user, self.db)
+
+    def connect(self):
+        import MySQLdb as mdb
+        if self.db is None:
+            return mdb.connect(host=self.host, user=self.user)
+        return mdb.connect(host=self.host, user=self.user, db=self.db)
+
+
+class SQLiteBackend(Backend):
+    """
+    A SQLite database file (a local stand-in for MySQL in tests
+    and benchmarks)
+    """
+    dialect = 'sqlite'
+    paramstyle = '?'
+
+    def __init__(self, path):
+        Backend.__init__(self)
+        self.path = os.path.abspath(path)
+
+    def key(self):
+        return (self.dialect, self.path)
+
+    def connect(self):
+        # pooled connections move between threads
+        con = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False,
+                              cached_statements=256)
+        con.text_factory = str
+        return con
+
+
+class Cursor(object):
+    """
+    Cursor taking "?" placeholders, timing every statement
+    """
+    def __init__(self, cursor, backend):
+        self.cursor  = cursor
+        self.backend = backend
+
+    def execute(self, sql, params=None):
+        sql = self.backend.prepare(sql)
+        with metrics.timer('query'):
+            if params is None: return self.cursor.execute(sql)
+            return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, rows):
+        sql = self.backend.prepare(sql)
+        with metrics.timer('query'):
+            return self.cursor.executemany(sql, rows)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        # fetchone, fetchall, rowcount, lastrowid, close, ...
+        return getattr(self.cursor, name)
+
+
+class PooledConnection(object):
+    """
+    A connection checked out of a Pool: close() returns it, and
+    "with con:" commits (or rolls back on an exception)
+    """
+    def __init__(self, pool, raw):
+        self.pool    = pool
+        self.raw     = raw
+        self.dialect = pool.backend.dialect
+
+    def cursor(self):
+        return Cursor(self.raw.cursor(), self.pool.backend)
+
+    def execute(self, sql, params=None):
+        """
+        return: Cursor | a new cursor that executed sql
+        """
+        cur = self.cursor()
+        cur.execute(sql, params)
+        return cur
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        if self.raw is not None:
+            raw, self.raw = self.raw, None
+            self.pool.release(raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None: self.raw.commit()
+        else:            self.raw.rollback()
+        return False
+
+
+class Pool(object):
+    """
+    At most "size" open connections to a backend, shared by the
+    threads of a process: connect() hands out an idle connection,
+    opens a new one while fewer than "size" are open, or waits up
+    to "timeout" seconds for one to be returned. Connections idle
+    for more than "recycle" seconds are reopened (MySQL drops idle
+    connections). After a fork the child starts an empty pool.
+    """
+    def __init__(self, backend, size=8, timeout=30.0, recycle=3600.0):
+        self.backend = backend
+        self.size    = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.cond    = threading.Condition(threading.Lock())
+        self.reset()
+
+    def reset(self):
+        # the parent's connections are kept referenced (closing them
+        # here would close them for the parent too)
+        self.orphans = getattr(self, 'orphans', []) + [raw for raw, t in getattr(self, 'idle', [])]
+        self.idle  = []     # (connection, time returned)
+        self.nOpen = 0
+        self.pid   = os.getpid()
+
+    def connect(self):
+        """
+        return: PooledConnection | an open connection (close it to return it)
+        """
+        t0 = time.time()
+        with self.cond:
+            if self.pid != os.getpid(): self.reset()
+            while True:
+                if self.idle:
+                    raw, returned = self.idle.pop()
+                    if time.time() - returned <= self.recycle: break
+                    self.nOpen -= 1
+                    closeQuietly(raw)
+                    continue
+                if self.nOpen < self.size:
+                    self.nOpen += 1
+                    raw = None
+                    break
+                remaining = t0 + self.timeout - time.time()
+                if remaining <= 0:
+                    raise PoolTimeout('no free connection to %s after %.1f s' %
+                                      (self.backend.key(), self.timeout))
+                self.cond.wait(remaining)
+        metrics.observe('skillrank_stage_seconds', time.time()-t0, stage='poolWait')
+
+        # open a new connection outside the lock
+        if raw is None:
+            try:
+                raw = self.backend.connect()
+            except:
+                with self.cond:
+                    self.nOpen -= 1
+                    self.cond.notify()
+                raise
+        return PooledConnection(self, raw)
+
+    def release(self, raw):
+        """
+        Return a connection to the pool (rolled back; dropped if that fails)
+        params:
+              raw: DB-API connection from this pool
+        """
+        if self.pid != os.getpid():
+            return
+        try:
+            raw.rollback()
+            broken = False
+        except Exception:
+            broken = True
+        with self.cond:
+            if broken:
+                self.nOpen -= 1
+                closeQuietly(raw)
+            else:
+                self.idle.append((raw, time.time()))
+            self.cond.notify()
+
+    def close(self):
+        """
+        Close the idle connections
+        """
+        with self.cond:
+            for raw, returned in self.idle:
+                closeQuietly(raw)
+            self.nOpen -= len(self.idle)
+            self.idle = []
+
+    def stats(self):
+        """
+        return: dict | pool size and its open and idle connections
+        """
+        with self.cond:
+            return {'size':self.size, 'open':self.nOpen, 'idle':len(self.idle)}
+
+
+def closeQuietly(raw):
+    try: raw.close()
+    except Exception: pass
+
+
+# default backend and the pools of the process (one per database)
+defaultBackend = MySQLBackend()
+poolSize = 8
+pools = {}
+poolsLock = threading.Lock()
+
+def configure(backend=None, size=None):
+    """
+    Set the default backend (e.g. a SQLiteBackend for local runs)
+    and the size of new pools
+    params:
+          backend: Backend | database used by connect() by default
+             size: int | maximum open connections per pool
+    """
+    global defaultBackend, poolSize
+    if backend is not None: defaultBackend = backend
+    if size is not None: poolSize = size
+
+
+def getPool(backend=None):
+    """
+    return: Pool | the process-wide pool for backend (default backend
+                   if None)
+    """
+    if backend is None: backend = defaultBackend
+    key = backend.key()
+    try:
+        return pools[key]
+    except KeyError:
+        with poolsLock:
+            if key not in pools:
+                pools[key] = Pool(backend, size=poolSize)
+            return pools[key]
+
+
+def connect(backend=None):
+    """
+    return: PooledConnection | connection from the pool of backend
+                               (default backend if None)
+    """
+    return getPool(backend).connect()
@@ -6,28 +6,28 @@ Author: Brian Boates
 Python script containing utility functions 
 for the skillrank package
 """
-import os, sys, re
-import urllib2
-import nltk
+import heapq
+import numpy as np
+import fetch, lexicon
 
 def getURL(url):
     """
-    return: raw text from URL as a string
+    return: raw text from URL as a string (over a pooled
+            keep-alive connection, see fetch.py)
     params:
             url: string | url to retrieve data from
     """
-    return urllib2.urlopen(url).read()
+    return fetch.getURL(url)
 
 
 def isWord(word):
     """
     return: True if word is an english word, False otherwise
+            (a lookup in the precomputed wordnet lexicon, see lexicon.py)
     params:
             word: string | word to check
     """
-    if nltk.corpus.wordnet.synsets( word ):
-        return True
-    else: return False
+    return lexicon.isWord(word)
 
 
 def isPlural(word1, word2):
@@ -89,6 +89,7 @@ def rankedBigrams(words):
     params:
             words: list[string] | list of words
     """
+    import nltk
     bam     = nltk.collocations.BigramAssocMeasures()
     bigrams = nltk.collocations.BigramCollocationFinder.from_words(words)
     return bigrams.score_ngrams(bam.likelihood_ratio)
@@ -100,35 +101,89 @@ def rankedTrigrams(words):
     params:
             words: list[string] | list of words
     """
+    import nltk
     tam      = nltk.collocations.TrigramAssocMeasures()
     trigrams = nltk.collocations.TrigramCollocationFinder.from_words(words)
     return trigrams.score_ngrams(tam.likelihood_ratio)
 
 
-def getBigrams(words, num=100):
+def collocations(words, num=100, minFreq=2):
     """
-    return: list[tuple(string, string)]
+    Find the top bigram collocations of a list of words: bigrams seen
+    at least minFreq times, without stopwords or words shorter than 3
+    letters, ranked by likelihood ratio (same ranking as nltk's
+    Text.collocations, ties broken alphabetically)
+    
+    return: list[tuple(string, int)] | top bigrams as ('word1 word2', count),
+                                       count as in getNgrams(words, N=2)
     params:
-          words: list[string] | list of words as strings
-            num: int | number of bigrams to return (default=100)
+            words: list[string] | list of words as strings
+              num: int | number of bigrams to return (default=100)
+          minFreq: int | minimum bigram frequency (default=2)
     """
-    from StringIO import StringIO
+    if len(words) < 2: return []
     
-    # create nltk.text object
-    text = nltk.Text(words)
+    # map words to integer ids
+    ids, vocab = {}, []
+    tokens = np.empty(len(words), dtype=np.int64)
+    for i, w in enumerate(words):
+        if w not in ids:
+            ids[w] = len(vocab)
+            vocab.append(w)
+        tokens[i] = ids[w]
     
-    # redirect stdout to StringIO()
-    actual_stdout = sys.stdout
-    sys.stdout = StringIO()
+    # unigram and bigram counts (a bigram is w1*V + w2)
+    V = len(vocab)
+    wordCounts = np.bincount(tokens, minlength=V)
+    pairs, pairCounts = np.unique(tokens[:-1]*V + tokens[1:], return_counts=True)
     
-    # get the collocations (bigrams)
-    text.collocations(num=num)
+    return rankCollocations(vocab, wordCounts, pairs // V, pairs % V, pairCounts,
+                            last=(ids[words[-2]], ids[words[-1]]), num=num, minFreq=minFreq)
+
+
+def rankCollocations(vocab, wordCounts, w1, w2, pairCounts, last=None, num=100,
+                     minFreq=2, ok=None):
+    """
+    Rank counted bigrams by likelihood ratio (see collocations)
     
-    # redirect stdout back to original
-    sys.stdout = actual_stdout
+    return: list[tuple(string, int)] | top bigrams as ('word1 word2', count)
+    params:
+            vocab: list[string] | words by id
+       wordCounts: numpy.ndarray | count of each word id
+           w1, w2: numpy.ndarray | word ids of each bigram
+       pairCounts: numpy.ndarray | count of each bigram
+             last: tuple(int, int) | ids of the final bigram (left out of the counts)
+              num: int | number of bigrams to return (default=100)
+          minFreq: int | minimum bigram frequency (default=2)
+               ok: numpy.ndarray | bool, word id passes the word filter
+                                   (computed from vocab if not given)
+    """
+    # frequency and word filters
+    if ok is None:
+        stopwords = lexicon.getStopwords()
+        ok = np.array([len(w) >= 3 and w.lower() not in stopwords for w in vocab], dtype=bool)
+    keep = (pairCounts >= minFreq) & ok[w1] & ok[w2]
+    w1, w2, pairCounts = w1[keep], w2[keep], pairCounts[keep]
+    if not len(pairCounts): return []
     
-    # process the bigrams a little bit
-    bigrams = [c[0]+' '+c[1] for c in text._collocations]
+    # likelihood ratio from the contingency table of every bigram
+    # (Manning and Schutze 5.3.4, same arithmetic as nltk)
+    n_xx = float(wordCounts.sum())
+    n_ii = pairCounts.astype(float)
+    n_oi = wordCounts[w2] - n_ii
+    n_io = wordCounts[w1] - n_ii
+    n_oo = n_xx - n_ii - n_oi - n_io
+    total = n_ii + n_oi + n_io + n_oo
+    score = 0.0
+    for obs, row, col in [(n_ii, n_io, n_oi), (n_oi, n_oo, n_ii),
+                          (n_io, n_ii, n_oo), (n_oo, n_oi, n_io)]:
+        expected = (obs + row) * (obs + col) / total
+        score = score + obs * np.log(obs / (expected + 1e-20) + 1e-20)
+    score = 2 * score
     
-    return bigrams
-
+    # top num by score, then alphabetically
+    best = heapq.nsmallest(num, zip((-score).tolist(), w1.tolist(), w2.tolist(), pairCounts.tolist()),
+                           key=lambda (s, i, j, c): (s, vocab[i], vocab[j]))
+    
+    # query counts leave out the final bigram (see getNgrams)
+    return [(vocab[i]+' '+vocab[j], c - ((i, j) == last)) for s, i, j, c in best]